@@ -10,11 +10,16 @@ import csv
 import datetime
 import json
 import logging
+import os
+import Queue
+import threading
 import time
 import urllib
 import urllib2
 import sys
 
+import task_results_cache
+
 
 class Error(Exception):
   pass
@@ -67,6 +72,24 @@ try:
       raise DownloadError()
     else:
       return response_body
+
+  def MakeHttpRequestWithHeaders(url, method='GET', headers={}, body=None,
+                                 timeout=25):
+    """Makes HTTP request and returns (read response, response headers).
+
+    Raises DownloadError on non-200 response.
+    """
+    try:
+      response = urlfetch.fetch(
+          url, payload=body, method=method, headers=headers, deadline=timeout)
+    except (urlfetch.DeadlineExceededError, urlfetch.DownloadError,
+            apiproxy_errors.DeadlineExceededError), e:
+      logging.warning('Got urlfetch error:\n%s', e)
+      raise DownloadError()
+    if 200 != response.status_code:
+      logging.warning('Got non-200 HTTP code: %s', response.status_code)
+      raise DownloadError()
+    return (response.content, response.headers)
 except ImportError:
   def MakeHttpRequest(url, method='GET', headers={}, body=None, timeout=15*60):
     """Makes HTTP request and returns read response.
@@ -80,6 +103,19 @@ except ImportError:
     response_body = response.read()
     return response_body
 
+  def MakeHttpRequestWithHeaders(url, method='GET', headers={}, body=None,
+                                 timeout=15*60):
+    """Makes HTTP request and returns (read response, response headers).
+
+    Raises urllib2.HTTPError on non-200 response.
+    """
+    request = urllib2.Request(url, body, headers)
+    request.get_method = lambda: method
+
+    response = urllib2.urlopen(request, timeout=timeout)
+    response_body = response.read()
+    return (response_body, response.info())
+
 
 class UTF8Recoder:
   """
@@ -161,6 +197,198 @@ def WriteTaskResultsAfterDate(after_date, limit=1000):
   return 0
 
 
+TASK_RESULT_HEADERS = [
+    'task_id',
+    'executor',
+    'assigned_worker',
+    'assigned_time',
+    'completed_time',
+    'exit_code',
+    'stderr_url',
+    'stdout_url',
+    'stderr_blobkey',
+    'stdout_blobkey',
+]
+
+
+# Tasks scanned per export page request.
+EXPORT_PAGE_SIZE = 5000
+# Attempts at downloading one export page before giving up on a partition.
+MAX_PAGE_ATTEMPTS = 5
+# Records the progress of each partition in an export's output directory.
+CHECKPOINT_FILENAME = task_results_cache.EXPORT_CHECKPOINT_FILENAME
+
+
+def MakeTaskResultsExportUrl(after_date, before_date, limit, cursor=None):
+  url = '%s/api/task_results/export/after_date/%d' % (BASE_URL, after_date)
+  params = [('format', 'csv'),
+            ('before_date', int(before_date)),
+            ('limit', int(limit))]
+  if cursor is not None:
+    params.append(('cursor', cursor))
+  return url + '?' + urllib.urlencode(params)
+
+
+def DownloadTaskResultsExportPage(after_date, before_date, limit, cursor=None):
+  """Downloads one page of CSV task results, retrying with backoff.
+
+  Returns:
+    (csv_rows, next_cursor) where csv_rows has no header line and
+    next_cursor is None once the time range is exhausted.
+
+  Raises:
+    The last download error after MAX_PAGE_ATTEMPTS failures.
+  """
+  url = MakeTaskResultsExportUrl(after_date, before_date, limit, cursor)
+  for attempt in xrange(MAX_PAGE_ATTEMPTS):
+    try:
+      logging.info('Fetching from url: %s', url)
+      (body, headers) = MakeHttpRequestWithHeaders(url)
+      break
+    except Exception, e:
+      if attempt + 1 == MAX_PAGE_ATTEMPTS:
+        raise
+      logging.warning('Failed fetching %s: %s. Retrying.', url, e)
+      time.sleep(2 ** attempt)
+  header_end = body.find('\n')
+  if header_end < 0:
+    return ('', None)
+  return (body[header_end + 1:], headers.get('X-Next-Cursor', None))
+
+
+class ExportCheckpoint(object):
+  """Thread-safe record of how far each export partition has gotten.
+
+  Stored as JSON mapping partition name to the cursor to resume from, the
+  number of bytes of its shard file known to be complete, and whether it
+  is done.
+  """
+
+  def __init__(self, path):
+    self.path_ = path
+    self.lock_ = threading.Lock()
+    self.partitions_ = {}
+    if os.path.exists(path):
+      with open(path, 'r') as checkpoint_file:
+        self.partitions_ = json.load(checkpoint_file)
+
+  def Get(self, name):
+    with self.lock_:
+      return self.partitions_.get(
+          name, {'cursor': None, 'offset': 0, 'done': False})
+
+  def Set(self, name, cursor, offset, done):
+    with self.lock_:
+      self.partitions_[name] = {'cursor': cursor,
+                                'offset': offset,
+                                'done': done}
+      # Write then rename so an interrupted write keeps the old checkpoint.
+      tmp_path = self.path_ + '.tmp'
+      with open(tmp_path, 'w') as checkpoint_file:
+        json.dump(self.partitions_, checkpoint_file, indent=2)
+        checkpoint_file.flush()
+        os.fsync(checkpoint_file.fileno())
+      os.rename(tmp_path, self.path_)
+
+
+class ExportPartition(object):
+  """Task results completed in (after_date, before_date], in one shard file."""
+
+  def __init__(self, after_date, before_date, output_dir):
+    self.after_date = after_date
+    self.before_date = before_date
+    self.name = 'task_results_%d_%d' % (after_date, before_date)
+    self.path = os.path.join(output_dir, self.name + '.csv')
+
+  def Export(self, checkpoint):
+    """Appends this partition's results to its shard, resuming if possible."""
+    state = checkpoint.Get(self.name)
+    if state['done']:
+      logging.info('%s already exported.', self.name)
+      return
+    cursor = state['cursor']
+    mode = 'r+b' if os.path.exists(self.path) else 'wb'
+    with open(self.path, mode) as shard:
+      # Drop any page written after the last checkpoint.
+      shard.seek(state['offset'])
+      shard.truncate()
+      if state['offset'] == 0:
+        shard.write(','.join(TASK_RESULT_HEADERS) + '\r\n')
+      while True:
+        (rows, cursor) = DownloadTaskResultsExportPage(
+            self.after_date, self.before_date, EXPORT_PAGE_SIZE, cursor)
+        shard.write(rows)
+        shard.flush()
+        os.fsync(shard.fileno())
+        checkpoint.Set(self.name, cursor, shard.tell(), cursor is None)
+        if cursor is None:
+          logging.info('%s exported.', self.name)
+          return
+
+
+def MakeExportPartitions(after_date, before_date, num_partitions, output_dir):
+  """Splits (after_date, before_date] into num_partitions time ranges."""
+  span = before_date - after_date
+  bounds = [after_date + span * i // num_partitions
+            for i in xrange(num_partitions)] + [before_date]
+  return [ExportPartition(bounds[i], bounds[i + 1], output_dir)
+          for i in xrange(num_partitions) if bounds[i] < bounds[i + 1]]
+
+
+def ExportTaskResults(after_date, before_date, output_dir,
+                      num_partitions=None, num_threads=8):
+  """Exports task results into one CSV shard per time partition.
+
+  Partitions are downloaded in parallel. Progress is checkpointed after
+  every page, so rerunning with the same arguments resumes an interrupted
+  export.
+
+  Returns:
+    0 if every partition was exported, 1 otherwise.
+  """
+  if not os.path.isdir(output_dir):
+    os.makedirs(output_dir)
+  if num_partitions is None:
+    # Default to one partition per day.
+    num_partitions = max(1, (before_date - after_date + 86399) // 86400)
+  partitions = MakeExportPartitions(after_date, before_date, num_partitions,
+                                    output_dir)
+  checkpoint = ExportCheckpoint(os.path.join(output_dir, CHECKPOINT_FILENAME))
+
+  pending = Queue.Queue()
+  for partition in partitions:
+    pending.put(partition)
+  failed = []
+
+  def ExportPending():
+    while True:
+      try:
+        partition = pending.get_nowait()
+      except Queue.Empty:
+        return
+      try:
+        partition.Export(checkpoint)
+      except Exception, e:
+        logging.exception(e)
+        logging.error('Export of %s failed. Rerun to resume it.',
+                      partition.name)
+        failed.append(partition.name)
+
+  threads = [threading.Thread(target=ExportPending)
+             for _ in xrange(min(num_threads, len(partitions)))]
+  for thread in threads:
+    thread.start()
+  for thread in threads:
+    thread.join()
+
+  if failed:
+    logging.error('%d of %d partitions failed.', len(failed), len(partitions))
+    return 1
+  logging.info('All %d partitions written to %s.', len(partitions),
+               output_dir)
+  return 0
+
+
 class DeviceStat(object):
   def __init__(self, device_name):
     self.device_name = device_name
@@ -220,7 +448,12 @@ Writes data in CSV format to STDOUT.
 
 Valid commands are:
  task_results [after_date]
+ export_task_results [after_date] [before_date] [output_dir] [partitions] [threads]
+   (writes CSV shards to output_dir instead; rerun to resume)
  process_task_results [csv_filename]
+ cache_task_results [cache_dir] [csv_filename_or_dir]...
+   (appends rows not yet cached to a local columnar store)
+ aggregate_task_results [cache_dir] [device|worker|exit_code|window] [window_seconds]
  timestamp [year] [month] [day] [hour] [minute] [second]
  help (prints this message)
 ''')
@@ -237,9 +470,39 @@ def main(argv):
     after_date = argv.pop(0)
     after_date = urllib.quote(after_date)
     return WriteTaskResultsAfterDate(after_date, limit=1000)
+  if command == 'export_task_results':
+    after_date = int(argv.pop(0))
+    before_date = int(argv.pop(0))
+    output_dir = argv.pop(0)
+    num_partitions = None
+    if argv:
+      num_partitions = int(argv.pop(0))
+    num_threads = 8
+    if argv:
+      num_threads = int(argv.pop(0))
+    return ExportTaskResults(after_date, before_date, output_dir,
+                             num_partitions, num_threads)
   if command == 'process_task_results':
     filename = argv.pop(0)
     return ProcessAggregateStatsFromTaskResultsCsvFile(filename)
+  if command == 'cache_task_results':
+    cache = task_results_cache.TaskResultsCache(argv.pop(0))
+    added = 0
+    for path in argv:
+      added += cache.IngestPath(path)
+    logging.info('Cached %d new rows, %d total.', added, cache.rows)
+    return 0
+  if command == 'aggregate_task_results':
+    cache = task_results_cache.TaskResultsCache(argv.pop(0))
+    group_by = argv.pop(0)
+    window_seconds = 86400
+    if argv:
+      window_seconds = int(argv.pop(0))
+    group_stats = task_results_cache.Aggregate(cache, group_by,
+                                               window_seconds)
+    for line in task_results_cache.FormatGroupStats(group_by, group_stats):
+      print line
+    return 0
   if command == 'timestamp':
     year = int(argv.pop(0))
     month = int(argv.pop(0))
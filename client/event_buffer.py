@@ -0,0 +1,146 @@
+#!/usr/bin/python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Buffers a worker's Events and sends them to MrTaskman in batches.
+
+Events are kept in memory until max_events of them are buffered or the
+oldest is max_seconds old, then sent with a single events.batch request.
+Events keep the time they were added at. A failed send keeps the events
+for a later flush, up to MAX_BUFFERED_EVENTS of them. MrTaskman stores a
+batch all or nothing, so a rejected batch is split in halves and resent
+until only the invalid Events are dropped.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import logging
+import time
+import urllib2
+
+
+DEFAULT_MAX_EVENTS = 50
+DEFAULT_MAX_SECONDS = 30
+
+# Most Events sent in a single request, as MrTaskman stores them in one put.
+MAX_EVENTS_PER_REQUEST = 500
+
+# Most Events kept while MrTaskman is unreachable. Oldest are dropped first.
+MAX_BUFFERED_EVENTS = 5000
+
+
+class EventBuffer(object):
+  """Buffers Events of a single worker."""
+
+  def __init__(self, api, worker_name, max_events=DEFAULT_MAX_EVENTS,
+               max_seconds=DEFAULT_MAX_SECONDS, clock=time.time):
+    self.api_ = api
+    self.worker_name_ = worker_name
+    self.max_events_ = max_events
+    self.max_seconds_ = max_seconds
+    self.clock_ = clock
+    self.events_ = []
+    # After a failed send, when to next try one.
+    self.retry_time_ = None
+
+  def Add(self, event_type, event_severity, event_name, event_info=None,
+          task_id=None, task_info=None):
+    """Buffers an Event, flushing the buffer if it is due."""
+    event = {
+      'kind': 'mrtaskman#event',
+      'worker_name': self.worker_name_,
+      'event_type': event_type,
+      'event_severity': event_severity,
+      'event_name': event_name,
+      'created': self.clock_(),
+    }
+    if event_info is not None:
+      event['event_info'] = event_info
+    if task_id is not None:
+      event['task_id'] = task_id
+    if task_info is not None:
+      event['task_info'] = task_info
+    self.events_.append(event)
+    if len(self.events_) > MAX_BUFFERED_EVENTS:
+      logging.warning('Dropping %d buffered events.',
+                      len(self.events_) - MAX_BUFFERED_EVENTS)
+      del self.events_[:-MAX_BUFFERED_EVENTS]
+    self.MaybeFlush()
+
+  def IsFlushDue(self):
+    """Returns True iff buffered Events are due to be sent."""
+    if not self.events_:
+      return False
+    now = self.clock_()
+    if self.retry_time_ is not None and now < self.retry_time_:
+      return False
+    return (len(self.events_) >= self.max_events_ or
+            now - self.events_[0]['created'] >= self.max_seconds_)
+
+  def MaybeFlush(self):
+    """Flushes if buffered Events are due to be sent.
+
+    Returns:
+      True if nothing is left to send, False otherwise.
+    """
+    if self.IsFlushDue():
+      return self.Flush()
+    return not self.events_
+
+  def Flush(self):
+    """Sends all buffered Events.
+
+    Events MrTaskman rejects as invalid are dropped. Events which could not
+    be sent for any other reason are kept, and not retried for max_seconds.
+
+    Returns:
+      True if all Events were sent or dropped, False otherwise.
+    """
+    while self.events_:
+      try:
+        self._SendBatch(min(len(self.events_), MAX_EVENTS_PER_REQUEST))
+      except urllib2.HTTPError, e:
+        logging.warning('CreateEvents HTTPError code %d\n%s',
+                        e.code, e.read())
+        self.retry_time_ = self.clock_() + self.max_seconds_
+        return False
+      except urllib2.URLError, e:
+        logging.info('Got URLError trying to send events to MrTaskman: %s', e)
+        self.retry_time_ = self.clock_() + self.max_seconds_
+        return False
+    self.retry_time_ = None
+    return True
+
+  def _SendBatch(self, size):
+    """Sends the first size buffered Events, removing them once sent.
+
+    A rejected batch is bisected to drop only the Events MrTaskman rejects.
+
+    Raises:
+      urllib2.HTTPError or urllib2.URLError if Events could not be sent for
+      another reason. Events sent before are removed all the same.
+    """
+    try:
+      self.api_.CreateEvents(self.events_[:size])
+    except urllib2.HTTPError, e:
+      if not 400 <= e.code < 500:
+        raise
+      if size == 1:
+        logging.warning('Dropping event rejected with %d: %s\n%r',
+                        e.code, e.read(), self.events_[0])
+        del self.events_[0]
+        return
+      half = size / 2
+      self._SendBatch(half)
+      self._SendBatch(size - half)
+      return
+    del self.events_[:size]
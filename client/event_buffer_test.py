@@ -0,0 +1,112 @@
+#!/usr/bin/python
+"""Tests of event_buffer."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import StringIO
+import unittest
+import urllib2
+
+from client import event_buffer
+
+
+class FakeApi(object):
+  def __init__(self):
+    self.batches = []
+    self.error = None
+
+  def CreateEvents(self, event_list):
+    if self.error:
+      raise self.error
+    for event in event_list:
+      if event['event_name'] == 'invalid':
+        raise MakeHttpError(400)
+    self.batches.append(list(event_list))
+    return {'kind': 'mrtaskman#event_batch_response',
+            'ids': range(len(event_list))}
+
+
+class FakeClock(object):
+  def __init__(self):
+    self.now = 1000.0
+
+  def __call__(self):
+    return self.now
+
+
+def MakeHttpError(code):
+  return urllib2.HTTPError('http://mrtaskman/events/batch', code, 'Error',
+                           {}, StringIO.StringIO('error'))
+
+
+class EventBufferTest(unittest.TestCase):
+  def setUp(self):
+    self.api = FakeApi()
+    self.clock = FakeClock()
+    self.buffer = event_buffer.EventBuffer(
+        self.api, 'worker', max_events=3, max_seconds=30, clock=self.clock)
+
+  def AddOffline(self):
+    self.buffer.Add('OFFLINE', 'WARNING', 'Device offline')
+
+  def testFlushesOnSize(self):
+    self.AddOffline()
+    self.AddOffline()
+    self.assertEqual([], self.api.batches)
+    self.AddOffline()
+    self.assertEqual(1, len(self.api.batches))
+    self.assertEqual(3, len(self.api.batches[0]))
+    self.assertEqual('worker', self.api.batches[0][0]['worker_name'])
+    self.assertEqual(1000.0, self.api.batches[0][0]['created'])
+
+  def testFlushesOnAge(self):
+    self.AddOffline()
+    self.clock.now += 29
+    self.assertFalse(self.buffer.MaybeFlush())
+    self.assertEqual([], self.api.batches)
+    self.clock.now += 1
+    self.assertTrue(self.buffer.MaybeFlush())
+    self.assertEqual(1, len(self.api.batches))
+
+  def testKeepsEventsUntilReachable(self):
+    self.api.error = urllib2.URLError('unreachable')
+    for _ in xrange(3):
+      self.AddOffline()
+    self.assertEqual([], self.api.batches)
+
+    # Not retried until max_seconds after the failure.
+    self.api.error = None
+    self.AddOffline()
+    self.assertEqual([], self.api.batches)
+    self.clock.now += 30
+    self.assertTrue(self.buffer.MaybeFlush())
+    self.assertEqual(4, len(self.api.batches[0]))
+
+  def testDropsRejectedEvents(self):
+    self.api.error = MakeHttpError(400)
+    self.AddOffline()
+    self.assertTrue(self.buffer.Flush())
+    self.api.error = None
+    self.assertTrue(self.buffer.Flush())
+    self.assertEqual([], self.api.batches)
+
+  def testDropsOnlyRejectedEventsOfBatch(self):
+    self.AddOffline()
+    self.buffer.Add('OFFLINE', 'WARNING', 'invalid')
+    self.AddOffline()
+    sent = [event['event_name'] for batch in self.api.batches
+            for event in batch]
+    self.assertEqual(['Device offline', 'Device offline'], sent)
+    self.assertTrue(self.buffer.MaybeFlush())
+
+  def testKeepsEventsOnServerError(self):
+    self.api.error = MakeHttpError(500)
+    self.AddOffline()
+    self.assertFalse(self.buffer.Flush())
+    self.api.error = None
+    self.assertTrue(self.buffer.Flush())
+    self.assertEqual(1, len(self.api.batches[0]))
+
+
+if __name__ == '__main__':
+  unittest.main()
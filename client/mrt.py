@@ -383,10 +383,14 @@ def Event(argv):
 
 
 def Events(argv):
+  worker_name = None
+  if argv:
+    worker_name = argv.pop(0)
+
   api = mrtaskman_api.MrTaskmanApi()
 
   try:
-    events = api.ListEvents()
+    events = api.ListEvents(worker_name=worker_name)
     json.dump(events, sys.stdout, indent=2)
     print ''
     return 0
@@ -485,7 +489,7 @@ COMMANDS:
   createevent {event}\tCreate an new Event with given event file.
   deleteevent {event_id}\tDelete Event with given id.
   event {event_id}\t\tPrint Event with given id.
-  events\t\t\tList most recent MrTaskman Events.""")
+  events [worker_name]\tList recent Events, optionally of one worker.""")
 
 
 # Mapping of command text to command function.
@@ -118,11 +118,14 @@ class MrTaskmanApi(object):
     response_body = response_body.decode('utf-8')
     return json.loads(response_body, 'utf-8')
 
-  def ListTasksByName(self, task_name):
+  def ListTasksByName(self, task_name, cursor=None, limit=None, fields=None):
     """Performs a tasks.listByName on given task_name.
 
     Args:
       task_name: Name of task as str
+      cursor: next_cursor from a previous TaskList to continue from, or None
+      limit: Maximum number of tasks to return as int, or None
+      fields: List of task fields to return as str, or None for all
 
     Returns:
       TaskList object.
@@ -133,6 +136,7 @@ class MrTaskmanApi(object):
     assert isinstance(task_name, basestring)
 
     path = '/tasks/list_by_name?name=%s' % urllib.quote(task_name)
+    path += self.MakeTaskListQuery(cursor, limit, fields, separator='&')
     url = FLAGS.mrtaskman_address + path
     body = None
     headers = {'Accept': 'application/json'}
@@ -142,6 +146,84 @@ class MrTaskmanApi(object):
     response_body = response_body.decode('utf-8')
     return json.loads(response_body, 'utf-8')
 
+  def IterTasksByName(self, task_name, limit=None, fields=None):
+    """Yields every task with given task_name, fetching a page at a time.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    return self.IterTaskList(
+        lambda cursor: self.ListTasksByName(task_name, cursor, limit, fields))
+
+  def ListTasksByExecutor(self, executor_capability, cursor=None, limit=None,
+                          fields=None):
+    """Performs an executors.list on given executor_capability.
+
+    Lists tasks waiting to be assigned to given executor.
+
+    Args:
+      executor_capability: Name of executor capability as str.
+      cursor: next_cursor from a previous TaskList to continue from, or None
+      limit: Maximum number of tasks to return as int, or None
+      fields: List of task fields to return as str, or None for all
+
+    Returns:
+      TaskList object.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    assert isinstance(executor_capability, basestring)
+
+    path = '/executors/%s' % executor_capability
+    path += self.MakeTaskListQuery(cursor, limit, fields)
+    url = FLAGS.mrtaskman_address + path
+    body = None
+    headers = {'Accept': 'application/json'}
+
+    response_body = MakeHttpRequest(
+        url, method='GET', headers=headers, body=body)
+    response_body = response_body.decode('utf-8')
+    return json.loads(response_body, 'utf-8')
+
+  def IterTasksByExecutor(self, executor_capability, limit=None, fields=None):
+    """Yields every task waiting for given executor, a page at a time.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    return self.IterTaskList(
+        lambda cursor: self.ListTasksByExecutor(
+            executor_capability, cursor, limit, fields))
+
+  def IterTaskList(self, list_page):
+    """Yields tasks from successive TaskList pages.
+
+    Args:
+      list_page: Function taking a cursor (or None) and returning a TaskList.
+    """
+    cursor = None
+    while True:
+      task_list = list_page(cursor)
+      for task in task_list.get('tasks', []):
+        yield task
+      cursor = task_list.get('next_cursor', None)
+      if not cursor:
+        return
+
+  def MakeTaskListQuery(self, cursor, limit, fields, separator='?'):
+    """Returns query string for given task list paging parameters."""
+    params = []
+    if cursor:
+      params.append(('cursor', cursor))
+    if limit:
+      params.append(('limit', int(limit)))
+    if fields:
+      params.append(('fields', ','.join(fields)))
+    if not params:
+      return ''
+    return separator + urllib.urlencode(params)
+
   def PeekAtExecutor(self, executor_capability):
     """Performs an executors.peek on given executor_capability.
 
@@ -299,6 +381,8 @@ class MrTaskmanApi(object):
 
     Returns:
       Assigned mrtaskman#task object, or None if no tasks were available.
+      Its result may be sent with SendTaskResult to ['task_complete_url'],
+      which expires in ['task_complete_url_expires_in'] seconds.
 
     Raises:
       urllib2.HTTPError on non-200 response.
@@ -327,7 +411,42 @@ class MrTaskmanApi(object):
     assign_request['worker'] = worker
     assign_request['hostname'] = hostname
     assign_request['capabilities'] = capabilities
+    return self.PutAssignRequest(assign_request)
+
+  def AssignTasks(self, worker, hostname, capabilities, max_tasks):
+    """Makes a request to /tasks/assign to get assigned up to max_tasks.
+
+    Args:
+      worker: Unique name of worker as str
+      hostname: Hostname identifying this machine
+      capabilities: Dict describing capabilities of the worker
+      max_tasks: Most tasks to be assigned as int
 
+    Returns:
+      mrtaskman#task_list object, whose ['tasks'] should be executed in
+      order and their results sent to ['task_results_url'] together with
+      SendTaskResults, or None if no tasks were available.
+      ['task_results_url'] expires in ['task_results_url_expires_in']
+      seconds, after which GetTaskResultsUrl gives a fresh one.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    assert worker
+    assert hostname
+    assert capabilities
+    assert max_tasks > 0
+
+    assign_request = dict()
+    assign_request['kind'] = 'mrtaskman#assign_request'
+    assign_request['worker'] = worker
+    assign_request['hostname'] = hostname
+    assign_request['capabilities'] = capabilities
+    assign_request['max_tasks'] = int(max_tasks)
+    return self.PutAssignRequest(assign_request)
+
+  def PutAssignRequest(self, assign_request):
+    """Sends given mrtaskman#assign_request, returning parsed response."""
     path = '/tasks/assign'
     url = FLAGS.mrtaskman_address + path
     body = json.dumps(assign_request, indent=2).encode('utf-8')
@@ -347,7 +466,8 @@ class MrTaskmanApi(object):
       task_id: Id of task to retrieve complete URL for as int
 
     Returns:
-      TaskCompleteUrl object, which has a ['task_complete_url'] field.
+      TaskCompleteUrl object, which has a ['task_complete_url'] field
+      expiring in ['task_complete_url_expires_in'] seconds.
 
     Raises:
       urllib2.HTTPError on non-200 response.
@@ -361,6 +481,25 @@ class MrTaskmanApi(object):
     response_body = response_body.decode('utf-8')
     return json.loads(response_body, 'utf-8')
 
+  def GetTaskResultsUrl(self):
+    """Retrieves a URL which results of a batch of tasks can be posted to.
+
+    Returns:
+      mrtaskman#task_results_url object, which has a ['task_results_url']
+      field expiring in ['task_results_url_expires_in'] seconds.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    path = '/tasks/results'
+    url = FLAGS.mrtaskman_address + path
+    body = None
+    headers = {'Accept': 'application/json'}
+    response_body = MakeHttpRequest(
+        url, method='GET', headers=headers, body=body)
+    response_body = response_body.decode('utf-8')
+    return json.loads(response_body, 'utf-8')
+
   def SendTaskResult(self, response_url, stdout, stderr, task_result):
     """Submits the results of a task to a MrTaskman-provided response_url.
 
@@ -391,6 +530,43 @@ class MrTaskmanApi(object):
     response_body = MakeHttpRequest(
         response_url, method='POST', headers=headers, body=body)
 
+  def SendTaskResults(self, task_results_url, results):
+    """Submits the results of a batch of tasks together.
+
+    Args:
+      task_results_url: ['task_results_url'] of the batch's mrtaskman#task_list
+      results: List of (stdout, stderr, task_result) per task, where
+               task_result is the task's mrtaskman#task_complete_request
+
+    Returns:
+      mrtaskman#task_results_response object, whose ['results'] give the
+      HTTP status of each task's result.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    assert results
+    fields = []
+    files = []
+    for (stdout, stderr, task_result) in results:
+      task_id = int(task_result['task_id'])
+      fields.append({'name': 'task_result_%d' % task_id,
+                     'Content-Type': 'application/json; charset=utf-8',
+                     'data': json.dumps(task_result, 'utf-8', indent=2)})
+      files.append({'name': 'STDOUT_%d' % task_id,
+                    'filename': 'stdout',
+                    'data': stdout})
+      files.append({'name': 'STDERR_%d' % task_id,
+                    'filename': 'stderr',
+                    'data': stderr})
+    (body, headers) = http_file_upload.EncodeMultipartHttpFormData(
+        {}, fields, files)
+
+    response_body = MakeHttpRequest(
+        task_results_url, method='POST', headers=headers, body=body)
+    response_body = response_body.decode('utf-8')
+    return json.loads(response_body, 'utf-8')
+
   def MakeTaskUrl(self, task_id):
     """Returns the URL to the task given by task_id."""
     return '%s/tasks/%d' % (FLAGS.mrtaskman_address, task_id)
@@ -563,19 +739,73 @@ class MrTaskmanApi(object):
     response_body = response_body.decode('utf-8')
     return json.loads(response_body, 'utf-8')
 
-  def ListEvents(self):
-    """Performs an events.list.
+  def CreateEvents(self, event_list):
+    """Performs an events.batch creating given Event objects together.
 
     Args:
-      None
+      event_list: List of Event objects to create.
+
+    Returns:
+      mrtaskman#event_batch_response object, whose ['ids'] are the ids of
+      created Events in the order given.
+
+    Raises:
+      urllib2.HTTPError on non-200 response.
+    """
+    assert event_list
+
+    path = '/events/batch'
+    url = FLAGS.mrtaskman_address + path
+    body = json.dumps({'kind': 'mrtaskman#event_list',
+                       'event_list': event_list}).encode('utf-8')
+    headers = {'Accept': 'application/json',
+               'Content-Type': 'application/json'}
+    response_body = MakeHttpRequest(
+        url, method='POST', headers=headers, body=body)
+    response_body = response_body.decode('utf-8')
+    return json.loads(response_body, 'utf-8')
+
+  def ListEvents(self, worker_name=None, event_type=None, event_severity=None,
+                 start_time=None, end_time=None, cursor=None, limit=None,
+                 fields=None):
+    """Performs an events.list of Events matching all given filters.
+
+    Args:
+      worker_name: Name of worker as str, or None
+      event_type: One of the Event types as str, or None
+      event_severity: One of the Event severities as str, or None
+      start_time: Earliest creation time as int timestamp, or None
+      end_time: Creation time to list Events before as int timestamp, or None
+      cursor: next_cursor from a previous EventList to continue from, or None
+      limit: Maximum number of events to return as int, or None
+      fields: List of event fields to return as str, or None for all
 
     Returns:
-      List of Event objects.
+      EventList object, newest Event first.
 
     Raises:
       urllib2.HTTPError on non-200 response.
     """
+    params = []
+    if worker_name:
+      params.append(('worker_name', worker_name))
+    if event_type:
+      params.append(('event_type', event_type))
+    if event_severity:
+      params.append(('event_severity', event_severity))
+    if start_time is not None:
+      params.append(('start_time', int(start_time)))
+    if end_time is not None:
+      params.append(('end_time', int(end_time)))
+    if cursor:
+      params.append(('cursor', cursor))
+    if limit:
+      params.append(('limit', int(limit)))
+    if fields:
+      params.append(('fields', ','.join(fields)))
     path = '/events/all'
+    if params:
+      path += '?' + urllib.urlencode(params)
     url = FLAGS.mrtaskman_address + path
     body = None
     headers = {'Accept': 'application/json'}
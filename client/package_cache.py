@@ -70,6 +70,12 @@ def SecondsSinceEpoch():
   return int(datetime.datetime.now().strftime('%s'))
 
 
+def TimedeltaToSeconds(timedelta):
+  """Returns given datetime.timedelta in seconds as float."""
+  return (timedelta.days * 24 * 60 * 60 + timedelta.seconds +
+          float(timedelta.microseconds) / 1000000)
+
+
 class PackageCache(object):
   def __init__(self,
                min_duration_seconds,
@@ -354,7 +360,13 @@ class PackageCache(object):
       package_info: dict containing 'name', 'version', and 'url'.
       directory: path to copy to as str.
       on_cache_miss: Callable accepting
-          (package_name, package_version, directory).
+          (package_name, package_version, directory), optionally returning
+          number of bytes downloaded.
+
+    Returns:
+      Dict with 'cache_hit' as bool, 'wait_seconds' spent waiting on another
+      process's download, 'download_seconds', 'copy_seconds' and, on cache
+      miss, 'bytes' returned by on_cache_miss.
 
     Raises:
       InvalidPackageError on invalid package_info.
@@ -362,6 +374,13 @@ class PackageCache(object):
     ValidatePackageInfo(package_info)
     VerifyDirectoryExists(directory)
 
+    stats = {
+      'cache_hit': False,
+      'wait_seconds': 0.0,
+      'download_seconds': 0.0,
+      'copy_seconds': 0.0,
+    }
+
     found_in_index = False
     is_already_downloading = False
     package_string = MakePackageString(package_info['name'],
@@ -395,11 +414,13 @@ class PackageCache(object):
         self._RemoveFromCopying(package_string)
       finally:
         self._Unlock()
-      logging.info('Copied in %0.3f seconds',
-                   timedelta.seconds +
-                   float(timedelta.microseconds) / 1000000)
+      stats['cache_hit'] = True
+      stats['copy_seconds'] = TimedeltaToSeconds(timedelta)
+      logging.info('Copied in %0.3f seconds', stats['copy_seconds'])
+      return stats
     else:
       if is_already_downloading:
+        start_time = datetime.datetime.now()
         self._Lock()
         try:
           while self._IsAlreadyDownloading(package_string):
@@ -409,8 +430,11 @@ class PackageCache(object):
             self._Lock()
         finally:
           self._Unlock()
+        wait_seconds = TimedeltaToSeconds(datetime.datetime.now() - start_time)
         # Recurse and allow logic above to perform copy, or re-download.
-        return self.CopyToDirectory(package_info, directory, on_cache_miss)
+        stats = self.CopyToDirectory(package_info, directory, on_cache_miss)
+        stats['wait_seconds'] += wait_seconds
+        return stats
       else:
         # TODO(jeff.carollo): This potentially leaves partially-downloaded
         # directories in the cache directory, but not in the .index. Will
@@ -418,14 +442,16 @@ class PackageCache(object):
         logging.info('Cache miss. Downloading to %s', cache_dir)
         os.system('mkdir -p %s' % cache_dir)
         start_time = datetime.datetime.now()
-        on_cache_miss(package_info['name'], package_info['version'], cache_dir)
+        num_bytes = on_cache_miss(package_info['name'],
+                                  package_info['version'], cache_dir)
         timedelta = datetime.datetime.now() - start_time
+        stats['download_seconds'] = TimedeltaToSeconds(timedelta)
+        if num_bytes is not None:
+          stats['bytes'] = num_bytes
 
         logging.info('Download completed in %0.3f seconds. '
                      'Copying from %s to %s',
-                     timedelta.seconds +
-                     float(timedelta.microseconds) / 1000000,
-                     cache_dir, directory)
+                     stats['download_seconds'], cache_dir, directory)
         start_time = datetime.datetime.now()
         self._CopyDirectory(cache_dir, directory)
         timedelta = datetime.datetime.now() - start_time
@@ -435,9 +461,10 @@ class PackageCache(object):
           self._RemoveFromDownloading(package_string)
         finally:
           self._Unlock()
+        stats['copy_seconds'] = TimedeltaToSeconds(timedelta)
         logging.info('Copied into cache in %0.3f seconds',
-                     timedelta.seconds +
-                     float(timedelta.microseconds) / 1000000)
+                     stats['copy_seconds'])
+        return stats
 
   def InvalidatePackageCache(self, package_info):
     """Marks given package as invalid, forcing a redownload on next access.
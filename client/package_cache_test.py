@@ -92,16 +92,29 @@ class PackageCacheTest(unittest.TestCase):
     def MockOnCacheMiss(n, v, p):
       self.assertEqual(name, n)
       self.assertEqual(version, v)
+      return 42
 
     try:
       os.system('mkdir -p %s' % tmp_dir)
-      self.cache.CopyToDirectory(
+      stats = self.cache.CopyToDirectory(
+          {
+            'name': name,
+            'version': version,
+          },
+          tmp_dir,
+          MockOnCacheMiss)
+      self.assertFalse(stats['cache_hit'])
+      self.assertEqual(42, stats['bytes'])
+
+      stats = self.cache.CopyToDirectory(
           {
             'name': name,
             'version': version,
           },
           tmp_dir,
           MockOnCacheMiss)
+      self.assertTrue(stats['cache_hit'])
+      self.assertFalse('bytes' in stats)
     finally:
       os.system('rm -rf %s' % tmp_dir)
 
@@ -60,11 +60,15 @@ def DownloadFileWithTimeout(url, destination, timeout=30*60):
     destination: Local filepath to write to as str.
     timeout: How long to wait before giving up in seconds as float.
 
+  Returns:
+    Number of bytes downloaded as int.
+
   Raises:
     urllib2.HTTPError on HTTP error.
     urllib2.URLError on timeout or other error resolving URL.
   """
   webfile = urllib2.urlopen(url, timeout=timeout)
+  num_bytes = 0
   try:
     # TODO(jeff.carollo): Checksums.
     localfile = open(destination, 'wb')
@@ -74,8 +78,10 @@ def DownloadFileWithTimeout(url, destination, timeout=30*60):
       if not buffer:
         break
       localfile.write(buffer)
+      num_bytes += len(buffer)
   finally:
     localfile.close()
+  return num_bytes
 
 
 def DownloadAndInstallPackage(package_name, package_version, root_dir):
@@ -87,7 +93,7 @@ def DownloadAndInstallPackage(package_name, package_version, root_dir):
     root_dir: Fully-qualified file path to install package under
 
   Returns:
-    None
+    Number of bytes downloaded as int.
 
   Raises:
     urllib2.HTTPError on packages not being available.
@@ -101,8 +107,10 @@ def DownloadAndInstallPackage(package_name, package_version, root_dir):
 
   package_files = package['files']
 
+  num_bytes = 0
   for package_file in package_files:
-    DownloadAndInstallFile(package_file, root_dir)
+    num_bytes += DownloadAndInstallFile(package_file, root_dir)
+  return num_bytes
 
 
 def DownloadAndInstallFile(package_file, root_dir):
@@ -112,7 +120,7 @@ def DownloadAndInstallFile(package_file, root_dir):
     package_file: A mrtaskman#file_info object
 
   Returns:
-    None
+    Number of bytes downloaded as int.
   """
   logging.info('DownloadAndInstallFile %s %s %s',
                package_file['destination'], root_dir,
@@ -129,7 +137,8 @@ def DownloadAndInstallFile(package_file, root_dir):
     pass
 
   # Download the file into the correct place.
-  DownloadFileWithTimeout(package_file['download_url'], file_path)
+  num_bytes = DownloadFileWithTimeout(package_file['download_url'], file_path)
 
   # Set file mode using octal digits.
   os.chmod(file_path, int(package_file['file_mode'], 8))
+  return num_bytes
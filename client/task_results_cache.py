@@ -0,0 +1,358 @@
+#!/usr/bin/python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Local columnar store of exported task results for fast aggregation.
+
+Rows from CSV files written by download_mrt_data are appended to one binary
+file per column, with executor and worker names dictionary-encoded as ints.
+Each CSV file's consumed byte offset is remembered, so re-ingesting a file
+that has grown (such as an export shard) only reads the new rows.
+
+Aggregations run over whole columns, using numpy when it is installed.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import array
+import csv
+import datetime
+import json
+import logging
+import math
+import os
+import time
+
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+
+class Error(Exception):
+  pass
+
+
+class InvalidGroupingError(Error):
+  pass
+
+
+# (column name, array typecode) of each stored column.
+COLUMNS = [
+    ('task_id', 'l'),
+    ('executor', 'i'),
+    ('worker', 'i'),
+    ('assigned_time', 'd'),
+    ('completed_time', 'd'),
+    ('exit_code', 'i'),
+]
+
+# Positions of columns in download_mrt_data's task result CSV rows.
+CSV_TASK_ID = 0
+CSV_EXECUTOR = 1
+CSV_WORKER = 2
+CSV_ASSIGNED_TIME = 3
+CSV_COMPLETED_TIME = 4
+CSV_EXIT_CODE = 5
+
+# Exit codes counted as a success and a failure, as in DeviceStat.
+SUCCESS_EXIT_CODE = 0
+FAILURE_EXIT_CODE = 212
+
+GROUPINGS = ['device', 'worker', 'exit_code', 'window']
+
+META_FILENAME = 'meta.json'
+
+# Checkpoint download_mrt_data's export_task_results writes next to shards.
+EXPORT_CHECKPOINT_FILENAME = 'checkpoint.json'
+
+
+def ParseTime(value):
+  """Converts a CSV datetime str to seconds since the epoch, or NaN."""
+  if not value:
+    return float('nan')
+  (seconds, _, micros) = value.partition('.')
+  parsed = datetime.datetime.strptime(seconds, '%Y-%m-%d %H:%M:%S')
+  return time.mktime(parsed.timetuple()) + float('0.' + (micros or '0'))
+
+
+class TaskResultsCache(object):
+  """An append-only columnar store of task results on disk."""
+
+  def __init__(self, root_path):
+    self.root_path = root_path
+    if not os.path.isdir(root_path):
+      os.makedirs(root_path)
+    self.meta_path_ = os.path.join(root_path, META_FILENAME)
+    meta = {'rows': 0, 'sources': {}, 'executors': [], 'workers': []}
+    if os.path.exists(self.meta_path_):
+      with open(self.meta_path_, 'r') as meta_file:
+        meta = json.load(meta_file)
+    self.rows = meta['rows']
+    self.sources_ = meta['sources']
+    self.executors = meta['executors']
+    self.workers = meta['workers']
+    self.executor_ids_ = dict((name, i) for (i, name)
+                              in enumerate(self.executors))
+    self.worker_ids_ = dict((name, i) for (i, name)
+                            in enumerate(self.workers))
+    self._TruncateColumns()
+
+  def _ColumnPath(self, name):
+    return os.path.join(self.root_path, name + '.col')
+
+  def _TruncateColumns(self):
+    """Drops column data appended after the last saved meta.
+
+    Ingesting appends to columns before saving meta, so an interrupted
+    ingest leaves rows past meta['rows'] which the next ingest would
+    otherwise misalign.
+    """
+    for (name, typecode) in COLUMNS:
+      path = self._ColumnPath(name)
+      if not os.path.exists(path):
+        continue
+      size = self.rows * array.array(typecode).itemsize
+      if os.path.getsize(path) > size:
+        logging.warning('Dropping partially ingested rows of %s.', name)
+        with open(path, 'r+b') as column_file:
+          column_file.truncate(size)
+
+  def _SaveMeta(self):
+    tmp_path = self.meta_path_ + '.tmp'
+    with open(tmp_path, 'w') as meta_file:
+      json.dump({'rows': self.rows,
+                 'sources': self.sources_,
+                 'executors': self.executors,
+                 'workers': self.workers}, meta_file)
+    os.rename(tmp_path, self.meta_path_)
+
+  def _GetId(self, ids, names, name):
+    """Returns the int id of name, assigning a new one if needed."""
+    name_id = ids.get(name, None)
+    if name_id is None:
+      name_id = len(names)
+      names.append(name)
+      ids[name] = name_id
+    return name_id
+
+  def IngestCsvFile(self, csv_path, max_offset=None):
+    """Appends rows of csv_path not ingested before.
+
+    Only complete lines are consumed, so a file still being written can be
+    ingested again later.
+
+    Args:
+      csv_path: Path of CSV file as str.
+      max_offset: Bytes of the file known to be final, or None for all.
+
+    Returns:
+      Number of rows added as int.
+    """
+    csv_path = os.path.abspath(csv_path)
+    offset = self.sources_.get(csv_path, 0)
+    if max_offset is not None and max_offset <= offset:
+      return 0
+    with open(csv_path, 'rb') as csv_file:
+      csv_file.seek(offset)
+      if max_offset is None:
+        data = csv_file.read()
+      else:
+        data = csv_file.read(max_offset - offset)
+    end = data.rfind('\n') + 1
+    if not end:
+      return 0
+    lines = data[:end].splitlines()
+    if offset == 0 and lines:
+      # Skip the header line.
+      lines = lines[1:]
+
+    columns = dict((name, array.array(typecode))
+                   for (name, typecode) in COLUMNS)
+    for row in csv.reader(lines):
+      if len(row) <= CSV_EXIT_CODE:
+        continue
+      columns['task_id'].append(int(row[CSV_TASK_ID]))
+      columns['executor'].append(self._GetId(
+          self.executor_ids_, self.executors,
+          row[CSV_EXECUTOR].decode('utf-8')))
+      columns['worker'].append(self._GetId(
+          self.worker_ids_, self.workers, row[CSV_WORKER].decode('utf-8')))
+      columns['assigned_time'].append(ParseTime(row[CSV_ASSIGNED_TIME]))
+      columns['completed_time'].append(ParseTime(row[CSV_COMPLETED_TIME]))
+      columns['exit_code'].append(int(row[CSV_EXIT_CODE]))
+
+    added = len(columns['task_id'])
+    for (name, _) in COLUMNS:
+      with open(self._ColumnPath(name), 'ab') as column_file:
+        columns[name].tofile(column_file)
+    self.rows += added
+    self.sources_[csv_path] = offset + end
+    self._SaveMeta()
+    logging.info('Ingested %d rows from %s.', added, csv_path)
+    return added
+
+  def IngestPath(self, path):
+    """Ingests a CSV file, or every .csv file in a directory.
+
+    Shards of an export directory are only ingested up to the offsets its
+    checkpoint records as complete. A resumed export truncates a shard back
+    to its checkpointed offset, so rows past it may yet be rewritten.
+    """
+    if not os.path.isdir(path):
+      return self.IngestCsvFile(path)
+    checkpoint = None
+    checkpoint_path = os.path.join(path, EXPORT_CHECKPOINT_FILENAME)
+    if os.path.exists(checkpoint_path):
+      with open(checkpoint_path, 'r') as checkpoint_file:
+        checkpoint = json.load(checkpoint_file)
+    added = 0
+    for filename in sorted(os.listdir(path)):
+      if not filename.endswith('.csv'):
+        continue
+      max_offset = None
+      if checkpoint is not None:
+        state = checkpoint.get(filename[:-len('.csv')], {'offset': 0})
+        max_offset = state['offset']
+      added += self.IngestCsvFile(os.path.join(path, filename), max_offset)
+    return added
+
+  def LoadColumn(self, name):
+    """Returns the named column as a numpy array, or array.array."""
+    typecode = dict(COLUMNS)[name]
+    path = self._ColumnPath(name)
+    if numpy is not None:
+      if not os.path.exists(path):
+        return numpy.zeros(0, dtype=typecode)
+      return numpy.fromfile(path, dtype=typecode, count=self.rows)
+    column = array.array(typecode)
+    if os.path.exists(path):
+      with open(path, 'rb') as column_file:
+        column.fromfile(column_file, self.rows)
+    return column
+
+
+class GroupStat(object):
+  """Run counts of one aggregation group."""
+
+  def __init__(self, label, runs, successes, failures):
+    self.label = label
+    self.runs = runs
+    self.successes = successes
+    self.failures = failures
+
+  def GetTotalRuns(self):
+    """Returns runs which either succeeded or failed."""
+    return self.successes + self.failures
+
+
+def CountByKey(keys, exit_codes):
+  """Counts runs, successes and failures per distinct key.
+
+  Returns:
+    List of (key, runs, successes, failures) sorted by key.
+  """
+  if numpy is not None:
+    keys = numpy.asarray(keys)
+    exit_codes = numpy.asarray(exit_codes)
+    (unique_keys, inverse) = numpy.unique(keys, return_inverse=True)
+    runs = numpy.bincount(inverse, minlength=len(unique_keys))
+    successes = numpy.bincount(
+        inverse, weights=(exit_codes == SUCCESS_EXIT_CODE),
+        minlength=len(unique_keys))
+    failures = numpy.bincount(
+        inverse, weights=(exit_codes == FAILURE_EXIT_CODE),
+        minlength=len(unique_keys))
+    return [(unique_keys[i].item(), int(runs[i]), int(successes[i]),
+             int(failures[i])) for i in xrange(len(unique_keys))]
+
+  counts = {}
+  for (key, exit_code) in zip(keys, exit_codes):
+    count = counts.setdefault(key, [0, 0, 0])
+    count[0] += 1
+    if exit_code == SUCCESS_EXIT_CODE:
+      count[1] += 1
+    elif exit_code == FAILURE_EXIT_CODE:
+      count[2] += 1
+  return [(key, count[0], count[1], count[2])
+          for (key, count) in sorted(counts.iteritems())]
+
+
+def GetWindowKeys(completed_times, exit_codes, window_seconds):
+  """Returns (window start times, exit codes) of rows with a completed time."""
+  if numpy is not None:
+    completed_times = numpy.asarray(completed_times)
+    known = numpy.isfinite(completed_times)
+    windows = (numpy.floor(completed_times[known] / window_seconds) *
+               window_seconds).astype('l')
+    return (windows, numpy.asarray(exit_codes)[known])
+  windows = []
+  known_exit_codes = []
+  for (completed_time, exit_code) in zip(completed_times, exit_codes):
+    if math.isnan(completed_time):
+      continue
+    windows.append(int(completed_time // window_seconds * window_seconds))
+    known_exit_codes.append(exit_code)
+  return (windows, known_exit_codes)
+
+
+def Aggregate(cache, group_by, window_seconds=86400):
+  """Aggregates run outcomes of all cached rows.
+
+  Args:
+    cache: TaskResultsCache to aggregate.
+    group_by: One of GROUPINGS.
+    window_seconds: Width of time windows when grouping by 'window'.
+
+  Returns:
+    List of GroupStat sorted by group.
+
+  Raises:
+    InvalidGroupingError if group_by is not one of GROUPINGS.
+  """
+  exit_codes = cache.LoadColumn('exit_code')
+  if group_by == 'device':
+    counts = CountByKey(cache.LoadColumn('executor'), exit_codes)
+    return [GroupStat(cache.executors[key], runs, successes, failures)
+            for (key, runs, successes, failures) in counts]
+  if group_by == 'worker':
+    counts = CountByKey(cache.LoadColumn('worker'), exit_codes)
+    return [GroupStat(cache.workers[key], runs, successes, failures)
+            for (key, runs, successes, failures) in counts]
+  if group_by == 'exit_code':
+    counts = CountByKey(exit_codes, exit_codes)
+  elif group_by == 'window':
+    (windows, exit_codes) = GetWindowKeys(
+        cache.LoadColumn('completed_time'), exit_codes, window_seconds)
+    counts = CountByKey(windows, exit_codes)
+  else:
+    raise InvalidGroupingError('group_by must be one of %s.' %
+                               ', '.join(GROUPINGS))
+  return [GroupStat(unicode(key), runs, successes, failures)
+          for (key, runs, successes, failures) in counts]
+
+
+def FormatGroupStats(group_by, group_stats):
+  """Returns aggregated GroupStats as CSV lines."""
+  lines = ['%s,runs,total_runs,successes,failures,success_pct,failure_pct' %
+           group_by]
+  for stat in group_stats:
+    total_runs = stat.GetTotalRuns()
+    success_pct = 0.0
+    failure_pct = 0.0
+    if total_runs:
+      success_pct = float(stat.successes) / float(total_runs) * 100
+      failure_pct = float(stat.failures) / float(total_runs) * 100
+    lines.append('%s,%d,%d,%d,%d,%s,%s' % (
+        stat.label.encode('utf-8'), stat.runs, total_runs, stat.successes,
+        stat.failures, success_pct, failure_pct))
+  return lines
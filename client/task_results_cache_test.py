@@ -0,0 +1,103 @@
+#!/usr/bin/python
+"""Tests of task_results_cache."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import json
+import os
+import unittest
+
+from client import task_results_cache
+
+HEADER = ('task_id,executor,worker,assigned_time,completed_time,exit_code,'
+          'stdout,stderr\n')
+
+
+class TaskResultsCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.path = '/tmp/task_results_cache_test'
+    os.system('rm -rf %s' % self.path)
+    os.system('mkdir -p %s' % self.path)
+    self.csv_path = os.path.join(self.path, 'results.csv')
+    self.cache_path = os.path.join(self.path, 'cache')
+
+  def tearDown(self):
+    os.system('rm -rf %s' % self.path)
+
+  def WriteCsv(self, text):
+    csv_file = open(self.csv_path, 'a')
+    csv_file.write(text)
+    csv_file.close()
+
+  def testIngestOnlyReadsNewRows(self):
+    self.WriteCsv(HEADER +
+                  '1,iphone,w1,2012-05-01 10:00:00,2012-05-01 10:01:00,0,,\n'
+                  '2,iphone,w2,2012-05-01 11:00:00,2012-05-01 11:01:00.5,'
+                  '212,,\n'
+                  '3,ipad,w1,2012-05-02 10:00:00,,0')
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    # The unterminated last line is left for a later ingest.
+    self.assertEqual(2, cache.IngestCsvFile(self.csv_path))
+    self.assertEqual(0, cache.IngestCsvFile(self.csv_path))
+
+    self.WriteCsv(',,\n')
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    self.assertEqual(1, cache.IngestCsvFile(self.csv_path))
+    self.assertEqual(3, cache.rows)
+    self.assertEqual([1, 2, 3], list(cache.LoadColumn('task_id')))
+
+  def testDropsRowsPastSavedMeta(self):
+    self.WriteCsv(HEADER +
+                  '1,iphone,w1,2012-05-01 10:00:00,2012-05-01 10:01:00,0,,\n')
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    cache.IngestCsvFile(self.csv_path)
+    # Simulates an ingest interrupted before saving meta.
+    column_file = open(cache._ColumnPath('task_id'), 'ab')
+    column_file.write(open(cache._ColumnPath('task_id'), 'rb').read())
+    column_file.close()
+
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    self.assertEqual([1], list(cache.LoadColumn('task_id')))
+
+  def testIngestPathStopsAtCheckpointedOffset(self):
+    first = '1,iphone,w1,2012-05-01 10:00:00,2012-05-01 10:01:00,0,,\n'
+    self.WriteCsv(HEADER + first +
+                  '2,iphone,w2,2012-05-01 11:00:00,2012-05-01 11:01:00,0,,\n')
+    checkpoint_file = open(os.path.join(
+        self.path, task_results_cache.EXPORT_CHECKPOINT_FILENAME), 'w')
+    json.dump({'results': {'cursor': None, 'offset': len(HEADER + first),
+                           'done': False}}, checkpoint_file)
+    checkpoint_file.close()
+
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    self.assertEqual(1, cache.IngestPath(self.path))
+    self.assertEqual(0, cache.IngestPath(self.path))
+    self.assertEqual([1], list(cache.LoadColumn('task_id')))
+
+  def testAggregate(self):
+    self.WriteCsv(HEADER +
+                  '1,iphone,w1,2012-05-01 10:00:00,2012-05-01 10:01:00,0,,\n'
+                  '2,iphone,w2,2012-05-01 11:00:00,2012-05-01 11:01:00,'
+                  '212,,\n'
+                  '3,ipad,w1,2012-05-02 10:00:00,,-99,,\n')
+    cache = task_results_cache.TaskResultsCache(self.cache_path)
+    cache.IngestCsvFile(self.csv_path)
+
+    stats = task_results_cache.Aggregate(cache, 'device')
+    self.assertEqual([(u'iphone', 2, 1, 1), (u'ipad', 1, 0, 0)],
+                     [(s.label, s.runs, s.successes, s.failures)
+                      for s in stats])
+
+    stats = task_results_cache.Aggregate(cache, 'exit_code')
+    self.assertEqual([u'-99', u'0', u'212'], [s.label for s in stats])
+
+    # Rows without a completed time are not in any window.
+    stats = task_results_cache.Aggregate(cache, 'window', 3600)
+    self.assertEqual([1, 1], [s.runs for s in stats])
+
+    self.assertRaises(task_results_cache.InvalidGroupingError,
+                      task_results_cache.Aggregate, cache, 'nothing')
+
+
+if __name__ == '__main__':
+  unittest.main()
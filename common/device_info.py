@@ -272,6 +272,24 @@ def GetCapabilities():
   return capabilities
 
 
+# Device info keys sent as attributes for matching requirement expressions.
+ATTRIBUTE_KEYS = ['device_name', 'device_type', 'os_name', 'os_version',
+                  'provider']
+
+
+def GetAttributes():
+  """Returns dict of attributes of device from environment."""
+  attributes = {}
+  if DEVICE_SN:
+    attributes['device_sn'] = DEVICE_SN
+    device_info = GetDeviceInfo()
+    if device_info:
+      for key in ATTRIBUTE_KEYS:
+        if device_info.get(key, None):
+          attributes[key] = device_info[key]
+  return attributes
+
+
 try:
   import subprocess
 
@@ -7,13 +7,22 @@ from google.appengine.ext import db
 from google.appengine.ext.db import datastore_query
 from google.appengine.ext.webapp import blobstore_handlers
 
+from models import archives
+from models import latency
+from models import rollups
 from models import tasks
+from models import timeseries
+from models import timings
 from util import device_info
+from util import model_to_dict
+from util import paging
+from util import middleware
 
 import csv
 import datetime
 import json
 import StringIO
+import time
 import urllib
 import webapp2
 
@@ -46,6 +55,28 @@ def GetExecutor(executor):
   return executor
 
 
+class ExecutorNames(object):
+  """Memoizes GetExecutor for the executors seen in one request."""
+
+  def __init__(self):
+    self.names_ = {}
+
+  def Get(self, executor):
+    name = self.names_.get(executor, None)
+    if name is None:
+      name = Utf8Encode(GetExecutor(executor))
+      self.names_[executor] = name
+    return name
+
+
+def GetBlobKeyStr(task_result, prop):
+  """Returns the key of a TaskResult blob as str without loading it."""
+  blob_key = prop.get_value_for_datastore(task_result)
+  if blob_key is None:
+    return ''
+  return str(blob_key)
+
+
 TASK_RESULT_KEYS = [
     'task_id',
     'executor',
@@ -58,33 +89,211 @@ TASK_RESULT_KEYS = [
     'stderr_blobkey',
     'stdout_blobkey',
 ]
-def FormatTaskResultsAsCsv(task_list):
-  """Specially format Tasks with TaskResults for CSV transmission."""
-  data_csv = StringIO.StringIO()
-  data_writer = csv.DictWriter(data_csv, TASK_RESULT_KEYS)
+def MakeTaskResultRow(task, executor_names):
+  """Returns a dict of TASK_RESULT_KEYS for given Task, or None to skip it.
+
+  The Task's result must already be loaded.
+  """
+  if task.executor_requirements[0] == 'macos':
+    return None
+  result = task.result
+  if result is None:
+    return None
+  row = {}
+  row['task_id'] = task.key().id()
+  row['executor'] = executor_names.Get(task.executor_requirements[0])
+  row['assigned_worker'] = Utf8Encode(task.assigned_worker or u'')
+  row['assigned_time'] = task.assigned_time
+  row['completed_time'] = task.completed_time
+  row['exit_code'] = result.exit_code
+  row['stderr_url'] = Utf8Encode(result.stderr_download_url or u'')
+  row['stdout_url'] = Utf8Encode(result.stdout_download_url or u'')
+  row['stderr_blobkey'] = GetBlobKeyStr(result, tasks.TaskResult.stderr)
+  row['stdout_blobkey'] = GetBlobKeyStr(result, tasks.TaskResult.stdout)
+  return row
+
+
+def MakeArchivedResultRow(record, executor_names):
+  """Returns a dict of TASK_RESULT_KEYS for an archived Task record.
+
+  Returns None to skip the record, as MakeTaskResultRow does.
+  """
+  if record['executor_requirements'][0] == 'macos':
+    return None
+  result = record['result']
+  if result is None:
+    return None
+  row = {}
+  row['task_id'] = record['task_id']
+  row['executor'] = executor_names.Get(record['executor_requirements'][0])
+  row['assigned_worker'] = Utf8Encode(record['assigned_worker'] or u'')
+  row['assigned_time'] = archives.ParseTime(record['assigned_time'])
+  row['completed_time'] = archives.ParseTime(record['completed_time'])
+  row['exit_code'] = result['exit_code']
+  row['stderr_url'] = Utf8Encode(result['stderr_url'] or u'')
+  row['stdout_url'] = Utf8Encode(result['stdout_url'] or u'')
+  row['stderr_blobkey'] = result['stderr_blobkey'] or ''
+  row['stdout_blobkey'] = result['stdout_blobkey'] or ''
+  return row
+
+
+class CsvRowWriter(object):
+  """Writes task result rows as CSV, starting with a header line."""
+  content_type = 'text/csv'
+
+  def __init__(self, out, header=True):
+    self.writer_ = csv.DictWriter(out, TASK_RESULT_KEYS)
+    if header:
+      self.writer_.writerow(dict(zip(TASK_RESULT_KEYS, TASK_RESULT_KEYS)))
+
+  def Write(self, row):
+    self.writer_.writerow(row)
+
+
+class NdjsonRowWriter(object):
+  """Writes task result rows as one JSON object per line."""
+  content_type = 'application/x-ndjson'
+
+  def __init__(self, out):
+    self.out_ = out
+
+  def Write(self, row):
+    for key in ('assigned_time', 'completed_time'):
+      if row[key] is not None:
+        row[key] = row[key].isoformat()
+    json.dump(row, self.out_, separators=(',', ':'))
+    self.out_.write('\n')
+
+
+EXPORT_ROW_WRITERS = {
+    'csv': CsvRowWriter,
+    'ndjson': NdjsonRowWriter,
+}
+
+# Largest number of Tasks a single export request may scan.
+MAX_EXPORT_LIMIT = 20000
+# Tasks fetched, and TaskResults batch-loaded, per datastore round trip.
+EXPORT_BATCH_SIZE = 500
+
+
+def WriteResultRows(row_writer, after_date, before_date, limit, cursor):
+  """Writes rows of up to limit Tasks completed after after_date.
+
+  Tasks moved to a TaskArchive are written from the archive first, then
+  Tasks still in the datastore. Archived Tasks which have not been deleted
+  yet are skipped in the datastore so no Task is written twice.
+
+  Returns:
+    (next_cursor, more) where next_cursor resumes after the last Task read,
+    or is the given cursor if none was, and more is True iff limit Tasks
+    were read.
+
+  Raises:
+    ValueError if cursor names no readable archive.
+  """
+  executor_names = ExecutorNames()
+  next_cursor = cursor
+  count = 0
+  horizon = archives.GetArchivedHorizon()
+  if (horizon is not None and after_date < horizon and
+      (cursor is None or archives.IsArchiveCursor(cursor))):
+    archive_before_date = horizon
+    if before_date is not None:
+      archive_before_date = min(before_date, horizon)
+    for (record, next_cursor) in archives.IterArchivedRecords(
+        after_date, archive_before_date, cursor):
+      row = MakeArchivedResultRow(record, executor_names)
+      if row is not None:
+        row_writer.Write(row)
+      count += 1
+      if count >= limit:
+        return (next_cursor, True)
+    cursor = None
+  if archives.IsArchiveCursor(cursor):
+    raise ValueError('No archive before %s: %s' % (horizon, cursor))
+
+  for (task_list, next_cursor) in tasks.IterResultsAfterDate(
+      after_date, limit - count, cursor, EXPORT_BATCH_SIZE, before_date):
+    count += len(task_list)
+    for task in task_list:
+      if horizon is not None and task.completed_time <= horizon:
+        continue
+      row = MakeTaskResultRow(task, executor_names)
+      if row is not None:
+        row_writer.Write(row)
+  return (next_cursor, count >= limit)
 
-  for task in task_list:
-    if task.executor_requirements[0] == 'macos':
-      continue
-    executor = GetExecutor(task.executor_requirements[0])
-    encoded_d = {}
-    encoded_d['task_id'] = task.key().id()
-    encoded_d['executor'] = Utf8Encode(executor)
-    encoded_d['assigned_worker'] = Utf8Encode(task.assigned_worker)
-    encoded_d['assigned_time'] = task.assigned_time
-    encoded_d['completed_time'] = task.completed_time
-    encoded_d['exit_code'] = task.result.exit_code
-    encoded_d['stderr_url'] = Utf8Encode(task.result.stderr_download_url)
-    encoded_d['stdout_url'] = Utf8Encode(task.result.stdout_download_url)
-    encoded_d['stderr_blobkey'] = Utf8Encode(task.result.stderr.key().__str__())
-    encoded_d['stdout_blobkey'] = Utf8Encode(task.result.stdout.key().__str__())
-    data_writer.writerow(encoded_d)
-  data_csv.flush()
-  return data_csv
+
+class ExportResultsAfterDate(webapp2.RequestHandler):
+  """Writes task results newer than after_date as CSV or NDJSON rows.
+
+  Rows are written as each batch of Tasks is fetched rather than built up
+  into a single document. The cursor to continue from is returned in the
+  X-Next-Cursor header, which is absent once all results were written.
+  An optional before_date param bounds the export to Tasks completed no
+  later than that integer timestamp. Archived Tasks are included, see
+  WriteResultRows.
+  """
+  def get(self, after_date):
+    cursor = self.request.get('cursor', None) or None
+    output_format = self.request.get('format', 'csv')
+    try:
+      limit = int(self.request.get('limit', MAX_EXPORT_LIMIT))
+      assert 0 < limit <= MAX_EXPORT_LIMIT
+    except (ValueError, AssertionError):
+      self.response.out.write(
+          'limit must be an integer from 1 to %d.' % MAX_EXPORT_LIMIT)
+      self.response.set_status(400)
+      return
+
+    row_writer_class = EXPORT_ROW_WRITERS.get(output_format, None)
+    if row_writer_class is None:
+      self.response.out.write(
+          'format must be one of %s.' % ', '.join(EXPORT_ROW_WRITERS))
+      self.response.set_status(400)
+      return
+
+    try:
+      after_date = int(urllib.unquote(after_date))
+    except:
+      self.response.out.write('after_date must be an integer timestamp.')
+      self.response.set_status(400)
+      return
+
+    after_date = datetime.datetime.fromtimestamp(after_date)
+
+    before_date = self.request.get('before_date', None)
+    if before_date:
+      try:
+        before_date = datetime.datetime.fromtimestamp(int(before_date))
+      except ValueError:
+        self.response.out.write('before_date must be an integer timestamp.')
+        self.response.set_status(400)
+        return
+    else:
+      before_date = None
+
+    self.response.headers['Content-Type'] = row_writer_class.content_type
+    row_writer = row_writer_class(self.response.out)
+    try:
+      (next_cursor, more) = WriteResultRows(
+          row_writer, after_date, before_date, limit, cursor)
+    except ValueError, e:
+      self.response.clear()
+      self.response.out.write('Invalid cursor: %s' % e)
+      self.response.set_status(400)
+      return
+
+    if next_cursor is not None and more:
+      self.response.headers['X-Next-Cursor'] = str(next_cursor)
 
 
 class ListResultsAfterDate(webapp2.RequestHandler):
-  """Retrieves a special-formatted list of results newer than after_date."""
+  """Retrieves a special-formatted list of results newer than after_date.
+
+  Archived Tasks are included, see WriteResultRows. Once all results were
+  listed, next_cursor is the cursor requested.
+  """
   def get(self, after_date):
     cursor = self.request.get('cursor', None)
     limit = int(self.request.get('limit', 1000))
@@ -98,12 +307,16 @@ class ListResultsAfterDate(webapp2.RequestHandler):
 
     after_date = datetime.datetime.fromtimestamp(after_date)
 
-    # Fetch data.
-    (results, next_cursor) = tasks.GetResultsAfterDate(
-        after_date, limit, cursor)
-
-    # Format data as CSV.
-    data_csv = FormatTaskResultsAsCsv(results)
+    # Fetch data and format it as CSV.
+    data_csv = StringIO.StringIO()
+    try:
+      (next_cursor, _) = WriteResultRows(
+          CsvRowWriter(data_csv, header=False), after_date, None, limit,
+          cursor or None)
+    except ValueError, e:
+      self.response.out.write('Invalid cursor: %s' % e)
+      self.response.set_status(400)
+      return
 
     # Create response.
     response = {}
@@ -117,6 +330,213 @@ class ListResultsAfterDate(webapp2.RequestHandler):
     self.response.headers['Content-Type'] = 'application/json'
 
 
+# Most rollups returned in one response.
+MAX_ROLLUP_LIMIT = 1000
+
+
+class ListRollups(webapp2.RequestHandler):
+  """Lists hourly or daily ResultRollups starting in a time range.
+
+  Takes integer timestamp start and end params, an optional device param
+  holding a device serial number, and limit and cursor params for paging.
+  """
+  MODEL_CLASS = rollups.ResultRollup
+  OWNER_PARAM = 'device'
+  KIND = 'mrtaskman#rollup_list'
+
+  def AddNames(self, rollup_dicts):
+    executor_names = ExecutorNames()
+    for rollup_dict in rollup_dicts:
+      rollup_dict['device_name'] = executor_names.Get(
+          rollup_dict['device_serial_number'])
+
+  def get(self, period):
+    try:
+      start_time = datetime.datetime.fromtimestamp(
+          int(self.request.get('start')))
+      end_time = datetime.datetime.fromtimestamp(
+          int(self.request.get('end')))
+    except ValueError:
+      self.response.out.write('start and end must be integer timestamps.')
+      self.response.set_status(400)
+      return
+    try:
+      limit = int(self.request.get('limit', MAX_ROLLUP_LIMIT))
+      assert 0 < limit <= MAX_ROLLUP_LIMIT
+    except (ValueError, AssertionError):
+      self.response.out.write(
+          'limit must be an integer from 1 to %d.' % MAX_ROLLUP_LIMIT)
+      self.response.set_status(400)
+      return
+    cursor = self.request.get('cursor', None) or None
+    owner = self.request.get(self.OWNER_PARAM, None) or None
+
+    query = rollups.MakeRollupQuery(period, start_time, end_time, owner,
+                                    self.MODEL_CLASS)
+    (rollup_list, next_cursor) = paging.FetchPage(query, limit, cursor)
+
+    rollup_dicts = model_to_dict.ModelsToDicts(rollup_list)
+    for rollup_dict in rollup_dicts:
+      rollup_dict.pop('folded_records', None)
+    self.AddNames(rollup_dicts)
+
+    response = {}
+    response['kind'] = self.KIND
+    response['rollups'] = rollup_dicts
+    response['next_cursor'] = next_cursor
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+
+
+class ListTimeoutRollups(ListRollups):
+  """Lists hourly or daily TimeoutRollups starting in a time range.
+
+  Takes the same params as ListRollups, with a worker param in place of
+  device.
+  """
+  MODEL_CLASS = rollups.TimeoutRollup
+  OWNER_PARAM = 'worker'
+  KIND = 'mrtaskman#timeout_rollup_list'
+
+  def AddNames(self, rollup_dicts):
+    pass
+
+
+def MakeSeriesDict(name, resolution, points):
+  """Returns a mrtaskman#time_series dict of GetSeries points."""
+  series = {}
+  series['kind'] = 'mrtaskman#time_series'
+  series['name'] = name
+  series['resolution'] = resolution
+  series['points'] = [{'time': int(time.mktime(start_time.timetuple())),
+                       'value': value}
+                      for (start_time, value) in points]
+  return series
+
+
+class ListTimeSeries(webapp2.RequestHandler):
+  """Lists minute, hour or day history of counters.
+
+  Takes one or more name params holding counter names, such as
+  Tasks.Completed, and integer timestamp start and end params.
+  """
+  def get(self, resolution):
+    names = self.request.get_all('name')
+    if not names:
+      self.response.out.write('At least one name is required.')
+      self.response.set_status(400)
+      return
+    try:
+      start_time = datetime.datetime.fromtimestamp(
+          int(self.request.get('start')))
+      end_time = datetime.datetime.fromtimestamp(
+          int(self.request.get('end')))
+    except ValueError:
+      self.response.out.write('start and end must be integer timestamps.')
+      self.response.set_status(400)
+      return
+
+    series_list = []
+    try:
+      for name in names:
+        points = timeseries.GetSeries(name, resolution, start_time, end_time)
+        series_list.append(MakeSeriesDict(name, resolution, points))
+    except timeseries.TooManyPointsError, e:
+      self.response.out.write(str(e))
+      self.response.set_status(400)
+      return
+
+    response = {}
+    response['kind'] = 'mrtaskman#time_series_list'
+    response['series'] = series_list
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+
+
+# Longest window latency histograms may cover.
+MAX_LATENCY_HOURS = 90 * 24
+
+
+class GetLatencies(webapp2.RequestHandler):
+  """Gets queue and run latency histograms of an executor capability.
+
+  Takes an optional integer hours param, the window to cover ending now.
+  """
+  def get(self, capability):
+    capability = urllib.unquote(capability)
+    try:
+      hours = int(self.request.get('hours', 24))
+      assert 0 < hours <= MAX_LATENCY_HOURS
+    except (ValueError, AssertionError):
+      self.response.out.write(
+          'hours must be an integer from 1 to %d.' % MAX_LATENCY_HOURS)
+      self.response.set_status(400)
+      return
+
+    response = {}
+    response['kind'] = 'mrtaskman#latencies'
+    response['capability'] = capability
+    response['hours'] = hours
+    histograms = latency.GetLatencies(capability, hours)
+    response['queue'] = histograms[latency.QUEUE]
+    response['run'] = histograms[latency.RUN]
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+
+
+# Longest window worker and package timings may cover.
+MAX_TIMINGS_HOURS = 90 * 24
+
+
+class TimingsHandler(webapp2.RequestHandler):
+  """Base class of handlers taking an optional integer hours param."""
+
+  def GetHours(self):
+    """Returns hours param, or None after writing a 400 response."""
+    try:
+      hours = int(self.request.get('hours', 24))
+      assert 0 < hours <= MAX_TIMINGS_HOURS
+    except (ValueError, AssertionError):
+      self.response.out.write(
+          'hours must be an integer from 1 to %d.' % MAX_TIMINGS_HOURS)
+      self.response.set_status(400)
+      return None
+    return hours
+
+
+class GetWorkerTimings(TimingsHandler):
+  """Gets mean phase timings, upload and package cache stats of a worker."""
+  def get(self, worker):
+    worker = urllib.unquote(worker)
+    hours = self.GetHours()
+    if hours is None:
+      return
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(timings.GetWorkerTimings(worker, hours),
+                           self.response.out)
+
+
+class GetPackageTimings(TimingsHandler):
+  """Gets mean install and download timings of a package version."""
+  def get(self, package_name, package_version):
+    package_name = urllib.unquote(package_name)
+    hours = self.GetHours()
+    if hours is None:
+      return
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(
+        timings.GetPackageTimings(package_name, int(package_version), hours),
+        self.response.out)
+
+
 app = webapp2.WSGIApplication([
   ('/api/task_results/list_after_date/after_date/(.+)', ListResultsAfterDate),
+  ('/api/task_results/export/after_date/(.+)', ExportResultsAfterDate),
+  ('/api/rollups/(hour|day)', ListRollups),
+  ('/api/rollups/timeouts/(hour|day)', ListTimeoutRollups),
+  ('/api/timeseries/(minute|hour|day)', ListTimeSeries),
+  ('/api/latency/(.+)', GetLatencies),
+  ('/api/timings/workers/(.+)', GetWorkerTimings),
+  ('/api/timings/packages/([^/]+)/(\d+)', GetPackageTimings),
   ], debug=True)
+app = middleware.WrapApp(app)
@@ -22,9 +22,12 @@ import webapp2
 
 from google.appengine.ext.webapp import template
 
+from models import latency
 from models import tasks
 from models import packages
+from models import timeseries
 from util import model_to_dict
+from util import middleware
 
 # Old Devices IDs.
 #  'SH0CJLV00997',
@@ -54,11 +57,40 @@ DEVICES = [
 ]
 
 
+# Counters whose hourly history is shown on the dashboard.
+TREND_COUNTERS = [
+  'Tasks.Scheduled',
+  'Tasks.Assigned',
+  'Tasks.Completed',
+  'Tasks.Completed.Failed',
+  'Tasks.Completed.TimedOut',
+]
+TREND_HOURS = 24
+
+
+def GetHourlyTrends(now=None):
+  """Returns list of [hour, value per TREND_COUNTERS], latest hour first."""
+  now = now or datetime.datetime.now()
+  end_time = now + datetime.timedelta(hours=1)
+  start_time = end_time - datetime.timedelta(hours=TREND_HOURS)
+  series = [timeseries.GetSeries(name, timeseries.HOUR, start_time, end_time)
+            for name in TREND_COUNTERS]
+  rows = []
+  for points in zip(*series):
+    row = [points[0][0].strftime('%Y-%m-%d %H:00')]
+    row.extend([value for (_, value) in points])
+    rows.append(row)
+  rows.reverse()
+  return rows
+
+
 class DashHandler(webapp2.RequestHandler):
   """A dashboard for MrTaskman."""
   def get(self):
     args = {
-      'devices': DEVICES
+      'devices': DEVICES,
+      'trend_counters': TREND_COUNTERS,
+      'trends': GetHourlyTrends(),
     }
     self.response.out.write(template.render('handlers/dash.html', args))
 
@@ -86,8 +118,12 @@ class ExecutorDashHandler(webapp2.RequestHandler):
     if current:
       current.id = current.key().id()
 
+    latencies = latency.GetLatencies(executor)
+
     args = {
       'executor': executor,
+      'queue_latency': latencies[latency.QUEUE],
+      'run_latency': latencies[latency.RUN],
       'pass_rate': pass_rate,
       'backlog': len(backlog),
       'oldest': oldest,
@@ -103,3 +139,4 @@ app = webapp2.WSGIApplication([
     ('/dash', DashHandler),
     ('/dash/(.+)', ExecutorDashHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
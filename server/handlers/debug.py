@@ -0,0 +1,43 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Handlers for debugging a running MrTaskman."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import webapp2
+
+from util import model_to_dict
+from util import tracing
+
+
+# Most recent traces listed in full.
+MAX_RECENT_TRACES = 20
+
+
+class TracesHandler(webapp2.RequestHandler):
+  """Summarizes recently sampled request traces."""
+  def get(self):
+    traces = tracing.GetRecentTraces()
+    response = tracing.AggregateTraces(traces)
+    response['kind'] = 'mrtaskman#trace_summary'
+    response['traces'] = len(traces)
+    response['sample_rate'] = tracing.SAMPLE_RATE
+    response['recent'] = traces[:MAX_RECENT_TRACES]
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
+
+
+app = webapp2.WSGIApplication([
+    ('/debug/traces', TracesHandler),
+    ], debug=True)
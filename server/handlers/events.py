@@ -14,6 +14,8 @@
 
 __author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
 
+import cgi
+import datetime
 import json
 import logging
 import urllib
@@ -21,6 +23,8 @@ import webapp2
 
 from models import events
 from util import model_to_dict
+from util import middleware
+from third_party.prodeagle import counter
 
 
 class EventsError(Exception):
@@ -28,6 +32,65 @@ class EventsError(Exception):
     Exception.__init__(self, message)
 
 
+# Default and largest page an event listing request may ask for.
+DEFAULT_EVENT_LIST_LIMIT = 100
+MAX_EVENT_LIST_LIMIT = 1000
+
+
+def ParseTimestampParam(request, name):
+  """Returns datetime of an integer timestamp param, or None if absent.
+
+  Raises:
+    ValueError if the param is not an integer.
+  """
+  value = request.get(name, None)
+  if not value:
+    return None
+  try:
+    return datetime.datetime.fromtimestamp(int(value))
+  except ValueError:
+    raise ValueError('%s must be an integer timestamp.' % name)
+
+
+def ParseEventListParams(request):
+  """Parses filter, paging and fields params of an event listing request.
+
+  Returns:
+    (filters, limit, cursor, fields) where filters is a dict of
+    events.ListEvents keyword arguments, and fields is a list of Event
+    property names or None for all properties.
+
+  Raises:
+    ValueError if any of the params is invalid.
+  """
+  filters = {}
+  for name in ('worker_name', 'event_type', 'event_severity'):
+    value = request.get(name, None)
+    if value:
+      filters[name] = value
+  filters['start_time'] = ParseTimestampParam(request, 'start_time')
+  filters['end_time'] = ParseTimestampParam(request, 'end_time')
+
+  try:
+    limit = int(request.get('limit', DEFAULT_EVENT_LIST_LIMIT))
+    assert 0 < limit <= MAX_EVENT_LIST_LIMIT
+  except (ValueError, AssertionError):
+    raise ValueError(
+        'limit must be between 1 and %d.' % MAX_EVENT_LIST_LIMIT)
+  cursor = request.get('cursor', None) or None
+
+  fields = request.get('fields', None)
+  if fields:
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    valid_fields = events.Event.properties().keys() + ['id']
+    for field in fields:
+      if field not in valid_fields:
+        raise ValueError('Invalid field: %s' % field)
+  else:
+    fields = None
+  return (filters, limit, cursor, fields)
+
+
 class EventsHandler(webapp2.RequestHandler):
   """Handles requests for Events."""
 
@@ -44,39 +107,42 @@ class EventsHandler(webapp2.RequestHandler):
     return
 
   def GetAllEvents(self):
-    """Convenience HTML form for testing."""
+    """Lists one page of Events, filtered by optional params.
+
+    Takes worker_name, event_type, event_severity, start_time and end_time
+    (integer timestamps) filters, limit and cursor params for paging, and a
+    comma separated fields param selecting Event properties to return.
+    """
     accept_type = self.GetAcceptTypeHtmlOrJson()
-    self.response.headers['Content-Type'] = accept_type
 
-    event_list = events.GetEventList()
+    try:
+      (filters, limit, cursor, fields) = ParseEventListParams(self.request)
+      (event_list, next_cursor) = events.ListEvents(
+          limit=limit, cursor=cursor, **filters)
+    except (ValueError, events.ClientEventError), e:
+      self.response.out.write('%s\n' % e)
+      self.response.set_status(400)
+      return
+
+    response = dict()
+    response['kind'] = 'mrtaskman#event_list'
+    response['event_list'] = model_to_dict.ModelsToDicts(event_list, fields)
+    response['next_cursor'] = next_cursor
 
+    self.response.headers['Content-Type'] = accept_type
     if 'html' in accept_type:
       # TODO(jeff.carollo): Extract out to Django templates.
       self.response.out.write(
           """
           <html><head><title>Events</title></head><body>
-          <pre><code>%s</code><pre>
+          <pre><code>%s</code></pre>
           </body></html>
-          """ % '<br/>'.join([
-              json.dumps(model_to_dict.ModelToDict(event), indent=2)
-              for event in event_list]))
+          """ % cgi.escape(model_to_dict.DumpsJson(response)))
       self.response.out.write('\n')
       return
 
-    if 'json' in accept_type:
-      response = dict()
-      response['kind'] = 'mrtaskman#event_list'
-      response['event_list'] = [
-          model_to_dict.ModelToDict(event) for event in event_list]
-      json.dump(response, self.response.out, indent=2)
-      self.response.out.write('\n')
-      return
-
-    # Should never get here.
-    logging.error('Sending 500 because we could not determine a Content-Type.')
-    self.response.out.write('Accept type not text/html or application/json.')
-    self.response.set_status(500)
-    return
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
 
   def post(self):
     """Creates an Event from a worker."""
@@ -110,7 +176,7 @@ class EventsHandler(webapp2.RequestHandler):
     self.response.headers['Content-Type'] = 'application/json'
     response = model_to_dict.ModelToDict(event)
     response['kind'] = 'mrtaskman#event'
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
 
   def GetAcceptTypeHtmlOrJson(self):
@@ -162,7 +228,7 @@ class EventsHandler(webapp2.RequestHandler):
     response = model_to_dict.ModelToDict(event)
     response['kind'] = 'mrtaskman#event'
     self.response.headers['Content-Type'] = 'application/json'
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
 
   def delete(self, event_id):
@@ -180,7 +246,46 @@ class EventsHandler(webapp2.RequestHandler):
       return
 
 
+class EventsBatchHandler(webapp2.RequestHandler):
+  """Creates a batch of Events from a worker with a single datastore put."""
+
+  def post(self):
+    try:
+      event_list = json.loads(self.request.body.decode('utf-8'), 'utf-8')
+    except ValueError, e:
+      logging.info(e)
+      event_list = None
+
+    if (not isinstance(event_list, dict) or
+        event_list.get('kind', '') != 'mrtaskman#event_list' or
+        not isinstance(event_list.get('event_list', None), list)):
+      self.response.out.write('POST body must contain an EventList entity.')
+      self.response.set_status(400)
+      return
+
+    try:
+      created = events.CreateEvents(event_list['event_list'])
+    except events.ClientEventError, e:
+      self.response.out.write('Error creating events: %s' % e.message)
+      self.response.set_status(400)
+      return
+    except events.ServerEventError, e:
+      self.response.out.write('Error creating events: %s' % e.message)
+      self.response.set_status(500)
+      return
+    counter.incr('Events.Created', len(created))
+
+    response = dict()
+    response['kind'] = 'mrtaskman#event_batch_response'
+    response['ids'] = [event.key().id() for event in created]
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
+
+
 app = webapp2.WSGIApplication([
+    ('/events/batch', EventsBatchHandler),
     ('/events/([a-z0-9]+)', EventsHandler),
     ('/events', EventsHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -27,6 +27,8 @@ from google.appengine.ext.webapp.util import run_wsgi_app
 
 import webapp2
 
+from util import middleware
+
 
 class PackageFileDownloadHandler(blobstore_handlers.BlobstoreDownloadHandler):
   def get(self, file_key):
@@ -39,3 +41,4 @@ class PackageFileDownloadHandler(blobstore_handlers.BlobstoreDownloadHandler):
 app = webapp2.WSGIApplication([
     ('/packagefiles/(.+)', PackageFileDownloadHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -26,6 +26,7 @@ import webapp2
 
 from models import packages
 from util import model_to_dict
+from util import middleware
 
 
 class PackagesError(Exception):
@@ -76,7 +77,7 @@ class PackagesCreateHandler(webapp2.RequestHandler):
       response = dict()
       response['kind'] = 'mrtaskman#get_upload_url_response'
       response['upload_url'] = upload_url
-      json.dump(response, self.response.out, indent=2)
+      model_to_dict.DumpJson(response, self.response.out)
       self.response.out.write('\n')
       return
 
@@ -146,7 +147,7 @@ class PackagesCreateHandler(webapp2.RequestHandler):
     self.response.headers['Content-Type'] = 'application/json'
     response = model_to_dict.ModelToDict(package)
     response['kind'] = 'mrtaskman#create_package_response'
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
 
   def GetAcceptTypeHtmlOrJson(self):
@@ -254,7 +255,7 @@ class PackagesHandler(webapp2.RequestHandler):
     response['files'] = response_files
 
     self.response.headers['Content-Type'] = 'application/json'
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
 
   def delete(self, package_name, package_version):
@@ -266,3 +267,4 @@ app = webapp2.WSGIApplication([
     ('/packages/create', PackagesCreateHandler),
     ('/packages/([a-zA-Z0-9\-_]+)\.([0-9.]+)', PackagesHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -27,6 +27,8 @@ from google.appengine.ext.webapp.util import run_wsgi_app
 
 import webapp2
 
+from util import middleware
+
 
 class TaskResultFileDownloadHandler(
     blobstore_handlers.BlobstoreDownloadHandler):
@@ -51,3 +53,4 @@ class TaskResultFileDownloadHandler(
 app = webapp2.WSGIApplication([
     ('/taskresultfiles/(.+)', TaskResultFileDownloadHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -24,8 +24,12 @@ import quopri
 import urllib
 import webapp2
 
+from index import bulk_delete
+from models import result_uploads
 from models import tasks
 from util import model_to_dict
+from util import requirements
+from util import middleware
 from third_party.prodeagle import counter
 
 
@@ -74,25 +78,45 @@ class TasksScheduleHandler(webapp2.RequestHandler):
       return
 
     try:
-      executor_requirements = parsed_config['task']['requirements']['executor']
-      assert executor_requirements
+      task_requirements = parsed_config['task']['requirements']
+      requirement_expression = task_requirements.get('expression', None)
+      if requirement_expression is None:
+        executor_requirements = task_requirements['executor']
+      else:
+        executor_requirements = task_requirements.get('executor', [])
+      assert executor_requirements or requirement_expression
       assert isinstance(executor_requirements, list)
       for executor_req in executor_requirements:
         assert isinstance(executor_req, basestring)
     except KeyError, e:
       counter.incr('Tasks.Schedule.400')
       self.response.out.write('Failure parsing config.\n')
-      self.response.out.write('task.requirements.executor is required\n')
+      self.response.out.write(
+          'task.requirements.executor or task.requirements.expression '
+          'is required\n')
       self.response.set_status(400)
       return
     except AssertionError, e:
       counter.incr('Tasks.Schedule.400')
       self.response.out.write('Failure parsing config.\n')
       self.response.out.write(
-          'task.requirements.executor must be a non-empty list of strings.\n')
+          'task.requirements.executor must be a list of strings, non-empty '
+          'unless task.requirements.expression is given.\n')
       self.response.set_status(400)
       return
 
+    if requirement_expression is not None:
+      try:
+        assert isinstance(requirement_expression, basestring)
+        requirements.Parse(requirement_expression)
+      except (AssertionError, requirements.ParseError), e:
+        counter.incr('Tasks.Schedule.400')
+        self.response.out.write('Failure parsing config.\n')
+        self.response.out.write(
+            'task.requirements.expression is invalid: %s\n' % e)
+        self.response.set_status(400)
+        return
+
     priority = parsed_config['task'].get('priority', 0)
     try:
       logging.info('priority is %s', priority)
@@ -106,7 +130,8 @@ class TasksScheduleHandler(webapp2.RequestHandler):
     user = users.GetCurrentUser()
 
     scheduled_task = tasks.Schedule(
-        name, config, user, executor_requirements, priority)
+        name, parsed_config, user, executor_requirements, priority,
+        requirement_expression)
 
     try:
       email = user.email()
@@ -123,68 +148,38 @@ class TasksScheduleHandler(webapp2.RequestHandler):
     response = dict()
     response['id'] = int(task_id)
     response['kind'] = 'mrtaskman#taskid'
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
     counter.incr('Tasks.Schedule.200')
 
 
-class TasksHandler(webapp2.RequestHandler):
-  def get(self, task_id):
-    """Retrieves a single task given by task_id."""
-    counter.incr('Tasks.Get')
-    # TODO(jeff.carollo): Specify request and response format."""
-    task_id = int(task_id)
-    task = tasks.GetById(task_id)
+class TaskResultUploadHandler(webapp2.RequestHandler):
+  """Base class of handlers receiving Task results from blobstore uploads."""
 
-    if task is None:
-      counter.incr('Tasks.Get.404')
-      self.error(404)
-      return
-
-    # Success. Write response.
-    self.response.headers['Content-Type'] = 'application/json'
-    response = model_to_dict.ModelToDict(task)
-    response['kind'] = 'mrtaskman#task'
-    json.dump(response, self.response.out, indent=2)
-    self.response.out.write('\n')
-    counter.incr('Tasks.Get.200')
+  def UploadResult(self, task_id, task_result, stdout, stderr):
+    """Stores the uploaded result of a single task.
 
-  def delete(self, task_id):
-    """Removes a single task given by task_id."""
-    counter.incr('Tasks.Delete')
-    task_id = int(task_id)
-    success = tasks.DeleteById(task_id)
-    if not success:
-      counter.incr('Tasks.Delete.404')
-      self.error(404)
-      return
-    # 200 OK.
-    counter.incr('Tasks.Delete.200')
-
-  def post(self, task_id):
-    """Uploads results of a task, including STDOUT and STDERR."""
-    counter.incr('Tasks.Update')
-    logging.info('Request: %s', self.request.body)
-    task_id = int(task_id)
-
-    blob_infos = self.GetBlobInfosFromPostBody()
+    Args:
+      task_id: Id of task as int.
+      task_result: Encoded mrtaskman#task_complete_request as str, or None.
+      stdout: blobstore.BlobInfo of STDOUT, or None.
+      stderr: blobstore.BlobInfo of STDERR, or None.
 
-    task_result = self.request.get('task_result', None)
+    Returns:
+      (status, message) where status is an HTTP status code as int.
+    """
     if task_result:
       task_result = quopri.decodestring(task_result).decode('ISO-8859-1')
     if task_result:
       try:
         task_result = json.loads(task_result, 'ISO-8859-1')
       except ValueError, e:
-        self.response.out.write('Field "task_result" must be valid JSON.\n')
         logging.info(e)
-        task_result = None
+        counter.incr('Tasks.Update.400')
+        return (400, 'Field "task_result" must be valid JSON.\n')
     if not task_result:
       counter.incr('Tasks.Update.400')
-      self.DeleteBlobs(blob_infos)
-      self.response.out.write('Field "task_result" is required.\n')
-      self.response.set_status(400)
-      return
+      return (400, 'Field "task_result" is required.\n')
 
     # Get required attempt and exit_code.
     try:
@@ -194,13 +189,10 @@ class TasksHandler(webapp2.RequestHandler):
       exit_code = task_result['exit_code']
       assert isinstance(attempt, int)
       assert isinstance(exit_code, int)
-    except KeyError, AssertionError:
+    except (KeyError, AssertionError):
       counter.incr('Tasks.Update.400')
-      self.DeleteBlobs(blob_infos)
-      self.response.out.write(
-          'task_result must contain integers "attempt" and "exit_code".')
-      self.response.set_status(400)
-      return
+      return (400,
+              'task_result must contain integers "attempt" and "exit_code".')
 
     result_metadata = task_result.get('result_metadata', None)
     if result_metadata:
@@ -208,18 +200,11 @@ class TasksHandler(webapp2.RequestHandler):
         result_metadata = json.dumps(result_metadata, indent=2)
       except:
         counter.incr('Tasks.Update.400')
-        self.DeleteBlobs(blob_infos)
-        self.response.out.write(
-            'result_metadata must be JSON serializable.')
-        self.response.set_status(400)
-        return
+        return (400, 'result_metadata must be JSON serializable.')
 
     # Get optional execution_time.
     execution_time = task_result.get('execution_time', None)
 
-    # Get optional blobs for STDOUT and STDERR.
-    stdout = blob_infos.get('STDOUT', None)
-    stderr = blob_infos.get('STDERR', None)
     stdout_download_url = self.MakeTaskResultFileDownloadUrl(stdout)
     stderr_download_url = self.MakeTaskResultFileDownloadUrl(stderr)
 
@@ -229,27 +214,42 @@ class TasksHandler(webapp2.RequestHandler):
     # Get optional worker_log.
     worker_log = task_result.get('worker_log', None)
 
+    # Get optional upload_key, which makes retried uploads idempotent.
+    upload_key = task_result.get('upload_key', None)
+    if upload_key is not None and not isinstance(upload_key, basestring):
+      counter.incr('Tasks.Update.400')
+      return (400, 'upload_key must be a string.')
+
+    # Get optional worker_timings.
+    worker_timings = task_result.get('worker_timings', None)
+    if worker_timings is not None and not isinstance(worker_timings, dict):
+      counter.incr('Tasks.Update.400')
+      return (400, 'worker_timings must be a JSON object.')
+
     try:
       tasks.UploadTaskResult(task_id, attempt, exit_code,
                              execution_time, stdout, stderr,
                              stdout_download_url, stderr_download_url,
                              device_serial_number, result_metadata,
-                             worker_log)
+                             worker_log, upload_key, worker_timings)
     except tasks.TaskNotFoundError:
       counter.incr('Tasks.Update.404')
-      self.DeleteBlobs(blob_infos)
-      self.response.out.write('Task %d does not exist.' % task_id)
-      self.response.set_status(404)
-      return
+      return (404, 'Task %d does not exist.' % task_id)
     except tasks.TaskTimedOutError:
       counter.incr('Tasks.Update.400')
-      self.DeleteBlobs(blob_infos)
-      self.response.out.write('Response for task %d timed out' % task_id)
-      self.response.set_status(400)
-      return
+      return (400, 'Response for task %d timed out' % task_id)
 
     counter.incr('Tasks.Update.200')
-    # 200 OK.
+    return (200, '')
+
+  def RecordUpload(self, task_ids, blob_infos):
+    """Records uploaded blobs until ClearUpload, so orphans are collected.
+
+    Returns:
+      Pending record to pass to result_uploads.ClearUpload.
+    """
+    return result_uploads.RecordUpload(
+        task_ids, [blob_info.key() for blob_info in blob_infos.values()])
 
   def DeleteBlobs(self, blob_infos):
     """Deletes blobs referenced in this request.
@@ -282,7 +282,6 @@ class TasksHandler(webapp2.RequestHandler):
     return '%s/taskresultfiles/%s' % (
         self.GetBaseUrl(self.request.url), blob_info.key())
 
-  # TODO(jeff.carollo): Extract into common base class.
   def GetBlobInfosFromPostBody(self):
     """Returns a dict of {'form_name': blobstore.BlobInfo}."""
     blobs = {}
@@ -292,11 +291,154 @@ class TasksHandler(webapp2.RequestHandler):
     return blobs
 
 
+class TasksHandler(TaskResultUploadHandler):
+  def get(self, task_id):
+    """Retrieves a single task given by task_id."""
+    counter.incr('Tasks.Get')
+    # TODO(jeff.carollo): Specify request and response format."""
+    task_id = int(task_id)
+    task = tasks.GetById(task_id)
+
+    if task is None:
+      counter.incr('Tasks.Get.404')
+      self.error(404)
+      return
+
+    # Success. Write response.
+    self.response.headers['Content-Type'] = 'application/json'
+    response = model_to_dict.ModelToDict(task)
+    response['kind'] = 'mrtaskman#task'
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
+    counter.incr('Tasks.Get.200')
+
+  def delete(self, task_id):
+    """Removes a single task given by task_id."""
+    counter.incr('Tasks.Delete')
+    task_id = int(task_id)
+    success = tasks.DeleteById(task_id)
+    if not success:
+      counter.incr('Tasks.Delete.404')
+      self.error(404)
+      return
+    # 200 OK.
+    counter.incr('Tasks.Delete.200')
+
+  def post(self, task_id):
+    """Uploads results of a task, including STDOUT and STDERR."""
+    counter.incr('Tasks.Update')
+    logging.info('Request: %s', self.request.body)
+    task_id = int(task_id)
+
+    blob_infos = self.GetBlobInfosFromPostBody()
+    pending_upload = self.RecordUpload([task_id], blob_infos)
+    (status, message) = self.UploadResult(
+        task_id,
+        self.request.get('task_result', None),
+        blob_infos.get('STDOUT', None),
+        blob_infos.get('STDERR', None))
+    if status != 200:
+      self.DeleteBlobs(blob_infos)
+    result_uploads.ClearUpload(pending_upload)
+    if status != 200:
+      self.response.out.write(message)
+      self.response.set_status(status)
+      return
+    # 200 OK.
+
+
+# Field name prefix of each task's result in a batch upload.
+RESULT_FIELD_PREFIX = 'task_result_'
+
+
+class TaskResultsHandler(TaskResultUploadHandler):
+  """Uploads results of a batch of tasks assigned together.
+
+  GET returns a fresh upload URL in case the one from tasks.assign expires.
+  Each task's fields are suffixed with its id: task_result_<id>,
+  STDOUT_<id> and STDERR_<id>.
+  """
+
+  def get(self):
+    """Returns a fresh URL to upload a batch of results to."""
+    counter.incr('Tasks.GetTaskResultsUrl')
+    response = {}
+    response['kind'] = 'mrtaskman#task_results_url'
+    response['task_results_url'] = MakeTaskResultsUrl()
+    response['task_results_url_expires_in'] = UPLOAD_URL_EXPIRES_IN_SECONDS
+
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
+    counter.incr('Tasks.GetTaskResultsUrl.200')
+
+  def post(self):
+    counter.incr('Tasks.UpdateBatch')
+    blob_infos = self.GetBlobInfosFromPostBody()
+
+    task_ids = []
+    for field_name in self.request.POST.keys():
+      if field_name.startswith(RESULT_FIELD_PREFIX):
+        try:
+          task_ids.append(int(field_name[len(RESULT_FIELD_PREFIX):]))
+        except ValueError:
+          continue
+    if not task_ids:
+      counter.incr('Tasks.UpdateBatch.400')
+      self.DeleteBlobs(blob_infos)
+      self.response.out.write('At least one task_result_<id> is required.\n')
+      self.response.set_status(400)
+      return
+
+    pending_upload = self.RecordUpload(task_ids, blob_infos)
+    results = []
+    uploaded_blob_names = set()
+    for task_id in sorted(task_ids):
+      stdout_name = 'STDOUT_%d' % task_id
+      stderr_name = 'STDERR_%d' % task_id
+      (status, message) = self.UploadResult(
+          task_id,
+          self.request.get(RESULT_FIELD_PREFIX + str(task_id), None),
+          blob_infos.get(stdout_name, None),
+          blob_infos.get(stderr_name, None))
+      if status == 200:
+        uploaded_blob_names.update([stdout_name, stderr_name])
+      result = {}
+      result['task_id'] = task_id
+      result['status'] = status
+      if message:
+        result['message'] = message.strip()
+      results.append(result)
+
+    self.DeleteBlobs(dict(
+        [(name, blob_info) for (name, blob_info) in blob_infos.iteritems()
+         if name not in uploaded_blob_names]))
+    result_uploads.ClearUpload(pending_upload)
+
+    response = {}
+    response['kind'] = 'mrtaskman#task_results_response'
+    response['results'] = results
+    self.response.headers['Content-Type'] = 'application/json'
+    model_to_dict.DumpJson(response, self.response.out)
+    self.response.out.write('\n')
+    counter.incr('Tasks.UpdateBatch.200')
+
+
+# Blobstore upload URLs expire 10 minutes after creation. Workers are told
+# they expire a little sooner, leaving time for the upload itself.
+UPLOAD_URL_EXPIRES_IN_SECONDS = 9 * 60
+
+
 def MakeTaskCompleteUrl(task_id):
   """Returns a URL for a worker to POST to when done with given Task."""
   return blobstore.create_upload_url('/tasks/%d' % task_id)
 
 
+def MakeTaskResultsUrl():
+  """Returns a URL for a worker to POST a batch of Task results to."""
+  return blobstore.create_upload_url('/tasks/results')
+
+
 class TasksAssignHandler(webapp2.RequestHandler):
   """Handles /tasks/assign, which hands off tasks to workers."""
 
@@ -347,26 +489,62 @@ class TasksAssignHandler(webapp2.RequestHandler):
       self.response.set_status(400)
       return
 
+    attributes = parsed_request['capabilities'].get('attributes', None) or {}
+    if (not isinstance(attributes, dict) or
+        [value for value in attributes.itervalues()
+         if not isinstance(value, basestring)]):
+      counter.incr('Tasks.Assign.400')
+      self.response.out.write(
+          'AssignRequest.capabilities.attributes must map strings to '
+          'strings.\n')
+      self.response.set_status(400)
+      return
+
+    # Workers which predate batching ask for a single task.
+    max_tasks = parsed_request.get('max_tasks', None)
+    if max_tasks is not None and (not isinstance(max_tasks, int) or
+                                  max_tasks < 1):
+      counter.incr('Tasks.Assign.400')
+      self.response.out.write(
+          'AssignRequest.max_tasks must be a positive integer.\n')
+      self.response.set_status(400)
+      return
+
     counters = counter.Batch()
     for executor_name in executor_capabilities:
       counters.incr('Executors.%s.Assign' % executor_name)
     counters.commit()
 
-    task = tasks.Assign(worker, executor_capabilities)
+    assigned = tasks.AssignBatch(worker, executor_capabilities, attributes,
+                                 max_tasks or 1)
 
     self.response.headers['Content-Type'] = 'application/json'
-    if task is None:
+    if not assigned:
       return
 
-    response = model_to_dict.ModelToDict(task)
-    response['kind'] = 'mrtaskman#task'
-    json.dump(response, self.response.out, indent=2)
+    if max_tasks is None:
+      task = assigned[0]
+      response = model_to_dict.ModelToDict(task)
+      response['kind'] = 'mrtaskman#task'
+      response['task_complete_url'] = MakeTaskCompleteUrl(task.key().id())
+      response['task_complete_url_expires_in'] = UPLOAD_URL_EXPIRES_IN_SECONDS
+    else:
+      response = {}
+      response['kind'] = 'mrtaskman#task_list'
+      response['tasks'] = []
+      for task in assigned:
+        task_dict = model_to_dict.ModelToDict(task)
+        task_dict['kind'] = 'mrtaskman#task'
+        response['tasks'].append(task_dict)
+      response['task_results_url'] = MakeTaskResultsUrl()
+      response['task_results_url_expires_in'] = UPLOAD_URL_EXPIRES_IN_SECONDS
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.out.write('\n')
     counter.incr('Tasks.Assign.200')
 
 
 class TaskCompleteUrlHandler(webapp2.RequestHandler):
-  """In case our task complete URL expires."""
+  """In case the task complete URL from tasks.assign expires."""
   def get(self, task_id):
     counter.incr('Tasks.GetTaskCompleteUrl')
     try:
@@ -380,33 +558,90 @@ class TaskCompleteUrlHandler(webapp2.RequestHandler):
     response = {}
     response['kind'] = 'mrtaskman#task_complete_url'
     response['task_complete_url'] = MakeTaskCompleteUrl(task_id)
+    response['task_complete_url_expires_in'] = UPLOAD_URL_EXPIRES_IN_SECONDS
 
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write('\n')
     counter.incr('Tasks.GetTaskCompleteUrl.200')
 
 
+# Largest page a single task listing request may ask for.
+MAX_TASK_LIST_LIMIT = 1000
+
+
+def ParseTaskListParams(request):
+  """Parses limit, cursor and fields params of a task listing request.
+
+  Returns:
+    (limit, cursor, fields) where fields is a list of Task property names
+    or None for all properties.
+
+  Raises:
+    ValueError if any of the params is invalid.
+  """
+  limit = int(request.get('limit', MAX_TASK_LIST_LIMIT))
+  if limit <= 0 or limit > MAX_TASK_LIST_LIMIT:
+    raise ValueError('limit must be between 1 and %d.' % MAX_TASK_LIST_LIMIT)
+  cursor = request.get('cursor', None) or None
+  fields = request.get('fields', None)
+  if fields:
+    fields = [field.strip() for field in fields.split(',') if field.strip()]
+    valid_fields = tasks.Task.properties().keys() + ['id']
+    for field in fields:
+      if field not in valid_fields:
+        raise ValueError('Invalid field: %s' % field)
+  else:
+    fields = None
+  return (limit, cursor, fields)
+
+
+def IsKeysOnly(fields):
+  """Returns True iff a listing of given fields needs only Task keys."""
+  return fields is not None and set(fields) == set(['id'])
+
+
+def MakeTaskListResponse(task_list, next_cursor, fields):
+  """Creates a mrtaskman#task_list response holding given fields of tasks."""
+  response = {}
+  response['kind'] = 'mrtaskman#task_list'
+  if IsKeysOnly(fields):
+    response['tasks'] = [{'id': task_key.id_or_name()}
+                         for task_key in task_list]
+  else:
+    response['tasks'] = model_to_dict.ModelsToDicts(task_list, fields)
+  response['next_cursor'] = next_cursor
+  return response
+
+
 class TasksListByExecutorHandler(webapp2.RequestHandler):
   def get(self, executor):
-    """Lists tasks for a given executor."""
-    limit = self.request.get('limit', 1000)
-    limit = int(limit)
-    task_list = tasks.GetByExecutor(executor, limit)
-    response = {}
-    response['kind'] = 'mrtaskman#task_list'
-    response['tasks'] = [model_to_dict.ModelToDict(task)
-                         for task in task_list]
+    """Lists tasks for a given executor, one page at a time."""
+    try:
+      (limit, cursor, fields) = ParseTaskListParams(self.request)
+    except ValueError, e:
+      self.response.out.write('%s\n' % e)
+      self.response.set_status(400)
+      return
+
+    (task_list, next_cursor) = tasks.ListByExecutor(
+        executor, limit, cursor, keys_only=IsKeysOnly(fields))
+    response = MakeTaskListResponse(task_list, next_cursor, fields)
 
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write('\n')
 
   def delete(self, executor):
-    """Deletes all tasks for a given executor."""
-    tasks.DeleteByExecutor(executor)
-    self.response.out.write('Delete task started.\n')
-    self.response.headers['Content-Type'] = 'text/plain'
+    """Starts deleting all scheduled tasks for a given executor.
+
+    Responds with the bulk delete job id and where to poll its progress.
+    """
+    job_id = bulk_delete.StartDeleteScheduledTasks(executor)
+    model_to_dict.DumpJson(bulk_delete.MakeJobResponse(job_id),
+                           self.response.out)
+    self.response.headers['Content-Type'] = 'application/json'
+    self.response.out.write('\n')
 
 
 class TasksListByNameHandler(webapp2.RequestHandler):
@@ -418,14 +653,18 @@ class TasksListByNameHandler(webapp2.RequestHandler):
       return
     name = name.decode('utf-8')
 
-    task_list = tasks.GetByName(name)
+    try:
+      (limit, cursor, fields) = ParseTaskListParams(self.request)
+    except ValueError, e:
+      self.response.out.write('%s\n' % e)
+      self.response.set_status(400)
+      return
 
-    response = {}
-    response['kind'] = 'mrtaskman#task_list'
-    logging.info('tasks: %s', task_list)
-    response['tasks'] = [model_to_dict.ModelToDict(task)
-                         for task in task_list]
-    json.dump(response, self.response.out, indent=2)
+    (task_list, next_cursor) = tasks.ListByName(
+        name, limit, cursor, keys_only=IsKeysOnly(fields))
+    response = MakeTaskListResponse(task_list, next_cursor, fields)
+
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write('\n')
 
@@ -441,7 +680,7 @@ class TasksPeekAtExecutorHandler(webapp2.RequestHandler):
     response = model_to_dict.ModelToDict(task)
     response['kind'] = 'mrtaskman#task'
 
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write('\n')
 
@@ -455,7 +694,7 @@ class PauseExecutorHandler(webapp2.RequestHandler):
     response['kind'] = 'mrtaskman#executor_pause_state'
     response['paused'] = paused
 
-    json.dump(response, self.response.out, indent=2)
+    model_to_dict.DumpJson(response, self.response.out)
     self.response.headers['Content-Type'] = 'application/json'
     self.response.out.write('\n')
 
@@ -477,9 +716,11 @@ app = webapp2.WSGIApplication([
     ('/tasks/([0-9]+)', TasksHandler),
     ('/tasks/([0-9]+)/task_complete_url', TaskCompleteUrlHandler),
     ('/tasks/assign', TasksAssignHandler),
+    ('/tasks/results', TaskResultsHandler),
     ('/tasks/list_by_name', TasksListByNameHandler),
     ('/tasks/schedule', TasksScheduleHandler),
     ('/executors/([a-zA-Z0-9]+)', TasksListByExecutorHandler),
     ('/executors/([a-zA-Z0-9]+)/pause', PauseExecutorHandler),
     ('/executors/([a-zA-Z0-9]+)/peek', TasksPeekAtExecutorHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -0,0 +1,146 @@
+# Copyright 2012 uTest, Inc. All Rights Reserved.
+
+"""Moves completed Tasks older than a cutoff into blob archives."""
+
+__author__ = 'Jeff Carollo (jeffc@utest.com)'
+
+import datetime
+import time
+
+from mapreduce import base_handler
+from mapreduce import context
+from mapreduce import input_readers
+from mapreduce import mapreduce_pipeline
+from mapreduce import operation
+from mapreduce.lib import files
+from mapreduce.lib import pipeline
+
+from models import archives
+from models import tasks
+
+
+# Archive Tasks completed more than this many days ago by default.
+DEFAULT_ARCHIVE_AFTER_DAYS = 30
+
+
+class ArchiveTasksPipeline(base_handler.PipelineBase):
+  """Archives Tasks completed in an archive's window, then deletes them.
+
+  Tasks are only deleted once their records are in finalized blobs and the
+  archive is readable, so exports see each Task exactly once throughout.
+  """
+  def run(self, archive_id, start_time, end_time):
+    params = {
+      'entity_kind': 'models.tasks.Task',
+      'batch_size': 100,
+      'start_time': start_time,
+      'end_time': end_time,
+    }
+    write_params = dict(params)
+    write_params['mime_type'] = 'application/x-ndjson'
+    filenames = yield mapreduce_pipeline.MapperPipeline(
+        'ArchiveTasks',
+        'index.archive_tasks_pipeline.ArchiveMap',
+        'index.archive_tasks_pipeline.TaskWithResultInputReader',
+        'mapreduce.output_writers.BlobstoreOutputWriter',
+        params=write_params,
+        shards=16)
+    written = yield SetArchiveWrittenPipeline(archive_id, filenames)
+    with pipeline.After(written):
+      deleted = yield mapreduce_pipeline.MapperPipeline(
+          'DeleteArchivedTasks',
+          'index.archive_tasks_pipeline.DeleteMap',
+          'mapreduce.input_readers.DatastoreInputReader',
+          params=params,
+          shards=16)
+    with pipeline.After(deleted):
+      yield SetArchiveCompletePipeline(archive_id)
+
+
+class SetArchiveWrittenPipeline(base_handler.PipelineBase):
+  def run(self, archive_id, filenames):
+    blob_keys = [files.blobstore.get_blob_key(filename)
+                 for filename in filenames]
+    archives.SetArchiveWritten(archive_id, blob_keys)
+
+
+class SetArchiveCompletePipeline(base_handler.PipelineBase):
+  def run(self, archive_id):
+    archives.SetArchiveComplete(archive_id)
+
+
+def StartArchivePipeline(archive_after_days=DEFAULT_ARCHIVE_AFTER_DAYS):
+  """Starts archiving Tasks completed over archive_after_days ago.
+
+  Returns:
+    The started ArchiveTasksPipeline, or None if there is nothing to do.
+  """
+  end_time = (datetime.datetime.now() -
+              datetime.timedelta(days=archive_after_days))
+  archive = archives.StartArchive(end_time)
+  if archive is None:
+    return None
+  archive_pipeline = ArchiveTasksPipeline(
+      archive.key().id(),
+      time.mktime(archive.start_time.timetuple()),
+      time.mktime(archive.end_time.timetuple()))
+  archive_pipeline.start()
+  return archive_pipeline
+
+
+def GetArchiveWindow():
+  """Returns (start_time, end_time) of the running job's archive."""
+  params = context.get().mapreduce_spec.mapper.params
+  return (datetime.datetime.fromtimestamp(params['start_time']),
+          datetime.datetime.fromtimestamp(params['end_time']))
+
+
+class TaskWithResultInputReader(input_readers.DatastoreInputReader):
+  """Yields Tasks with the TaskResults of archivable ones loaded.
+
+  TaskResults are loaded with one batch get per batch of Tasks fetched,
+  rather than one get per Task.
+  """
+
+  def _iter_key_range(self, k_range):
+    batch = []
+    for (key, task) in super(TaskWithResultInputReader,
+                             self)._iter_key_range(k_range):
+      batch.append((key, task))
+      if len(batch) >= self._batch_size:
+        for item in self._AttachResults(batch):
+          yield item
+        batch = []
+    for item in self._AttachResults(batch):
+      yield item
+
+  def _AttachResults(self, batch):
+    window = GetArchiveWindow()
+    tasks.AttachResults([task for (_, task) in batch
+                         if IsArchivable(task, window)])
+    return batch
+
+
+def IsArchivable(task, window):
+  (start_time, end_time) = window
+  completed_time = archives.GetCompletedTime(task)
+  return (task.state == tasks.TaskStates.COMPLETE and
+          completed_time is not None and
+          start_time < completed_time <= end_time)
+
+
+def ArchiveMap(task):
+  if not IsArchivable(task, GetArchiveWindow()):
+    return
+  yield archives.EncodeRecord(archives.MakeArchiveRecord(task))
+  yield operation.counters.Increment('archived')
+
+
+def DeleteMap(task):
+  if not IsArchivable(task, GetArchiveWindow()):
+    return
+  result_key = tasks.Task.result.get_value_for_datastore(task)
+  if result_key is not None:
+    yield operation.db.Delete(result_key)
+  yield operation.db.Delete(task)
+  yield operation.counters.Increment('deleted')
@@ -0,0 +1,125 @@
+# Copyright 2012 uTest, Inc. All Rights Reserved.
+
+"""Bulk deletion of Tasks and Packages as parallel mapper jobs.
+
+Deletes go through the mapper's mutation pool, which batches them into
+large datastore RPCs, across many shards at once. Each job's progress can
+be read with GetProgress.
+"""
+
+__author__ = 'Jeff Carollo (jeffc@utest.com)'
+
+from google.appengine.ext import blobstore
+
+from mapreduce import context
+from mapreduce import control
+from mapreduce import model
+from mapreduce import operation
+
+from models import packages
+from models import tasks
+
+
+BULK_DELETE_SHARDS = 16
+BULK_DELETE_BATCH_SIZE = 500
+PROGRESS_URL = '/bulk_delete/%s'
+
+
+def StartDeleteScheduledTasks(executor):
+  """Starts deleting all scheduled Tasks for given executor.
+
+  Returns:
+    Mapreduce job id as str.
+  """
+  return control.start_map(
+      'DeleteScheduledTasks.%s' % executor,
+      'index.bulk_delete.DeleteScheduledTaskMap',
+      'mapreduce.input_readers.DatastoreInputReader',
+      {
+        'entity_kind': 'models.tasks.Task',
+        'batch_size': BULK_DELETE_BATCH_SIZE,
+        'executor': executor,
+      },
+      shard_count=BULK_DELETE_SHARDS)
+
+
+def StartDeletePackages(name):
+  """Starts deleting all versions of Package name and their files.
+
+  Returns:
+    Mapreduce job id as str.
+  """
+  return control.start_map(
+      'DeletePackages.%s' % name,
+      'index.bulk_delete.DeletePackageMap',
+      'mapreduce.input_readers.DatastoreKeyInputReader',
+      {
+        'entity_kind': 'models.packages.Package',
+        'batch_size': BULK_DELETE_BATCH_SIZE,
+        'package_name': name,
+      },
+      shard_count=BULK_DELETE_SHARDS)
+
+
+def GetMapperParam(name):
+  return context.get().mapreduce_spec.mapper.params[name]
+
+
+def DeleteScheduledTaskMap(task):
+  if task.state != tasks.TaskStates.SCHEDULED:
+    return
+  if GetMapperParam('executor') not in task.executor_requirements:
+    return
+  yield operation.db.Delete(task.key())
+  yield operation.counters.Increment('deleted')
+
+
+def DeletePackageMap(package_key):
+  # Package key names are 'name^^^version', so no Package need be loaded.
+  key_prefix = packages.MakePackageKey(GetMapperParam('package_name'),
+                                       '').name()
+  if not package_key.name().startswith(key_prefix):
+    return
+  package_files = (packages.PackageFile.all()
+                                       .ancestor(package_key)
+                                       .fetch(limit=1000))
+  blob_keys = []
+  for package_file in package_files:
+    blob_key = packages.PackageFile.blob.get_value_for_datastore(package_file)
+    if blob_key is not None:
+      blob_keys.append(blob_key)
+    yield operation.db.Delete(package_file.key())
+  if blob_keys:
+    blobstore.delete(blob_keys)
+  yield operation.db.Delete(package_key)
+  yield operation.counters.Increment('deleted')
+  yield operation.counters.Increment('deleted_files', len(package_files))
+
+
+def GetProgress(job_id):
+  """Returns a mrtaskman#bulk_delete_progress dict, or None if not found."""
+  state = model.MapreduceState.get_by_job_id(job_id)
+  if state is None:
+    return None
+  counters = state.counters_map
+  progress = {}
+  progress['kind'] = 'mrtaskman#bulk_delete_progress'
+  progress['job_id'] = job_id
+  progress['name'] = state.mapreduce_spec.name
+  progress['active'] = state.active
+  progress['result_status'] = state.result_status
+  progress['active_shards'] = state.active_shards
+  progress['failed_shards'] = state.failed_shards
+  progress['scanned'] = counters.get(context.COUNTER_MAPPER_CALLS)
+  progress['deleted'] = counters.get('deleted')
+  progress['start_time'] = str(state.start_time)
+  return progress
+
+
+def MakeJobResponse(job_id):
+  """Returns a mrtaskman#bulk_delete_job dict for a started job."""
+  response = {}
+  response['kind'] = 'mrtaskman#bulk_delete_job'
+  response['job_id'] = job_id
+  response['progress_url'] = PROGRESS_URL % job_id
+  return response
@@ -5,11 +5,18 @@
 __author__ = 'Jeff Carollo (jeffc@utest.com)'
 
 
+from google.appengine.api import taskqueue
+
 import logging
 import webapp2
 
+from index import archive_tasks_pipeline
+from index import bulk_delete
+from index import migrate_json_pipeline
 from index import migrate_tasks_pipeline
 from index import task_results_pipeline
+from util import model_to_dict
+from util import middleware
 
 
 class IndexHandler(webapp2.RequestHandler):
@@ -23,12 +30,21 @@ class IndexHandler(webapp2.RequestHandler):
 <input type="submit" value="Migrate Tasks"></input>
 </form>
 <form method="POST" action='/index'>
+<input type="hidden" name="action" value="migrate_json"></input>
+<input type="submit" value="Migrate Task Configs"></input>
+</form>
+<form method="POST" action='/index'>
 <input type="hidden" name="action" value="task_results"></input>
 <input type="submit" value="Task Results"></input>
 </form>
+<form method="POST" action='/index'>
+<input type="hidden" name="action" value="archive_tasks"></input>
+Days: <input type="text" name="days" value="%d"></input>
+<input type="submit" value="Archive Tasks"></input>
+</form>
 </body>
 </html>
-    ''')
+    ''' % archive_tasks_pipeline.DEFAULT_ARCHIVE_AFTER_DAYS)
     self.response.headers['Content-Type'] = 'text/html'
 
   def post(self):
@@ -45,6 +61,12 @@ class IndexHandler(webapp2.RequestHandler):
       self.redirect(
           pipeline.base_path + "/status?root=" + pipeline.pipeline_id)
       return
+    if action == 'migrate_json':
+      pipeline = migrate_json_pipeline.MigrateJsonPipeline()
+      pipeline.start()
+      self.redirect(
+          pipeline.base_path + "/status?root=" + pipeline.pipeline_id)
+      return
     if action == 'task_results':
       pipeline = task_results_pipeline.TaskResultsPipeline()
       pipeline.start()
@@ -52,10 +74,78 @@ class IndexHandler(webapp2.RequestHandler):
           pipeline.base_path + "/status?root=" + pipeline.pipeline_id)
       return
 
+    if action == 'archive_tasks':
+      days = int(self.request.get(
+          'days', archive_tasks_pipeline.DEFAULT_ARCHIVE_AFTER_DAYS))
+      pipeline = archive_tasks_pipeline.StartArchivePipeline(days)
+      if pipeline is None:
+        self.response.out.write(
+            'An archive is still being written, or nothing to archive.')
+        return
+      self.redirect(
+          pipeline.base_path + "/status?root=" + pipeline.pipeline_id)
+      return
+
     self.response.out.write('Invalid action: %s' % action)
     self.response.set_status(400)
 
 
+class ArchiveTasksHandler(webapp2.RequestHandler):
+  """Starts archiving old completed Tasks from cron."""
+  def get(self):
+    days = int(self.request.get(
+        'days', archive_tasks_pipeline.DEFAULT_ARCHIVE_AFTER_DAYS))
+    pipeline = archive_tasks_pipeline.StartArchivePipeline(days)
+    if pipeline is None:
+      logging.info('An archive is still being written, or nothing to do.')
+      return
+    logging.info('Started archive pipeline %s.', pipeline.pipeline_id)
+
+
+class DeleteAllByExecutorHandler(webapp2.RequestHandler):
+  """Deletes scheduled tasks for executor, from already-queued requests."""
+  def post(self, executor):
+    job_id = bulk_delete.StartDeleteScheduledTasks(executor)
+    logging.info('Started deleting tasks for %s as job %s.', executor, job_id)
+
+
+class PackagesBulkDeleteHandler(webapp2.RequestHandler):
+  """Deletes every version of a Package by name."""
+  def get(self):
+    name = self.request.get('name', 'monkey')
+    task = taskqueue.Task(
+        method='POST',
+        params={'name': name},
+        url='/packages/deleteall')
+    task.add()
+    self.response.out.write('Task enqueued.')
+
+  def post(self):
+    name = self.request.get('name', 'monkey')
+    job_id = bulk_delete.StartDeletePackages(name)
+    logging.info('Started deleting packages %s as job %s.', name, job_id)
+    model_to_dict.DumpJson(bulk_delete.MakeJobResponse(job_id),
+                           self.response.out)
+    self.response.headers['Content-Type'] = 'application/json'
+
+
+class BulkDeleteProgressHandler(webapp2.RequestHandler):
+  """Reports progress of a bulk delete job."""
+  def get(self, job_id):
+    progress = bulk_delete.GetProgress(job_id)
+    if progress is None:
+      self.response.out.write('No such job: %s' % job_id)
+      self.response.set_status(404)
+      return
+    model_to_dict.DumpJson(progress, self.response.out)
+    self.response.headers['Content-Type'] = 'application/json'
+
+
 app = webapp2.WSGIApplication([
     ('/index', IndexHandler),
+    ('/index/archive_tasks', ArchiveTasksHandler),
+    ('/executors/([a-zA-Z0-9]+)/deleteall', DeleteAllByExecutorHandler),
+    ('/packages/deleteall', PackagesBulkDeleteHandler),
+    ('/bulk_delete/([a-zA-Z0-9_\-]+)', BulkDeleteProgressHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
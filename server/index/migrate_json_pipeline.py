@@ -0,0 +1,34 @@
+# Copyright 2012 uTest, Inc. All Rights Reserved.
+
+"""Rewrites double-encoded Task configs with a single JSON encoding."""
+
+__author__ = 'Jeff Carollo (jeffc@utest.com)'
+
+from mapreduce import base_handler
+from mapreduce import mapreduce_pipeline
+from mapreduce import operation
+
+from models import tasks
+
+
+class MigrateJsonPipeline(base_handler.PipelineBase):
+  def run(self):
+    yield mapreduce_pipeline.MapperPipeline(
+        'MigrateJson',
+        'index.migrate_json_pipeline.Map',
+        'mapreduce.input_readers.DatastoreInputReader',
+        params={
+          'entity_kind': 'models.tasks.Task',
+          'batch_size': 100,
+        },
+        shards=100)
+
+
+def Map(task):
+  if not tasks.Task.config.IsLegacyEncoded(task):
+    yield operation.counters.Increment('already_migrated')
+    return
+  # Reading parses the legacy text; writing stores the parsed value once.
+  task.config = task.config
+  yield operation.db.Put(task)
+  yield operation.counters.Increment('migrated')
@@ -0,0 +1,255 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Blob archives of completed Tasks moved out of the datastore.
+
+Each TaskArchive covers Tasks completed in a time window following the
+previous archive's window. Archived Tasks are stored as one compact JSON
+record per line in blobstore files, written by index.archive_tasks_pipeline
+before the Tasks and their TaskResults are deleted.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.ext import blobstore
+from google.appengine.ext import db
+
+import datetime
+import json
+
+from models import tasks
+
+
+class ArchiveStates(object):
+  # Records are being written; the archive cannot be read yet.
+  WRITING = 'writing'
+  # Records are readable; archived Tasks may still be in the datastore.
+  WRITTEN = 'written'
+  # Archived Tasks have been deleted from the datastore.
+  COMPLETE = 'complete'
+
+
+# Start of the window of the first archive.
+EPOCH = datetime.datetime.fromtimestamp(0)
+
+ARCHIVE_CURSOR_PREFIX = 'archive:'
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+
+class TaskArchive(db.Model):
+  """Blobs holding Tasks completed after start_time up to end_time."""
+  start_time = db.DateTimeProperty(required=True)
+  end_time = db.DateTimeProperty(required=True)
+  state = db.StringProperty(
+      required=True,
+      choices=(ArchiveStates.WRITING,
+               ArchiveStates.WRITTEN,
+               ArchiveStates.COMPLETE),
+      default=ArchiveStates.WRITING)
+  blob_keys = db.ListProperty(blobstore.BlobKey)
+  created_time = db.DateTimeProperty(auto_now_add=True)
+
+
+def GetArchives():
+  """Returns all TaskArchives ordered by window."""
+  return list(TaskArchive.all().order('end_time'))
+
+
+def GetReadableArchives():
+  """Returns TaskArchives whose records can be read, ordered by window."""
+  return [archive for archive in GetArchives()
+          if archive.state != ArchiveStates.WRITING]
+
+
+def GetArchivedHorizon():
+  """Returns end_time of the last readable archive, or None."""
+  archive_list = GetReadableArchives()
+  if not archive_list:
+    return None
+  return archive_list[-1].end_time
+
+
+def StartArchive(end_time):
+  """Creates a TaskArchive for Tasks completed after the last archive.
+
+  Returns:
+    The new TaskArchive, or None if an archive is still being written or
+    there is nothing new to archive before end_time.
+  """
+  archive_list = GetArchives()
+  start_time = EPOCH
+  if archive_list:
+    if [archive for archive in archive_list
+        if archive.state == ArchiveStates.WRITING]:
+      return None
+    start_time = archive_list[-1].end_time
+  if end_time <= start_time:
+    return None
+  archive = TaskArchive(start_time=start_time, end_time=end_time)
+  archive.put()
+  return archive
+
+
+def SetArchiveWritten(archive_id, blob_keys):
+  archive = TaskArchive.get_by_id(archive_id)
+  archive.blob_keys = blob_keys
+  archive.state = ArchiveStates.WRITTEN
+  archive.put()
+
+
+def SetArchiveComplete(archive_id):
+  archive = TaskArchive.get_by_id(archive_id)
+  archive.state = ArchiveStates.COMPLETE
+  archive.put()
+
+
+def FormatTime(value):
+  if value is None:
+    return None
+  return value.strftime(TIME_FORMAT)
+
+
+def ParseTime(value):
+  if value is None:
+    return None
+  return datetime.datetime.strptime(value, TIME_FORMAT)
+
+
+def GetCompletedTime(task):
+  """Returns when a completed Task completed.
+
+  Tasks which timed out before timeouts set completed_time are taken to
+  have completed when they were last assigned.
+  """
+  if (task.completed_time is None and
+      task.outcome == tasks.TaskOutcomes.TIMED_OUT):
+    return task.assigned_time
+  return task.completed_time
+
+
+def MakeArchiveRecord(task):
+  """Returns dict of a completed Task and its TaskResult to archive.
+
+  The Task's result should already be loaded, see tasks.AttachResults.
+  """
+  record = {}
+  record['task_id'] = task.key().id()
+  record['name'] = task.name
+  record['executor_requirements'] = task.executor_requirements
+  record['assigned_worker'] = task.assigned_worker
+  record['assigned_time'] = FormatTime(task.assigned_time)
+  record['completed_time'] = FormatTime(GetCompletedTime(task))
+  record['outcome'] = task.outcome
+  result = task.result
+  if result is not None:
+    result_class = tasks.TaskResult
+    record['result'] = {
+        'exit_code': result.exit_code,
+        'execution_time': result.execution_time,
+        'device_serial_number': result.device_serial_number,
+        'stdout_url': result.stdout_download_url,
+        'stderr_url': result.stderr_download_url,
+        'stdout_blobkey': MakeBlobKeyStr(
+            result_class.stdout.get_value_for_datastore(result)),
+        'stderr_blobkey': MakeBlobKeyStr(
+            result_class.stderr.get_value_for_datastore(result)),
+    }
+  else:
+    record['result'] = None
+  return record
+
+
+def MakeBlobKeyStr(blob_key):
+  if blob_key is None:
+    return None
+  return str(blob_key)
+
+
+def EncodeRecord(record):
+  """Returns record as a single line of compact JSON."""
+  return json.dumps(record, separators=(',', ':')) + '\n'
+
+
+def IsArchiveCursor(cursor):
+  return cursor is not None and cursor.startswith(ARCHIVE_CURSOR_PREFIX)
+
+
+def MakeArchiveCursor(archive_id, blob_index, offset):
+  return '%s%d:%d:%d' % (ARCHIVE_CURSOR_PREFIX, archive_id, blob_index,
+                         offset)
+
+
+def ParseArchiveCursor(cursor):
+  """Returns (archive_id, blob_index, offset) of an archive cursor.
+
+  Raises:
+    ValueError if cursor is not a valid archive cursor.
+  """
+  if not IsArchiveCursor(cursor):
+    raise ValueError('Not an archive cursor: %s' % cursor)
+  parts = cursor[len(ARCHIVE_CURSOR_PREFIX):].split(':')
+  if len(parts) != 3:
+    raise ValueError('Not an archive cursor: %s' % cursor)
+  return tuple(int(part) for part in parts)
+
+
+def IterArchivedRecords(after_date, before_date, cursor=None):
+  """Yields archived Task records completed after after_date.
+
+  Args:
+    after_date: Only records completed after this datetime are yielded.
+    before_date: If not None, only records completed no later than this
+                 datetime are yielded.
+    cursor: Archive cursor to resume from, or None.
+
+  Yields:
+    (record, next_cursor) where next_cursor resumes after record.
+
+  Raises:
+    ValueError if cursor is not an archive cursor of a readable archive.
+  """
+  archive_list = GetReadableArchives()
+  (resume_id, resume_blob_index, resume_offset) = (None, 0, 0)
+  if cursor is not None:
+    (resume_id, resume_blob_index, resume_offset) = ParseArchiveCursor(cursor)
+    if resume_id not in [archive.key().id() for archive in archive_list]:
+      raise ValueError('No readable archive %d: %s' % (resume_id, cursor))
+
+  for archive in archive_list:
+    archive_id = archive.key().id()
+    if resume_id is not None:
+      if archive_id != resume_id:
+        continue
+      resume_id = None
+    else:
+      (resume_blob_index, resume_offset) = (0, 0)
+    if archive.end_time <= after_date:
+      continue
+    if before_date is not None and archive.start_time >= before_date:
+      break
+
+    for blob_index in xrange(resume_blob_index, len(archive.blob_keys)):
+      reader = blobstore.BlobReader(archive.blob_keys[blob_index])
+      if blob_index == resume_blob_index:
+        reader.seek(resume_offset)
+      while True:
+        line = reader.readline()
+        if not line:
+          break
+        record = json.loads(line)
+        completed_time = ParseTime(record['completed_time'])
+        if completed_time <= after_date:
+          continue
+        if before_date is not None and completed_time > before_date:
+          continue
+        yield (record, MakeArchiveCursor(archive_id, blob_index,
+                                         reader.tell()))
@@ -16,8 +16,11 @@ __author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
 
 from google.appengine.ext import db
 
+import datetime
 import logging
 
+from util import paging
+
 
 class Error(Exception):
   pass
@@ -92,27 +95,83 @@ def AddOptionalModelIntProperty(model, src, prop):
       raise ClientEventError('%s is invalid. %s', prop, e)
 
 
-def CreateEvent(event):
-  """Creates an Event from the given event dictionary and stores it."""
+# Most Events created by a single CreateEvents, within one datastore put.
+MAX_EVENTS_PER_BATCH = 500
+
+
+def MakeEvent(event):
+  """Returns an unsaved Event from the given event dictionary.
+
+  An optional 'created' of seconds since the epoch keeps the time a worker
+  buffered the event at. Times in the future are replaced by now.
+
+  Raises:
+    ClientEventError on an invalid event dictionary.
+  """
   CheckRequiredProperty('Event', event, 'worker_name')
   CheckRequiredProperty('Event', event, 'event_type')
   CheckRequiredProperty('Event', event, 'event_severity')
   CheckRequiredProperty('Event', event, 'event_name')
 
-  e = Event(worker_name=event['worker_name'],
-            event_type=event['event_type'],
-            event_severity=event['event_severity'],
-            event_name=event['event_name'])
+  properties = {}
+  created = event.get('created', None)
+  if created is not None:
+    if isinstance(created, bool) or not isinstance(created, (int, float)):
+      raise ClientEventError('created must be seconds since the epoch.')
+    # Left out otherwise, so auto_now_add applies.
+    properties['created'] = min(datetime.datetime.fromtimestamp(created),
+                                datetime.datetime.now())
+
+  try:
+    e = Event(worker_name=event['worker_name'],
+              event_type=event['event_type'],
+              event_severity=event['event_severity'],
+              event_name=event['event_name'],
+              **properties)
+  except db.BadValueError, error:
+    raise ClientEventError('Event is invalid. %s' % error)
 
   AddOptionalModelStrProperty(e, event, 'worker_version')
   AddOptionalModelStrProperty(e, event, 'event_info')
   AddOptionalModelIntProperty(e, event, 'task_id')
   AddOptionalModelStrProperty(e, event, 'task_info')
+  return e
 
+
+def CreateEvent(event):
+  """Creates an Event from the given event dictionary and stores it."""
+  e = MakeEvent(event)
   if db.put(e):
     return e
 
 
+def CreateEvents(event_list):
+  """Creates Events from the given event dictionaries in a single put.
+
+  Nothing is stored unless every event dictionary is valid.
+
+  Returns:
+    List of created Events, in the order given.
+
+  Raises:
+    ClientEventError on an invalid event dictionary, or on over
+    MAX_EVENTS_PER_BATCH of them.
+  """
+  if len(event_list) > MAX_EVENTS_PER_BATCH:
+    raise ClientEventError(
+        'At most %d events may be created at once.' % MAX_EVENTS_PER_BATCH)
+  event_models = []
+  for (index, event) in enumerate(event_list):
+    if not isinstance(event, dict):
+      raise ClientEventError('Event %d is not an Event entity.' % index)
+    try:
+      event_models.append(MakeEvent(event))
+    except ClientEventError, e:
+      raise ClientEventError('Event %d: %s' % (index, e))
+  db.put(event_models)
+  return event_models
+
+
 def GetEventById(event_id):
   """Gets a single Event with given integer event_id."""
   event_key = db.Key.from_path('Event', event_id)
@@ -130,6 +189,43 @@ def DeleteEventById(event_id):
   return True
 
 
-def GetEventList():
-  """Returns all Events in a list."""
-  return Event.all().order('-__key__').fetch(1000)
+def ListEvents(worker_name=None, event_type=None, event_severity=None,
+               start_time=None, end_time=None, limit=100, cursor=None):
+  """Returns a page of Events matching all given filters, newest first.
+
+  Each equality filter has an index with created, so any combination of
+  them is served by merging those indexes.
+
+  Args:
+    worker_name: Only list Events of this worker, or None.
+    event_type: Only list Events of this type, or None.
+    event_severity: Only list Events of this severity, or None.
+    start_time: Only list Events created at or after this datetime, or None.
+    end_time: Only list Events created before this datetime, or None.
+    limit: Maximum number of Events to return as int.
+    cursor: Websafe cursor string to resume from, or None.
+
+  Returns:
+    (event_list, next_cursor) as in paging.FetchPage.
+
+  Raises:
+    ClientEventError on an unknown event_type or event_severity.
+  """
+  if event_type is not None and event_type not in EVENT_TYPES:
+    raise ClientEventError('Invalid event_type: %s' % event_type)
+  if event_severity is not None and event_severity not in EVENT_SEVERITY:
+    raise ClientEventError('Invalid event_severity: %s' % event_severity)
+
+  query = Event.all()
+  if worker_name is not None:
+    query.filter('worker_name =', worker_name)
+  if event_type is not None:
+    query.filter('event_type =', event_type)
+  if event_severity is not None:
+    query.filter('event_severity =', event_severity)
+  if start_time is not None:
+    query.filter('created >=', start_time)
+  if end_time is not None:
+    query.filter('created <', end_time)
+  query.order('-created')
+  return paging.FetchPage(query, limit, cursor)
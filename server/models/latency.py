@@ -0,0 +1,83 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Queue and run latency histograms per executor capability.
+
+Each latency is counted in its util.histogram bucket by a ProdEagle counter
+named 'Latency.<kind>.<capability>.<bucket>'. The harvest turns counters
+into models.timeseries buckets, so a histogram over any window is the sum
+of its counters' hour or day buckets.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from models import timeseries
+from util import histogram
+
+
+# Time from scheduled_time until assigned_time.
+QUEUE = 'Queue'
+# Time from the worker starting a Task until completed_time. Tasks assigned
+# in a batch only start once the worker is done with earlier ones.
+RUN = 'Run'
+
+KINDS = (QUEUE, RUN)
+
+PERCENTILES = (50, 90, 99)
+
+
+def GetSeconds(start_time, end_time):
+  return max(0.0, (end_time - start_time).total_seconds())
+
+
+def MakeCounterName(kind, capability, bucket):
+  return 'Latency.%s.%s.%d' % (kind, capability, bucket)
+
+
+def Record(counters, kind, capability, start_time, end_time):
+  """Counts a latency in a counter.Batch, if both times are known."""
+  if not capability or start_time is None or end_time is None:
+    return
+  bucket = histogram.GetBucket(GetSeconds(start_time, end_time))
+  counters.incr(MakeCounterName(kind, capability, bucket))
+
+
+def GetHistogram(kind, capability, start_time, end_time,
+                 resolution=timeseries.HOUR):
+  """Returns histogram of latencies counted from start_time to end_time."""
+  names = [MakeCounterName(kind, capability, bucket)
+           for bucket in xrange(histogram.NUM_BUCKETS)]
+  totals = timeseries.GetTotals(names, resolution, start_time, end_time)
+  return [totals.get(name, 0) for name in names]
+
+
+def MakeHistogramDict(counts):
+  """Returns a mrtaskman#latency_histogram dict of a histogram."""
+  histogram_dict = {}
+  histogram_dict['kind'] = 'mrtaskman#latency_histogram'
+  histogram_dict['count'] = sum(counts)
+  histogram_dict['buckets'] = [
+      {'upper_seconds': histogram.GetUpperBound(bucket), 'count': count}
+      for (bucket, count) in enumerate(counts) if count]
+  for percentile in PERCENTILES:
+    histogram_dict['p%d' % percentile] = histogram.GetPercentile(
+        counts, percentile)
+  return histogram_dict
+
+
+def GetLatencies(capability, hours=24, now=None):
+  """Returns {kind: mrtaskman#latency_histogram} over the last hours."""
+  (resolution, start_time, end_time) = timeseries.GetRecentWindow(hours, now)
+  return dict([(kind, MakeHistogramDict(
+                   GetHistogram(kind, capability, start_time, end_time,
+                                resolution)))
+               for kind in KINDS])
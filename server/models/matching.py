@@ -0,0 +1,128 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Inverted index from capability terms to scheduled Tasks.
+
+The postings of a term list the best-ranked scheduled Tasks anchored on it
+as (queue_rank, task_id, executors, expression) entries, kept in memcache.
+Assign reads the postings of all of a worker's terms with one memcache call
+and checks requirements without touching the datastore, so its cost does
+not grow with the number of capabilities a worker has.
+
+Postings are only hints. Assign re-checks each Task in a transaction and
+drops stale entries, and missing postings are rebuilt from the datastore.
+A worker matching too few cached entries of a truncated term has Assign
+read further entries from the datastore, so it is not starved by Tasks
+ranked ahead of those it can run.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import memcache
+
+import heapq
+
+from util import requirements
+
+
+POSTINGS_KEY_PREFIX = 'postings:'
+# Most entries kept per term. Longer postings are marked truncated, and are
+# rebuilt from the datastore once their entries run out.
+MAX_POSTINGS = 100
+# Postings are rebuilt from the datastore at least this often, which also
+# picks up Tasks a rebuild racing with Schedule left out.
+POSTINGS_SECONDS = 60
+CAS_ATTEMPTS = 3
+
+
+def GetPostings(terms):
+  """Returns dict of {term: (entries, truncated)} of cached terms."""
+  return memcache.get_multi(terms, key_prefix=POSTINGS_KEY_PREFIX)
+
+
+def SetPostings(term, entries, truncated):
+  entries = sorted(entries)
+  if len(entries) > MAX_POSTINGS:
+    entries = entries[:MAX_POSTINGS]
+    truncated = True
+  memcache.set(POSTINGS_KEY_PREFIX + term, (entries, truncated),
+               time=POSTINGS_SECONDS)
+
+
+def UpdatePostings(term, update):
+  """Replaces cached entries of term with update(entries), if cached."""
+  client = memcache.Client()
+  key = POSTINGS_KEY_PREFIX + term
+  for _ in xrange(CAS_ATTEMPTS):
+    cached = client.gets(key)
+    if cached is None:
+      # The next read rebuilds it from the datastore.
+      return
+    (entries, truncated) = cached
+    entries = update(entries)
+    if len(entries) > MAX_POSTINGS:
+      entries = entries[:MAX_POSTINGS]
+      truncated = True
+    if client.cas(key, (entries, truncated), time=POSTINGS_SECONDS):
+      return
+  # Too contended to update; have the next read rebuild it instead.
+  client.delete(key)
+
+
+def AddPosting(terms, entry):
+  for term in terms:
+    UpdatePostings(term, lambda entries: sorted(entries + [entry]))
+
+
+def RemovePostings(terms, task_ids):
+  task_ids = set(task_ids)
+  for term in terms:
+    UpdatePostings(term, lambda entries: [entry for entry in entries
+                                          if entry[1] not in task_ids])
+
+
+def Matches(entry, executor_capabilities, attributes):
+  """Returns True iff a worker may run the Task of entry."""
+  (_, _, executors, expression) = entry
+  if executors and not executor_capabilities.intersection(executors):
+    return False
+  if expression and not requirements.Evaluate(requirements.Parse(expression),
+                                              attributes):
+    return False
+  return True
+
+
+def MergeCandidates(postings, executor_capabilities, attributes, limit):
+  """Returns best-ranked entries a worker may run, across terms.
+
+  Args:
+    postings: Dict of {term: entries} of the worker's terms.
+    executor_capabilities: Set of the worker's executor capabilities.
+    attributes: Dict of the worker's attributes.
+    limit: Most entries to return as int.
+
+  Returns:
+    List of up to limit (entry, term) with distinct Tasks, by queue_rank.
+  """
+  merged = heapq.merge(*[[(entry, term) for entry in entries]
+                         for (term, entries) in postings.iteritems()])
+  candidates = []
+  seen = set()
+  for (entry, term) in merged:
+    if entry[1] in seen:
+      continue
+    seen.add(entry[1])
+    if Matches(entry, executor_capabilities, attributes):
+      candidates.append((entry, term))
+      if len(candidates) >= limit:
+        break
+  return candidates
@@ -14,12 +14,10 @@
 
 __author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
 
-from google.appengine.api import taskqueue
 from google.appengine.ext import db
 from google.appengine.ext.blobstore import blobstore
 
 import logging
-import webapp2
 
 from third_party.prodeagle import counter
 
@@ -115,6 +113,10 @@ def GetPackageFilesByPackageNameAndVersion(name, version):
 
 
 def DeletePackageByNameAndVersion(name, version):
+  """Deletes a Package and its PackageFiles, then the files' blobs.
+
+  Blobs are only deleted once the PackageFiles referring to them are.
+  """
   def tx():
     package_key = MakePackageKey(name, version)
     package_keys = [package_key]
@@ -131,36 +133,11 @@ def DeletePackageByNameAndVersion(name, version):
       except:
         continue
 
-    # TODO(jeff.carollo): Make sure this doesn't sometimes leak.
-    if blob_keys:
-      logging.info('Deleting %d files from %d package files.',
-                   len(blob_keys), len(package_files))
-      blobstore.delete_async(blob_keys)
-
     db.delete(package_keys)
-  return db.run_in_transaction(tx)
-
-
-class BulkDeleteHandler(webapp2.RequestHandler):
-  def get(self):
-    name = self.request.get('name', 'monkey')
-    task = taskqueue.Task(
-        method='POST',
-        params={'name': name},
-        url='/packages/deleteall')
-    task.add()
-    self.response.out.write('Task enqueued.')
-
-  def post(self):
-    name = self.request.get('name', 'monkey')
-    while True:
-      packages = Package.all().filter('name=', name).fetch(limit=20)
-      if not packages:
-        return
-      for package in packages:
-        DeletePackageByNameAndVersion(package.name, package.version)
-
-
-app = webapp2.WSGIApplication([
-    ('/packages/deleteall', BulkDeleteHandler),
-])
+    return (blob_keys, len(package_files))
+  (blob_keys, num_package_files) = db.run_in_transaction(tx)
+
+  if blob_keys:
+    logging.info('Deleting %d files from %d package files.',
+                 len(blob_keys), num_package_files)
+    blobstore.delete(blob_keys)
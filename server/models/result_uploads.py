@@ -0,0 +1,152 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Garbage collection of orphaned Task result blobs.
+
+Blobstore stores uploaded STDOUT and STDERR before any handler runs, so a
+result upload which fails, times out or duplicates an earlier upload leaves
+blobs no TaskResult refers to. Each upload is recorded as a ResultUpload
+while it is processed, and the record is deleted once every blob was either
+stored or deleted. Only uploads whose request died midway leave a record. A
+cron job later checks old ResultUploads against the TaskResults of their
+Tasks, deleting unreferenced blobs in batches, and chains further runs
+until no old ResultUploads are left.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import blobstore
+from google.appengine.ext import db
+
+import datetime
+import logging
+import webapp2
+
+from third_party.prodeagle import counter
+from models import tasks
+from util import middleware
+
+
+COLLECT_URL = '/tasks/collect_orphaned_blobs'
+
+# Uploads younger than this may still be being processed.
+COLLECT_AFTER = datetime.timedelta(hours=1)
+# Most ResultUploads checked at once.
+COLLECT_BATCH_SIZE = 100
+# Most batches checked by a single collection before chaining another.
+MAX_BATCHES_PER_COLLECT = 10
+
+
+class ResultUpload(db.Model):
+  """Blobs uploaded in a single request with results of task_ids."""
+  task_ids = db.ListProperty(int, indexed=False)
+  blob_keys = db.ListProperty(blobstore.BlobKey, indexed=False)
+  created_time = db.DateTimeProperty(auto_now_add=True)
+
+
+def RecordUpload(task_ids, blob_keys):
+  """Starts recording blobs uploaded with results of task_ids, if any.
+
+  The record is written while the upload is processed.
+
+  Returns:
+    Pending record to pass to ClearUpload once every blob was stored or
+    deleted, or None if there were no blobs.
+  """
+  if not blob_keys:
+    return None
+  return db.put_async(
+      ResultUpload(task_ids=list(task_ids), blob_keys=list(blob_keys)))
+
+
+def ClearUpload(pending_upload):
+  """Deletes the record of an upload which left no orphaned blobs."""
+  if pending_upload is None:
+    return
+  db.delete(pending_upload.get_result())
+
+
+def GetReferencedBlobKeys(task_ids):
+  """Returns set of blob keys referenced by TaskResults of given Tasks."""
+  task_keys = [db.Key.from_path('TaskParent', '0', 'Task', task_id)
+               for task_id in set(task_ids)]
+  result_keys = [tasks.Task.result.get_value_for_datastore(task)
+                 for task in db.get(task_keys) if task is not None]
+  result_keys = [key for key in result_keys if key is not None]
+  referenced = set()
+  if not result_keys:
+    return referenced
+  for result in db.get(result_keys):
+    if result is None:
+      continue
+    for prop in (tasks.TaskResult.stdout, tasks.TaskResult.stderr):
+      blob_key = prop.get_value_for_datastore(result)
+      if blob_key is not None:
+        referenced.add(blob_key)
+  return referenced
+
+
+def CollectOrphanedBlobs(now=None):
+  """Deletes unreferenced blobs of ResultUploads older than COLLECT_AFTER.
+
+  If old ResultUploads remain after MAX_BATCHES_PER_COLLECT batches, queues
+  another collection to carry on.
+
+  Returns:
+    Number of blobs deleted as int.
+  """
+  now = now or datetime.datetime.now()
+  cutoff = now - COLLECT_AFTER
+  deleted = 0
+  for _ in xrange(MAX_BATCHES_PER_COLLECT):
+    uploads = (ResultUpload.all()
+                           .filter('created_time <', cutoff)
+                           .order('created_time')
+                           .fetch(COLLECT_BATCH_SIZE))
+    if not uploads:
+      break
+    task_ids = []
+    for upload in uploads:
+      task_ids.extend(upload.task_ids)
+    referenced = GetReferencedBlobKeys(task_ids)
+    orphans = []
+    for upload in uploads:
+      orphans.extend([blob_key for blob_key in upload.blob_keys
+                      if blob_key not in referenced])
+    if orphans:
+      blobstore.delete(orphans)
+    db.delete(uploads)
+    deleted += len(orphans)
+    if len(uploads) < COLLECT_BATCH_SIZE:
+      break
+  else:
+    taskqueue.add(url=COLLECT_URL)
+  counter.incr('Tasks.OrphanedBlobsDeleted', deleted)
+  return deleted
+
+
+class CollectOrphanedBlobsHandler(webapp2.RequestHandler):
+  """Runs an orphaned blob collection from cron."""
+
+  def get(self):
+    deleted = CollectOrphanedBlobs()
+    logging.info('Deleted %d orphaned result blobs.', deleted)
+
+  def post(self):
+    self.get()
+
+
+app = webapp2.WSGIApplication([
+    (COLLECT_URL, CollectOrphanedBlobsHandler),
+    ], debug=True)
+app = middleware.WrapApp(app)
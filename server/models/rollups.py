@@ -0,0 +1,324 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Hourly and daily rollups of Task outcomes per device.
+
+Each uploaded TaskResult or timed out Task queues a small record on a pull
+queue inside the transaction completing the Task. A cron job leases queued
+records and folds them into ResultRollup entities per device, or
+TimeoutRollup entities per worker, so device health can be read without
+scanning every TaskResult. Hourly rollups are children of their
+day's rollup, letting one transaction update a day and its hours together.
+Hourly rollups remember the records folded into them, so a record folded
+again after its delete failed is skipped.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import datetime
+import json
+import logging
+import webapp2
+
+from third_party.prodeagle import counter
+from util import db_properties
+from util import middleware
+
+
+# Pull queue holding one record per uploaded TaskResult.
+RESULTS_QUEUE = 'result-rollups'
+UPDATE_URL = '/rollups/update'
+
+# Most records leased at once, the pull queue maximum.
+MAX_LEASE_SIZE = 1000
+# Most leases folded in by a single update.
+MAX_LEASES_PER_UPDATE = 10
+LEASE_SECONDS = 60
+
+HOUR = 'hour'
+DAY = 'day'
+
+# Rollup device for results which did not involve a device.
+NO_DEVICE = 'none'
+# Rollup worker for timeouts of Tasks with no assigned worker.
+NO_WORKER = 'none'
+
+HOUR_FORMAT = '%Y-%m-%dT%H'
+
+
+class ResultRollup(db.Model):
+  """Counts of Task outcomes on one device over one hour or day."""
+  # Property naming what the rollup counts Tasks of.
+  OWNER_PROPERTY = 'device_serial_number'
+
+  period = db.StringProperty(required=True, choices=(HOUR, DAY))
+  start_time = db.DateTimeProperty(required=True)
+  device_serial_number = db.StringProperty(required=True)
+  completed = db.IntegerProperty(required=True, default=0)
+  successes = db.IntegerProperty(required=True, default=0)
+  failures = db.IntegerProperty(required=True, default=0)
+  # Sum of execution times in seconds, for average run time.
+  execution_time = db.FloatProperty(required=True, default=0.0)
+  # Dict of {str(exit_code): count}.
+  exit_codes = db_properties.JsonProperty(required=False)
+  # Names of pull queue records folded in. Only kept on hourly rollups.
+  folded_records = db.StringListProperty(indexed=False)
+
+  def ApplyDelta(self, delta):
+    self.completed += delta.completed
+    self.successes += delta.successes
+    self.failures += delta.failures
+    self.execution_time += delta.execution_time
+    exit_codes = dict(self.exit_codes or {})
+    for (exit_code, count) in delta.exit_codes.iteritems():
+      exit_codes[exit_code] = exit_codes.get(exit_code, 0) + count
+    self.exit_codes = exit_codes
+
+
+class TimeoutRollup(db.Model):
+  """Counts of Tasks timed out on one worker over one hour or day.
+
+  No result names the device a timed out Task ran on, so timeouts are
+  counted against the worker the Task was assigned to.
+  """
+  OWNER_PROPERTY = 'worker'
+
+  period = db.StringProperty(required=True, choices=(HOUR, DAY))
+  start_time = db.DateTimeProperty(required=True)
+  worker = db.StringProperty(required=True)
+  timeouts = db.IntegerProperty(required=True, default=0)
+  # Sum of seconds from assignment until timing out.
+  execution_time = db.FloatProperty(required=True, default=0.0)
+  folded_records = db.StringListProperty(indexed=False)
+
+  def ApplyDelta(self, delta):
+    self.timeouts += delta.completed
+    self.execution_time += delta.execution_time
+
+
+def MakeDayRollupKey(owner, day, model_class=ResultRollup):
+  return db.Key.from_path(
+      model_class.kind(), '%s:%s' % (day.strftime('%Y-%m-%d'), owner))
+
+
+def MakeHourRollupKey(day_key, hour):
+  return db.Key.from_path(day_key.kind(), hour.strftime('%H'),
+                          parent=day_key)
+
+
+def EnqueueResult(device_serial_number, exit_code, completed_time,
+                  execution_time):
+  """Queues a completed TaskResult to be folded into rollups.
+
+  Must be called inside of the datastore transaction uploading the result.
+  """
+  payload = json.dumps({
+      'device': device_serial_number or NO_DEVICE,
+      'hour': completed_time.strftime(HOUR_FORMAT),
+      'exit_code': exit_code,
+      'execution_time': execution_time or 0.0,
+  })
+  taskqueue.Task(method='PULL', payload=payload).add(
+      queue_name=RESULTS_QUEUE, transactional=True)
+
+
+def EnqueueTimeout(worker, completed_time, execution_time):
+  """Queues a timed out Task to be folded into TimeoutRollups.
+
+  Must be called inside of the datastore transaction timing out the Task.
+  """
+  payload = json.dumps({
+      'worker': worker or NO_WORKER,
+      'hour': completed_time.strftime(HOUR_FORMAT),
+      'execution_time': execution_time or 0.0,
+      'timed_out': True,
+  })
+  taskqueue.Task(method='PULL', payload=payload).add(
+      queue_name=RESULTS_QUEUE, transactional=True)
+
+
+class RollupDelta(object):
+  """Counts to add to a single rollup."""
+
+  def __init__(self):
+    self.completed = 0
+    self.successes = 0
+    self.failures = 0
+    self.execution_time = 0.0
+    self.exit_codes = {}
+
+  def Add(self, record):
+    self.completed += 1
+    self.execution_time += record.execution_time
+    if record.exit_code is None:
+      return
+    if record.exit_code == 0:
+      self.successes += 1
+    else:
+      self.failures += 1
+    exit_code = str(record.exit_code)
+    self.exit_codes[exit_code] = self.exit_codes.get(exit_code, 0) + 1
+
+
+class ResultRecord(object):
+  """A queued result or timeout record parsed from its pull task."""
+
+  def __init__(self, leased):
+    record = json.loads(leased.payload)
+    self.name = leased.name
+    self.hour = datetime.datetime.strptime(record['hour'], HOUR_FORMAT)
+    if record.get('timed_out', False):
+      self.model_class = TimeoutRollup
+      self.owner = record['worker']
+      self.exit_code = None
+    else:
+      self.model_class = ResultRollup
+      self.owner = record['device']
+      self.exit_code = int(record['exit_code'])
+    self.execution_time = float(record['execution_time'])
+
+
+class DayDeltas(object):
+  """Records to fold into one owner's day rollup and its hour rollups."""
+
+  def __init__(self, model_class, owner, day):
+    self.model_class = model_class
+    self.owner = owner
+    self.day = day
+    self.hour_records = {}
+    self.leased_tasks = []
+
+  def Add(self, record, leased):
+    self.hour_records.setdefault(record.hour, []).append(record)
+    self.leased_tasks.append(leased)
+
+  def Apply(self):
+    """Adds the records to stored rollups in a single transaction.
+
+    Records already folded into their hour's rollup are skipped.
+    """
+    day_key = MakeDayRollupKey(self.owner, self.day, self.model_class)
+    hours = sorted(self.hour_records)
+    keys = [day_key] + [MakeHourRollupKey(day_key, hour) for hour in hours]
+    starts = [(DAY, self.day)] + [(HOUR, hour) for hour in hours]
+    def tx():
+      rollups = db.get(keys)
+      for i in xrange(len(keys)):
+        if rollups[i] is None:
+          (period, start_time) = starts[i]
+          rollups[i] = self.model_class(
+              key=keys[i], period=period, start_time=start_time,
+              **{self.model_class.OWNER_PROPERTY: self.owner})
+      day_delta = RollupDelta()
+      for (hour, hour_rollup) in zip(hours, rollups[1:]):
+        folded = set(hour_rollup.folded_records)
+        hour_delta = RollupDelta()
+        for record in self.hour_records[hour]:
+          if record.name in folded:
+            continue
+          folded.add(record.name)
+          hour_rollup.folded_records.append(record.name)
+          hour_delta.Add(record)
+          day_delta.Add(record)
+        hour_rollup.ApplyDelta(hour_delta)
+      rollups[0].ApplyDelta(day_delta)
+      db.put(rollups)
+    db.run_in_transaction(tx)
+
+
+def GroupLeasedResults(leased_tasks):
+  """Returns list of DayDeltas summing given leased records."""
+  day_deltas = {}
+  for leased in leased_tasks:
+    try:
+      record = ResultRecord(leased)
+    except (ValueError, KeyError, TypeError), e:
+      logging.error('Dropping bad rollup record %r: %s', leased.payload, e)
+      counter.incr('Rollups.BadRecord')
+      taskqueue.Queue(RESULTS_QUEUE).delete_tasks(leased)
+      continue
+    day = record.hour.replace(hour=0)
+    group_key = (record.model_class.kind(), record.owner, day)
+    deltas = day_deltas.get(group_key, None)
+    if deltas is None:
+      deltas = DayDeltas(record.model_class, record.owner, day)
+      day_deltas[group_key] = deltas
+    deltas.Add(record, leased)
+  return day_deltas.values()
+
+
+def UpdateRollups():
+  """Folds queued records into ResultRollups and TimeoutRollups.
+
+  Records are only deleted once their rollups committed, so a failed update
+  leaves them to be retried when their lease expires. Rollups skip records
+  they already folded in, so a record whose delete failed, or whose commit
+  timed out yet succeeded, is not counted twice.
+
+  Returns:
+    Number of result records folded in as int.
+  """
+  queue = taskqueue.Queue(RESULTS_QUEUE)
+  folded = 0
+  for _ in xrange(MAX_LEASES_PER_UPDATE):
+    leased_tasks = queue.lease_tasks(LEASE_SECONDS, MAX_LEASE_SIZE)
+    if not leased_tasks:
+      break
+    for deltas in GroupLeasedResults(leased_tasks):
+      try:
+        deltas.Apply()
+      except db.Error, e:
+        logging.exception(e)
+        counter.incr('Rollups.UpdateFailed')
+        continue
+      queue.delete_tasks(deltas.leased_tasks)
+      folded += len(deltas.leased_tasks)
+    if len(leased_tasks) < MAX_LEASE_SIZE:
+      break
+  counter.incr('Rollups.Folded', folded)
+  return folded
+
+
+def MakeRollupQuery(period, start_time, end_time, owner=None,
+                    model_class=ResultRollup):
+  """Returns query for rollups of period starting in [start_time, end_time).
+
+  Rollups are ordered by start_time. Rollups of all devices, or workers for
+  TimeoutRollups, are included unless owner is given.
+  """
+  assert period in (HOUR, DAY)
+  query = model_class.all().filter('period =', period)
+  if owner:
+    query = query.filter('%s =' % model_class.OWNER_PROPERTY, owner)
+  return (query.filter('start_time >=', start_time)
+               .filter('start_time <', end_time)
+               .order('start_time'))
+
+
+class UpdateRollupsHandler(webapp2.RequestHandler):
+  """Runs a rollup update from cron."""
+
+  def get(self):
+    folded = UpdateRollups()
+    logging.info('Folded %d results into rollups.', folded)
+
+  def post(self):
+    self.get()
+
+
+app = webapp2.WSGIApplication([
+    (UPDATE_URL, UpdateRollupsHandler),
+    ], debug=True)
+app = middleware.WrapApp(app)
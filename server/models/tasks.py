@@ -24,12 +24,22 @@ from google.appengine.ext.db import datastore_query
 import datetime
 import json
 import logging
+import time
 import urllib
 import webapp2
 
 from third_party.prodeagle import counter
+from models import latency
+from models import matching
+from models import rollups
+from models import webhooks
+from models import timings
 from util import db_properties
+from util import middleware
+from util import paging
 from util import parsetime
+from util import requirements
+from util import tracing
 
 
 class Error(Exception):
@@ -68,6 +78,10 @@ class TaskResult(db.Model):
   device_serial_number = db.StringProperty(required=False)
   result_metadata = db.TextProperty(required=False)
   worker_log = db.TextProperty(required=False)
+  # Idempotency key the worker sent with the result, reused across retries.
+  upload_key = db.StringProperty(required=False, indexed=False)
+  # mrtaskman#worker_timings the worker reported, as JSON.
+  worker_timings = db.TextProperty(required=False)
 
 
 class Task(db.Model):
@@ -88,13 +102,28 @@ class Task(db.Model):
       default=TaskStates.SCHEDULED)
   attempts = db.IntegerProperty(required=True, default=0)
   max_attempts = db.IntegerProperty(required=True, default=3)
+  # Executors any of which may run the Task. Tasks given only a requirement
+  # expression hold its anchor terms instead, see requirements.GetAnchorTerms.
   executor_requirements = db.StringListProperty(required=True)
+  # Requirement expression over worker attributes, see util.requirements.
+  requirement_expression = db.TextProperty(required=False)
   priority = db.IntegerProperty(required=True, default=0)
   webhook = db.StringProperty(required=False)
+  # Derived from config at schedule time so it need not be parsed again.
+  # Seconds an assigned task may run before timing out.
+  timeout_seconds = db.IntegerProperty(required=False)
+  # Required packages as 'name.version' strs.
+  packages = db.StringListProperty()
+  # Position in the queue set by the scheduler policy; lowest goes first.
+  queue_rank = db.FloatProperty(required=False)
+  # Group whose Tasks share the queue fairly with other groups.
+  share_group = db.StringProperty(required=False)
 
   # Set once state == TaskStates.ASSIGNED.
   assigned_time = db.DateTimeProperty(required=False)
   assigned_worker = db.TextProperty(required=False)
+  # Capability of the worker the Task was matched by.
+  assigned_capability = db.StringProperty(required=False, indexed=False)
 
   # Set once state == TaskStates.COMPLETE.
   completed_time = db.DateTimeProperty(required=False)
@@ -110,6 +139,26 @@ def MakeParentKey():
   return db.Key.from_path('TaskParent', '0')
 
 
+class ExecutorPause(db.Model):
+  """Marks the executor named by its key_name as paused.
+
+  Memcache fronts these so Assign rarely reads them, but they keep
+  executors paused across memcache flushes.
+  """
+  paused_time = db.DateTimeProperty(auto_now_add=True)
+
+
+# Values cached in memcache for an executor's pause state.
+PAUSED = 'paused'
+RUNNING = 'running'
+
+# How long this instance trusts its own copy of pause states.
+PAUSE_CACHE_SECONDS = 10
+
+# {executor: (paused, expiry time)} of pause states seen by this instance.
+_pause_cache = {}
+
+
 def MakeExecutorPauseKey(executor):
   """Returns a db.Key corresponding to given executor."""
   return db.Key.from_path('ExecutorPause', executor)
@@ -117,8 +166,10 @@ def MakeExecutorPauseKey(executor):
 
 def PauseExecutor(executor):
   """Temporarily pauses execution for given executor."""
+  db.put(ExecutorPause(key=MakeExecutorPauseKey(executor)))
+  _pause_cache.pop(executor, None)
   key = str(MakeExecutorPauseKey(executor))
-  memcache.set(key, 'paused')
+  memcache.set(key, PAUSED)
 
 
 def ResumeExecutor(executor):
@@ -126,32 +177,276 @@ def ResumeExecutor(executor):
 
   Returns 0 on network failure, non-zero otherwise.
   """
+  db.delete(MakeExecutorPauseKey(executor))
+  _pause_cache.pop(executor, None)
   key = str(MakeExecutorPauseKey(executor))
-  return memcache.delete(key)
+  return memcache.set(key, RUNNING)
+
+
+def GetPausedExecutors(executors):
+  """Returns the set of given executors which are paused.
+
+  Consults this instance's recent pause states first, then memcache with a
+  single get_multi, then the datastore with a single batch get for any
+  executors memcache has forgotten.
+  """
+  now = time.time()
+  paused = set()
+  unknown = []
+  for executor in executors:
+    cached = _pause_cache.get(executor, None)
+    if cached is not None and cached[1] > now:
+      if cached[0]:
+        paused.add(executor)
+    else:
+      unknown.append(executor)
+  if not unknown:
+    return paused
+
+  keys = dict((str(MakeExecutorPauseKey(executor)), executor)
+              for executor in unknown)
+  states = {}
+  for (key, value) in memcache.get_multi(keys.keys()).iteritems():
+    states[keys[key]] = (value == PAUSED)
+
+  forgotten = [executor for executor in unknown if executor not in states]
+  if forgotten:
+    pauses = db.get([MakeExecutorPauseKey(executor)
+                     for executor in forgotten])
+    missing = {}
+    for (executor, pause) in zip(forgotten, pauses):
+      states[executor] = pause is not None
+      missing[str(MakeExecutorPauseKey(executor))] = (
+          PAUSED if pause is not None else RUNNING)
+    memcache.set_multi(missing)
+
+  expiry = now + PAUSE_CACHE_SECONDS
+  for (executor, is_paused) in states.iteritems():
+    _pause_cache[executor] = (is_paused, expiry)
+    if is_paused:
+      paused.add(executor)
+  return paused
 
 
 def IsExecutorPaused(executor):
   """Returns True iff executor is paused. False otherwise."""
-  key = str(MakeExecutorPauseKey(executor))
-  paused = memcache.get(key)
-  return bool(memcache.get(key))
+  return executor in GetPausedExecutors([executor])
+
 
+# Scheduler policy.
+#
+# Scheduled Tasks are assigned in order of queue_rank, a virtual time in
+# seconds since the epoch:
+#  - Tasks of one share group and priority are ranked in FIFO order.
+#  - Each priority level counts as AGING_SECONDS_PER_PRIORITY of waiting,
+#    so a Task overtakes Tasks one level above it once it has waited that
+#    much longer than they have.
+#  - Consecutive Tasks of one share group are ranked at least
+#    FAIR_SHARE_STEP_SECONDS apart, so a large batch interleaves with other
+#    groups' Tasks instead of starving them.
+#  - A share group's Tasks are never ranked over MAX_SHARE_LEAD_SECONDS
+#    ahead of now, so a burst stops counting against the group as time
+#    passes, and cannot outweigh more than a few priority levels.
+AGING_SECONDS_PER_PRIORITY = 10 * 60
+FAIR_SHARE_STEP_SECONDS = 60
+MAX_SHARE_LEAD_SECONDS = 3 * AGING_SECONDS_PER_PRIORITY
+
+# How Tasks are grouped for fair sharing.
+SHARE_BY_NAME_PREFIX = 'name_prefix'
+SHARE_BY_SUBMITTER = 'submitter'
+FAIR_SHARE_BY = SHARE_BY_NAME_PREFIX
+
+
+def GetShareGroup(name, scheduled_by):
+  """Returns the share group of a Task with given name and submitter.
+
+  Name prefixes are the part of the name before its first '.'. Tasks without
+  a submitter are grouped by name prefix.
+  """
+  if FAIR_SHARE_BY == SHARE_BY_SUBMITTER and scheduled_by is not None:
+    return 'submitter:%s' % scheduled_by.email()
+  return 'name:%s' % name.split('.', 1)[0]
 
-def Schedule(name, config, scheduled_by, executor_requirements, priority=0):
-  """Adds a new Task with given name, config, user and requirements."""
-  webhook = json.loads(config)['task'].get('webhook', None)
+
+SHARE_RANK_KEY_PREFIX = 'share_rank:'
+SHARE_RANK_CAS_ATTEMPTS = 3
+
+
+def ReserveShareRank(share_group, now):
+  """Returns the next queue_rank before priority for share_group.
+
+  The rank of the group's next Task is kept in memcache. It never leads now
+  by much more than MAX_SHARE_LEAD_SECONDS, so losing it, or giving up on a
+  contended update, only ranks a Task as if its group were idle.
+  """
+  client = memcache.Client()
+  key = SHARE_RANK_KEY_PREFIX + share_group
+  expires_in = MAX_SHARE_LEAD_SECONDS + FAIR_SHARE_STEP_SECONDS
+  rank = now
+  for _ in xrange(SHARE_RANK_CAS_ATTEMPTS):
+    next_rank = client.gets(key)
+    if next_rank is None:
+      rank = now
+      if client.add(key, rank + FAIR_SHARE_STEP_SECONDS, time=expires_in):
+        return rank
+      continue
+    rank = max(now, min(next_rank, now + MAX_SHARE_LEAD_SECONDS))
+    if client.cas(key, rank + FAIR_SHARE_STEP_SECONDS, time=expires_in):
+      return rank
+  return rank
+
+
+def MakeQueueRank(share_rank, priority):
+  return share_rank - priority * AGING_SECONDS_PER_PRIORITY
+
+
+@tracing.Traced('tasks.Schedule')
+def Schedule(name, config, scheduled_by, executor_requirements, priority=0,
+             requirement_expression=None):
+  """Adds a new Task with given name, parsed config, user and requirements.
+
+  A Task may require any of executor_requirements, a requirement_expression
+  over worker attributes, or both.
+  """
+  assert executor_requirements or requirement_expression
+  if not executor_requirements:
+    executor_requirements = requirements.GetAnchorTerms(
+        requirements.Parse(requirement_expression))
+  webhook = config['task'].get('webhook', None)
+  timeout = ParseTaskTimeout(config)
+  share_group = GetShareGroup(name, scheduled_by)
+  queue_rank = MakeQueueRank(ReserveShareRank(share_group, time.time()),
+                             priority)
   task = Task(parent=MakeParentKey(),
               name=name,
               config=config,
               scheduled_by=scheduled_by,
               executor_requirements=executor_requirements,
+              requirement_expression=requirement_expression,
               priority=priority,
-              webhook=webhook)
+              webhook=webhook,
+              timeout_seconds=int(timeout.total_seconds()),
+              packages=GetPackageStrings(config),
+              queue_rank=queue_rank,
+              share_group=share_group)
   db.put(task)
+  matching.AddPosting(task.executor_requirements, MakePosting(task))
   counter.incr('Tasks.Scheduled')
   return task
 
 
+def MakePosting(task):
+  """Returns the entry of a scheduled Task in capability postings."""
+  queue_rank = task.queue_rank
+  if queue_rank is None:
+    # Tasks scheduled before queue_rank existed rank by age and priority.
+    queue_rank = MakeQueueRank(time.mktime(task.scheduled_time.timetuple()),
+                               task.priority)
+  executors = [executor for executor in task.executor_requirements
+               if not executor.startswith(
+                   requirements.ATTRIBUTE_TERM_PREFIX)]
+  return (queue_rank, task.key().id(), executors,
+          task.requirement_expression)
+
+
+def LoadPostings(term):
+  """Returns (entries, truncated) of scheduled Tasks anchored on term."""
+  ranked = (Task.all()
+                .ancestor(MakeParentKey())
+                .filter('state =', TaskStates.SCHEDULED)
+                .filter('executor_requirements =', term)
+                .order('queue_rank')
+                .fetch(limit=matching.MAX_POSTINGS))
+  # Tasks scheduled before queue_rank existed are not in the rank index.
+  # Only those not already fetched as ranked Tasks are read in full.
+  unranked_keys = (Task.all(keys_only=True)
+                       .ancestor(MakeParentKey())
+                       .filter('state =', TaskStates.SCHEDULED)
+                       .filter('executor_requirements =', term)
+                       .order('-priority')
+                       .fetch(limit=matching.MAX_POSTINGS))
+  ranked_keys = set([task.key() for task in ranked])
+  unranked = db.get([key for key in unranked_keys if key not in ranked_keys])
+  entries = [MakePosting(task) for task in ranked]
+  entries.extend(MakePosting(task) for task in unranked
+                 if task is not None and task.queue_rank is None)
+  truncated = (len(ranked) >= matching.MAX_POSTINGS or
+               len(unranked_keys) >= matching.MAX_POSTINGS)
+  return (entries, truncated)
+
+
+def LoadPostingsAfter(term, queue_rank):
+  """Returns entries of scheduled Tasks on term ranked after queue_rank."""
+  ranked = (Task.all()
+                .ancestor(MakeParentKey())
+                .filter('state =', TaskStates.SCHEDULED)
+                .filter('executor_requirements =', term)
+                .filter('queue_rank >', queue_rank)
+                .order('queue_rank')
+                .fetch(limit=matching.MAX_POSTINGS))
+  return [MakePosting(task) for task in ranked]
+
+
+def GetPostings(terms):
+  """Returns dict of {term: (entries, truncated)}, rebuilding any needed."""
+  cached = matching.GetPostings(terms)
+  postings = {}
+  for term in terms:
+    value = cached.get(term, None)
+    if value is None or (value[1] and not value[0]):
+      # Missing, or truncated and used up.
+      value = LoadPostings(term)
+      matching.SetPostings(term, *value)
+    postings[term] = value
+  return postings
+
+
+# Most pages of MAX_POSTINGS entries read past the cached entries of a
+# truncated term, when those do not give a worker enough Tasks.
+MAX_POSTING_PAGES = 3
+
+
+def PagePastPostings(postings, candidates, executor_capabilities, attributes,
+                     limit):
+  """Adds candidates from past the cached entries of truncated terms.
+
+  Cached postings only hold the best-ranked entries of a term. A worker
+  matching none of them, such as one whose attributes only satisfy the
+  version comparison of later Tasks anchored on the attribute, would
+  otherwise never be offered those Tasks.
+
+  Args:
+    postings: Dict of {term: (entries, truncated)} as from GetPostings.
+    candidates: List of (entry, term) from matching.MergeCandidates.
+    executor_capabilities: Set of the worker's executor capabilities.
+    attributes: Dict of the worker's attributes.
+    limit: Most candidates to return as int.
+
+  Returns:
+    List of up to limit (entry, term) with distinct Tasks, by queue_rank.
+  """
+  seen = set([entry[1] for (entry, _) in candidates])
+  candidates = list(candidates)
+  for (term, (entries, truncated)) in postings.iteritems():
+    if not truncated or not entries:
+      continue
+    queue_rank = entries[-1][0]
+    for _ in xrange(MAX_POSTING_PAGES):
+      if len(candidates) >= limit:
+        break
+      page = LoadPostingsAfter(term, queue_rank)
+      for entry in page:
+        if (entry[1] not in seen and
+            matching.Matches(entry, executor_capabilities, attributes)):
+          seen.add(entry[1])
+          candidates.append((entry, term))
+      if len(page) < matching.MAX_POSTINGS:
+        break
+      queue_rank = page[-1][0]
+  candidates.sort()
+  return candidates[:limit]
+
+
 def GetById(task_id):
   """Retrieves Task with given integer task_id."""
   key = db.Key.from_path('TaskParent', '0', 'Task', task_id)
@@ -169,6 +464,19 @@ def GetByName(task_name):
   return tasks
 
 
+def ListByName(task_name, limit=1000, cursor=None, keys_only=False):
+  """Returns a page of Tasks with given name, newest first.
+
+  Returns:
+    (task_list, next_cursor) as in paging.FetchPage.
+  """
+  assert isinstance(task_name, basestring)
+  query = (Task.all(keys_only=keys_only)
+               .filter('name =', task_name)
+               .order('-scheduled_time'))
+  return paging.FetchPage(query, limit, cursor)
+
+
 def DeleteById(task_id):
   """Deletes Task with given integer task_id."""
   task = GetById(task_id)
@@ -189,6 +497,19 @@ def GetByExecutor(executor, limit=1000, keys_only=False):
   return tasks
 
 
+def ListByExecutor(executor, limit=1000, cursor=None, keys_only=False):
+  """Returns a page of tasks waiting for a given executor.
+
+  Returns:
+    (task_list, next_cursor) as in paging.FetchPage.
+  """
+  query = (Task.all(keys_only=keys_only)
+               .ancestor(MakeParentKey())
+               .filter('state =', TaskStates.SCHEDULED)
+               .filter('executor_requirements =', executor))
+  return paging.FetchPage(query, limit, cursor)
+
+
 def GetOldestTaskForCapability(executor_capability):
   """Retrieves front of the queue for given executor capability.
 
@@ -198,6 +519,15 @@ def GetOldestTaskForCapability(executor_capability):
   Returns:
     First Task in the queue, or None.
   """
+  task = (Task.all()
+              .ancestor(MakeParentKey())
+              .filter('state =', TaskStates.SCHEDULED)
+              .filter('executor_requirements =', executor_capability)
+              .order('queue_rank')
+              .get())
+  if task is not None:
+    return task
+  # Tasks scheduled before queue_rank existed are not in the rank index.
   task = (Task.all()
               .ancestor(MakeParentKey())
               .filter('state =', TaskStates.SCHEDULED)
@@ -242,12 +572,13 @@ def GetCurrentTask(executor_capability):
   return task
 
 
-def AssignTaskToWorker(task, worker):
+def AssignTaskToWorker(task, worker, capability=None):
   """Takes given Task and assigns to given worker.
 
   Args:
     task: Task to assign.
     worker: Name of worker as str.
+    capability: Capability of worker the Task was matched by, as str.
 
   Returns:
     None
@@ -257,57 +588,185 @@ def AssignTaskToWorker(task, worker):
   task.state = TaskStates.ASSIGNED
   task.assigned_time = datetime.datetime.now()
   task.assigned_worker = worker
+  task.assigned_capability = capability
   task.attempts += 1
 
   db.put(task)
 
 
-def Assign(worker, executor_capabilities):
+# Most candidate Tasks Assign tries beyond those it wants to assign.
+MAX_ASSIGN_CANDIDATES = 5
+
+# Most Tasks assigned by a single request. Each assignment adds a
+# transactional timeout task, and a transaction may add at most 5.
+MAX_TASKS_PER_ASSIGN = 5
+
+
+def Assign(worker, executor_capabilities, attributes=None):
   """Looks for Tasks worker can execute, assigning one if possible.
 
+  Returns:
+    Task if a Task was assigned, None otherwise.
+  """
+  assigned = AssignBatch(worker, executor_capabilities, attributes)
+  if not assigned:
+    return None
+  return assigned[0]
+
+
+@tracing.Traced('tasks.Assign')
+def AssignBatch(worker, executor_capabilities, attributes=None, max_tasks=1):
+  """Looks for Tasks worker can execute, assigning up to max_tasks.
+
+  Candidates come from the capability postings of the worker's executor
+  capabilities and attributes, best queue_rank first. Tasks requiring an
+  expression are only matched while none of the worker's executor
+  capabilities is paused.
+
+  All Tasks are assigned in a single transaction. The worker executes them
+  back to back and uploads their results once the whole batch has run, so
+  every Task of the batch times out at the sum of their timeouts.
+
   Args:
     worker: Name of worker as str.
     executor_capabilities: Capabilities as list of str.
+    attributes: Optional dict of worker attributes, such as os_version.
+    max_tasks: Most Tasks to assign as int, up to MAX_TASKS_PER_ASSIGN.
 
   Returns:
-    Task if a Task was assigned, None otherwise.
+    List of assigned Tasks in execution order, possibly empty.
   """
   assert worker
   assert executor_capabilities
+  attributes = attributes or {}
+  max_tasks = max(1, min(max_tasks, MAX_TASKS_PER_ASSIGN))
+
+  logging.info('Trying to assign %d tasks for %s %s',
+               max_tasks, executor_capabilities, attributes)
+  capabilities = [capability for capability in executor_capabilities
+                  if capability]
+  paused = GetPausedExecutors(capabilities)
+  terms = [capability for capability in capabilities
+           if capability not in paused]
+  if not paused:
+    terms.extend(requirements.GetWorkerTerms(attributes))
+  if not terms:
+    return []
 
-  logging.info('Trying to assign task for %s', executor_capabilities)
-  def tx(executor_capability):
-    task = GetOldestTaskForCapability(executor_capability)
-    if task is None:
-      return None
-    logging.info('Assigning task %s to %s for %s.',
-                 task.key().id_or_name(),
-                 worker,
-                 executor_capability)
-    AssignTaskToWorker(task, worker)
-    logging.info('Assignment successful.')
-    ScheduleTaskTimeout(task)
-    counter.incr('Tasks.Assigned')
-    counter.incr('Executors.%s.Assigned' % executor_capability)
-    return task
+  postings = GetPostings(terms)
+  candidates = matching.MergeCandidates(
+      dict([(term, entries) for (term, (entries, _)) in postings.iteritems()]),
+      set(terms), attributes, max_tasks + MAX_ASSIGN_CANDIDATES)
+  if len(candidates) < max_tasks:
+    candidates = PagePastPostings(postings, candidates, set(terms),
+                                  attributes,
+                                  max_tasks + MAX_ASSIGN_CANDIDATES)
+  if not candidates:
+    return []
 
-  for executor_capability in executor_capabilities:
-    if not executor_capability:
-      continue
-    if IsExecutorPaused(executor_capability):
-      continue
-    task = db.run_in_transaction(tx, executor_capability)
-    if task:
-      return task
-  return None
+  def tx():
+    task_keys = [db.Key.from_path('TaskParent', '0', 'Task', entry[1])
+                 for (entry, _) in candidates]
+    assigned = []
+    stale = []
+    deadline = datetime.datetime.now()
+    for (task, (entry, term)) in zip(db.get(task_keys), candidates):
+      if task is None or task.state != TaskStates.SCHEDULED:
+        stale.append((entry[1], term))
+        continue
+      if len(assigned) >= max_tasks:
+        break
+      logging.info('Assigning task %s to %s for %s.',
+                   entry[1], worker, term)
+      AssignTaskToWorker(task, worker, term)
+      deadline += GetTaskTimeout(task)
+      assigned.append((task, term))
+    for (task, _) in assigned:
+      ScheduleTaskTimeout(task, deadline)
+    return (assigned, stale)
+  (assigned, stale) = db.run_in_transaction(tx)
+  logging.info('Assigned %d tasks.', len(assigned))
+
+  if stale:
+    matching.RemovePostings(set([term for (_, term) in stale]),
+                            [task_id for (task_id, _) in stale])
+  counters = counter.Batch()
+  for (task, term) in assigned:
+    matching.RemovePostings(task.executor_requirements, [task.key().id()])
+    counters.incr('Tasks.Assigned')
+    counters.incr('Executors.%s.Assigned' % term)
+    latency.Record(counters, latency.QUEUE, term,
+                   task.scheduled_time, task.assigned_time)
+  counters.commit()
+  return [task for (task, _) in assigned]
+
+
+UPLOAD_KEY_MEMCACHE_PREFIX = 'result_upload:'
+UPLOAD_KEY_MEMCACHE_SECONDS = 24 * 60 * 60
 
 
+def GetResultUploadKey(task):
+  """Returns upload_key of given Task's TaskResult, or None."""
+  if task.state != TaskStates.COMPLETE:
+    return None
+  result_key = Task.result.get_value_for_datastore(task)
+  if result_key is None:
+    return None
+  result = db.get(result_key)
+  if result is None:
+    return None
+  return result.upload_key
+
+
+def IsResultUploaded(task_id, upload_key):
+  """Returns True iff a result with upload_key was stored for task_id.
+
+  Checks memcache, then the datastore outside of any transaction, so
+  retried uploads are acknowledged cheaply.
+  """
+  if not upload_key:
+    return False
+  memcache_key = '%s%d' % (UPLOAD_KEY_MEMCACHE_PREFIX, task_id)
+  if memcache.get(memcache_key) == upload_key:
+    return True
+  task = GetById(task_id)
+  if task is None or GetResultUploadKey(task) != upload_key:
+    return False
+  memcache.set(memcache_key, upload_key, time=UPLOAD_KEY_MEMCACHE_SECONDS)
+  return True
+
+
+@tracing.Traced('tasks.UploadTaskResult')
 def UploadTaskResult(task_id, attempt, exit_code,
                      execution_time, stdout, stderr,
                      stdout_download_url, stderr_download_url,
-                     device_serial_number, result_metadata, worker_log):
+                     device_serial_number, result_metadata, worker_log,
+                     upload_key=None, worker_timings=None):
+  """Stores the result of given Task attempt, completing the Task.
+
+  Uploads are idempotent by upload_key: a result whose upload_key was
+  already stored for the Task is acknowledged without storing it again.
+  worker_timings is an optional mrtaskman#worker_timings dict, counted
+  against the Task's assigned worker by models.timings.
+
+  Returns:
+    True if the result was stored, False if it duplicated a stored result.
+
+  Raises:
+    TaskNotFoundError if the Task does not exist.
+    TaskTimedOutError if the attempt may no longer upload results.
+  """
   logging.info('Trying to upload result for task %d attempt %d',
                task_id, attempt)
+  if IsResultUploaded(task_id, upload_key):
+    logging.info('Result %s was already uploaded.', upload_key)
+    counter.incr('Tasks.Completed.Duplicate')
+    return False
+
+  worker_timings_json = None
+  if worker_timings:
+    worker_timings_json = json.dumps(worker_timings)
+
   def tx():
     task = GetById(task_id)
     counters = counter.Batch()
@@ -315,22 +774,20 @@ def UploadTaskResult(task_id, attempt, exit_code,
     # Validate that task is in a state to accept results from worker.
     if not task:
       raise TaskNotFoundError()
+    # A concurrent retry of this upload may have committed first.
+    if upload_key and GetResultUploadKey(task) == upload_key:
+      counters.incr('Tasks.Completed.Duplicate')
+      return (None, counters)
     counters.incr('Tasks.Completed')
     if device_serial_number:
       counters.incr('Executors.%s.Completed' % device_serial_number)
     if task.attempts != attempt:
       logging.info('Attempts: %d, attempt: %d', task.attempts, attempt)
-      counter.incr('Tasks.Completed.TimedOut')
-      if device_serial_number:
-        counter.incr('Executors.%s.TimedOut' % device_serial_number)
       raise TaskTimedOutError()
     # Here we allow a timed out task to publish results if it hasn't
     # been scheduled to another worker yet.
     if task.state not in [TaskStates.ASSIGNED, TaskStates.SCHEDULED]:
       logging.info('task.state: %s', task.state)
-      counter.incr('Tasks.Completed.TimedOut')
-      if device_serial_number:
-        counter.incr('Executors.%s.TimedOut' % device_serial_number)
       raise TaskTimedOutError()
 
     # Mark task as complete and place results.
@@ -346,6 +803,16 @@ def UploadTaskResult(task_id, attempt, exit_code,
         counters.incr('Executors.%s.Failed' % device_serial_number)
       task.outcome = TaskOutcomes.FAILED
     task.state = TaskStates.COMPLETE
+    # Measured from when the worker reports starting the Task, as a Task
+    # assigned in a batch waits on earlier ones first.
+    run_start_time = task.assigned_time
+    worker_seconds = timings.GetWorkerSeconds(worker_timings)
+    if worker_seconds is not None and run_start_time is not None:
+      run_start_time = max(run_start_time, task.completed_time -
+                           datetime.timedelta(seconds=worker_seconds))
+    latency.Record(counters, latency.RUN, task.assigned_capability,
+                   run_start_time, task.completed_time)
+    timings.Record(counters, task.assigned_worker, worker_timings)
 
     task_result = TaskResult(parent=task,
                              exit_code=exit_code,
@@ -356,32 +823,57 @@ def UploadTaskResult(task_id, attempt, exit_code,
                              stderr_download_url=stderr_download_url,
                              device_serial_number=device_serial_number,
                              result_metadata=result_metadata,
-                             worker_log=worker_log)
+                             worker_log=worker_log,
+                             upload_key=upload_key,
+                             worker_timings=worker_timings_json)
     task_result = db.put(task_result)
 
     task.result = task_result
     db.put(task)
 
-    taskqueue.add(url='/tasks/%d/invoke_webhook' % task.key().id(),
-                  transactional=True)
+    rollups.EnqueueResult(device_serial_number, exit_code,
+                          task.completed_time, execution_time)
+    if task.webhook:
+      webhooks.EnqueueCompletion(task.key().id(), task.webhook,
+                                 webhooks.IsBatchingEnabled(task.config))
     return (task, counters)
-  (task, counters) = db.run_in_transaction(tx)
-  logging.info('Insert succeeded.')
+  try:
+    (task, counters) = db.run_in_transaction(tx)
+  except TaskTimedOutError:
+    # Counted here rather than in tx, which may run more than once.
+    counters = counter.Batch()
+    counters.incr('Tasks.Completed.TimedOut')
+    if device_serial_number:
+      counters.incr('Executors.%s.TimedOut' % device_serial_number)
+    counters.commit()
+    raise
   counters.commit()
+  if task is None:
+    logging.info('Result %s was already uploaded.', upload_key)
+    return False
+  logging.info('Insert succeeded.')
+  if upload_key:
+    memcache.set('%s%d' % (UPLOAD_KEY_MEMCACHE_PREFIX, task_id), upload_key,
+                 time=UPLOAD_KEY_MEMCACHE_SECONDS)
+  if task.webhook:
+    webhooks.ScheduleDispatch()
+  return True
 
 
 class InvokeWebhookHandler(webapp2.RequestHandler):
+  """Invokes the webhook of a single Task.
+
+  Completions are now delivered in batches by models.webhooks. This handler
+  remains for invoke_webhook tasks enqueued before that.
+  """
   def post(self, task_id):
     task = GetById(int(task_id))
     if not task:
       return
 
-    config = json.loads(task.config)
-    try:
-      webhook = config['task']['webhook']
-    except Exception, e:
-      logging.exception(e)
-      logging.info('No webhook, or error invoking webhook.')
+    webhook = task.webhook
+    if not webhook:
+      logging.info('No webhook for task %s.', task_id)
       return
 
     logging.info('invoking webhook: %s', webhook)
@@ -396,32 +888,57 @@ class InvokeWebhookHandler(webapp2.RequestHandler):
     counter.incr('Tasks.WebhookInvoked%s' % fetched.status_code)
 
 
-def GetTaskTimeout(task, default=datetime.timedelta(minutes=15)):
-  """Returns task timeout as timedelta.
+def GetPackageStrings(config):
+  """Returns packages required by given parsed config as 'name.version'."""
+  package_strings = []
+  for package in config.get('packages', []):
+    try:
+      package_strings.append('%s.%s' % (package['name'], package['version']))
+    except (KeyError, TypeError):
+      continue
+  return package_strings
+
+
+def ParseTaskTimeout(config, default=datetime.timedelta(minutes=15)):
+  """Returns timeout of task with given parsed config as timedelta.
 
   Defaults to 15 minutes if no timeout is specified.
 
   A worker is given 3 minutes longer than the task timeout to allow for
   the overhead of downloading and installing packages.
   """
-  config = task.config
-  parsed_config = json.loads(config)
-  timeout_str = parsed_config['task'].get('timeout', None)
+  timeout_str = config['task'].get('timeout', None)
   if not timeout_str:
     return default
   return (parsetime.ParseTimeDelta(timeout_str) +
           datetime.timedelta(minutes=3))
 
 
-def ScheduleTaskTimeout(task):
+def GetTaskTimeout(task):
+  """Returns task timeout as timedelta.
+
+  Uses the timeout derived at schedule time, only parsing the config of
+  Tasks scheduled before timeout_seconds existed.
+  """
+  if task.timeout_seconds is not None:
+    return datetime.timedelta(seconds=task.timeout_seconds)
+  return ParseTaskTimeout(task.config)
+
+
+def ScheduleTaskTimeout(task, deadline=None):
   """Schedules a timeout for the given assigned Task.
 
   Must be called inside of a datastore transaction.
-  Called by Assign to enforce Task timeouts.
+  Called by AssignBatch to enforce Task timeouts.
+
+  Args:
+    task: Assigned Task.
+    deadline: When task times out, defaulting to its timeout from now.
   """
-  timeout = GetTaskTimeout(task)
+  if deadline is None:
+    deadline = datetime.datetime.now() + GetTaskTimeout(task)
   timeout_task = taskqueue.Task(
-      eta=(datetime.datetime.now() + timeout),
+      eta=deadline,
       method='POST',
       params={'task_key': task.key(),
               'task_attempt': task.attempts},
@@ -445,13 +962,17 @@ class TaskTimeoutHandler(webapp2.RequestHandler):
       task = db.get(task_key)
       if not task:
         logging.info('Timed out Task %s was deleted.', task_key)
-        return
+        return None
       if (task.state == TaskStates.ASSIGNED and
           task.attempts == task_attempt):
         if task.attempts >= task.max_attempts:
           task.state = TaskStates.COMPLETE
           task.outcome = TaskOutcomes.TIMED_OUT
+          task.completed_time = datetime.datetime.now()
           db.put(task)
+          run_time = task.completed_time - task.assigned_time
+          rollups.EnqueueTimeout(task.assigned_worker, task.completed_time,
+                                 run_time.days * 86400 + run_time.seconds)
         else:
           # Remember to enforce uploading task outcome to check
           # both state and attempts.
@@ -459,52 +980,62 @@ class TaskTimeoutHandler(webapp2.RequestHandler):
           # task.assigned_worker intentionally left so we can see
           # who timed out.
           db.put(task)
-    db.run_in_transaction(tx)
-
-
-def DeleteByExecutor(executor):
-  delete_task = taskqueue.Task(
-      method='POST',
-      url='/executors/%s/deleteall' % executor)
-  delete_task.add()
-
-
-class DeleteAllByExecutorHandler(webapp2.RequestHandler):
-  """Deletes all tasks for a given executor."""
-  def post(self, executor):
-    count = 0
-    while True:
-      task_keys = GetByExecutor(executor, limit=1000, keys_only=True)
-      if not task_keys:
-        logging.info('Done. Deleted %d tasks total.', count)
-        return
-      logging.info('Deleting %d tasks.', len(task_keys))
-      count += len(task_keys)
-      db.delete(task_keys)
-
-
-def GetResultsAfterDate(after_date, limit, cursor):
-  """Retrieve all Tasks with result info before after_date."""
+          return task
+      return None
+    rescheduled = db.run_in_transaction(tx)
+    if rescheduled is not None:
+      matching.AddPosting(rescheduled.executor_requirements,
+                          MakePosting(rescheduled))
+
+
+def AttachResults(task_list):
+  """Loads the TaskResults of given Tasks with a single batch get."""
+  result_keys = [Task.result.get_value_for_datastore(task)
+                 for task in task_list]
+  present_keys = [key for key in result_keys if key is not None]
+  if not present_keys:
+    return
+  results = dict(zip(present_keys, db.get(present_keys)))
+  for (task, result_key) in zip(task_list, result_keys):
+    if result_key is not None and results[result_key] is not None:
+      task.result = results[result_key]
+
+
+def IterResultsAfterDate(after_date, limit, cursor, batch_size=500,
+                         before_date=None):
+  """Yields batches of Tasks completed after after_date with results loaded.
+
+  Fetches up to limit Tasks in batches of batch_size, so callers can write
+  out each batch before the next is fetched. If before_date is given, only
+  Tasks completed no later than before_date are included.
+
+  Yields:
+    (task_list, next_cursor) where next_cursor resumes after task_list.
+  """
   query = Task.all().filter('completed_time >', after_date)
-  if cursor is not None:
-    task_list = query.fetch(
-        limit=limit,
-        start_cursor=datastore_query.Cursor.from_websafe_string(cursor))
-  else:
-    task_list = query.fetch(limit=limit)
-
-  if not task_list:
-    return (task_list, query.cursor())
-
-  # Fetch TaskResults.
-  result_list = db.get([task.__dict__['_result'] for task in task_list])
-  for i in xrange(0, len(task_list)):
-    task_list[i].result = result_list[i]
-  return (task_list, query.cursor())
+  if before_date is not None:
+    query.filter('completed_time <=', before_date)
+  remaining = limit
+  while remaining > 0:
+    batch_limit = min(batch_size, remaining)
+    if cursor is not None:
+      task_list = query.fetch(
+          limit=batch_limit,
+          start_cursor=datastore_query.Cursor.from_websafe_string(cursor))
+    else:
+      task_list = query.fetch(limit=batch_limit)
+    if not task_list:
+      return
+    cursor = query.cursor()
+    AttachResults(task_list)
+    yield (task_list, cursor)
+    if len(task_list) < batch_limit:
+      return
+    remaining -= len(task_list)
 
 
 app = webapp2.WSGIApplication([
     ('/tasks/timeout', TaskTimeoutHandler),
-    ('/executors/([a-zA-Z0-9]+)/deleteall', DeleteAllByExecutorHandler),
     ('/tasks/([0-9]+)/invoke_webhook', InvokeWebhookHandler),
     ], debug=True)
+app = middleware.WrapApp(app)
@@ -0,0 +1,293 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Minute, hour and day history of ProdEagle counters.
+
+The ProdEagle harvest hands each harvest's counter updates to AddHarvest,
+which queues them as push tasks adding them to a CounterBucket per counter
+for each resolution. The harvest has already taken the updates out of
+memcache, so queued tasks retry until the buckets are written. A cron job
+harvests every minute, so history is kept whether or not the ProdEagle
+service collects. Finer buckets expire after RETENTION.
+
+Bucket key names are 'resolution|name|start', with start a zero padded
+timestamp, so a counter's buckets in a time range are read with a single
+key range query.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+
+import datetime
+import json
+import logging
+import time
+import webapp2
+
+from util import middleware
+
+
+MINUTE = 'minute'
+HOUR = 'hour'
+DAY = 'day'
+
+RESOLUTIONS = (MINUTE, HOUR, DAY)
+
+RESOLUTION_SECONDS = {
+  MINUTE: 60,
+  HOUR: 60 * 60,
+  DAY: 24 * 60 * 60,
+}
+
+# How long buckets of each resolution are kept. Day buckets never expire.
+RETENTION = {
+  MINUTE: datetime.timedelta(days=2),
+  HOUR: datetime.timedelta(days=90),
+}
+
+# Counters ProdEagle keeps about itself are not worth a history.
+SKIPPED_PREFIXES = ('ProdEagle.',)
+
+# Most buckets read or written by a single datastore call, and added by a
+# single task.
+BATCH_SIZE = 500
+
+# Most tasks added to a queue by a single call.
+MAX_TASKS_PER_ADD = 100
+
+# Most points a single GetSeries may return.
+MAX_POINTS = 1500
+
+# Longest window GetRecentWindow reads from hour buckets. Longer ones read
+# day buckets.
+MAX_HOURLY_WINDOW_HOURS = 48
+
+EXPIRE_URL = '/timeseries/expire'
+ADD_URL = '/timeseries/add'
+
+
+class Error(Exception):
+  pass
+
+
+class TooManyPointsError(Error):
+  pass
+
+
+class CounterBucket(db.Model):
+  """Sum of a counter's increments over a minute, hour or day."""
+  resolution = db.StringProperty(required=True, choices=RESOLUTIONS)
+  name = db.StringProperty(required=True, indexed=False)
+  start_time = db.DateTimeProperty(required=True)
+  value = db.IntegerProperty(required=True, default=0, indexed=False)
+
+
+def GetBucketStart(timestamp, resolution):
+  """Returns start of resolution's bucket holding timestamp, as int."""
+  timestamp = int(timestamp)
+  return timestamp - timestamp % RESOLUTION_SECONDS[resolution]
+
+
+def MakeBucketKeyName(resolution, name, bucket_start):
+  return '%s|%s|%010d' % (resolution, name, bucket_start)
+
+
+def MakeBucketKey(resolution, name, bucket_start):
+  return db.Key.from_path(
+      'CounterBucket', MakeBucketKeyName(resolution, name, bucket_start))
+
+
+def AddToBuckets(bucket_deltas):
+  """Adds deltas to buckets with one batch get and one batch put.
+
+  Args:
+    bucket_deltas: List of at most BATCH_SIZE distinct
+                   (resolution, name, bucket_start, delta).
+  """
+  keys = [MakeBucketKey(resolution, name, bucket_start)
+          for (resolution, name, bucket_start, _) in bucket_deltas]
+  to_put = []
+  for ((resolution, name, bucket_start, delta), entity) in zip(
+      bucket_deltas, db.get(keys)):
+    if entity is None:
+      entity = CounterBucket(
+          key_name=MakeBucketKeyName(resolution, name, bucket_start),
+          resolution=resolution,
+          name=name,
+          start_time=datetime.datetime.fromtimestamp(bucket_start))
+    entity.value += delta
+    to_put.append(entity)
+  db.put(to_put)
+
+
+def AddHarvest(counters):
+  """Queues harvested counter updates to the buckets of every resolution.
+
+  Updates are queued in tasks of up to BATCH_SIZE buckets, see
+  AddBucketsHandler.
+
+  Args:
+    counters: Dict of {name: {slot: delta}}, slot being a timestamp.
+  """
+  deltas = {}
+  for (name, slots) in counters.iteritems():
+    if name.startswith(SKIPPED_PREFIXES):
+      continue
+    for (slot, delta) in slots.iteritems():
+      if not delta:
+        continue
+      for resolution in RESOLUTIONS:
+        bucket = (resolution, name, GetBucketStart(slot, resolution))
+        deltas[bucket] = deltas.get(bucket, 0) + delta
+
+  bucket_deltas = [bucket + (delta,) for (bucket, delta)
+                   in deltas.iteritems()]
+  add_tasks = [
+      taskqueue.Task(payload=json.dumps(bucket_deltas[offset:
+                                                      offset + BATCH_SIZE]),
+                     url=ADD_URL)
+      for offset in xrange(0, len(bucket_deltas), BATCH_SIZE)]
+  for offset in xrange(0, len(add_tasks), MAX_TASKS_PER_ADD):
+    taskqueue.Queue().add(add_tasks[offset:offset + MAX_TASKS_PER_ADD])
+  logging.info('Queued %d counter buckets in %d tasks.',
+               len(bucket_deltas), len(add_tasks))
+
+
+def GetRecentWindow(hours, now=None):
+  """Returns (resolution, start_time, end_time) covering the last hours.
+
+  end_time is past now, so the bucket holding now is included.
+  """
+  now = now or datetime.datetime.now()
+  resolution = HOUR
+  if hours > MAX_HOURLY_WINDOW_HOURS:
+    resolution = DAY
+  end_time = now + datetime.timedelta(seconds=RESOLUTION_SECONDS[resolution])
+  start_time = now - datetime.timedelta(hours=hours)
+  return (resolution, start_time, end_time)
+
+
+def GetSeries(name, resolution, start_time, end_time):
+  """Returns a counter's values in buckets starting in a time range.
+
+  Args:
+    name: Counter name as str.
+    resolution: One of RESOLUTIONS.
+    start_time: Datetime of the first bucket, rounded down to resolution.
+    end_time: Datetime buckets must start before.
+
+  Returns:
+    List of (bucket start datetime, value), one per bucket. Buckets without
+    any increments have value 0.
+
+  Raises:
+    TooManyPointsError if the range holds over MAX_POINTS buckets.
+  """
+  bucket_seconds = RESOLUTION_SECONDS[resolution]
+  first = GetBucketStart(time.mktime(start_time.timetuple()), resolution)
+  end = int(time.mktime(end_time.timetuple()))
+  if (end - first) / bucket_seconds > MAX_POINTS:
+    raise TooManyPointsError(
+        'Over %d %s buckets requested.' % (MAX_POINTS, resolution))
+
+  values = {}
+  query = (CounterBucket.all()
+                        .filter('__key__ >=',
+                                MakeBucketKey(resolution, name, first))
+                        .filter('__key__ <',
+                                MakeBucketKey(resolution, name, end)))
+  for bucket in query.run(batch_size=BATCH_SIZE):
+    values[int(time.mktime(bucket.start_time.timetuple()))] = bucket.value
+
+  return [(datetime.datetime.fromtimestamp(bucket_start),
+           values.get(bucket_start, 0))
+          for bucket_start in xrange(first, end, bucket_seconds)]
+
+
+def GetTotals(names, resolution, start_time, end_time):
+  """Returns {name: sum} of counters' buckets starting in a time range.
+
+  Buckets are read by key, so this suits many counters over a few buckets.
+
+  Raises:
+    TooManyPointsError if the range holds over MAX_POINTS buckets.
+  """
+  bucket_seconds = RESOLUTION_SECONDS[resolution]
+  first = GetBucketStart(time.mktime(start_time.timetuple()), resolution)
+  end = int(time.mktime(end_time.timetuple()))
+  if (end - first) / bucket_seconds > MAX_POINTS:
+    raise TooManyPointsError(
+        'Over %d %s buckets requested.' % (MAX_POINTS, resolution))
+
+  keys = [MakeBucketKey(resolution, name, bucket_start)
+          for name in names
+          for bucket_start in xrange(first, end, bucket_seconds)]
+  totals = {}
+  for offset in xrange(0, len(keys), BATCH_SIZE):
+    for bucket in db.get(keys[offset:offset + BATCH_SIZE]):
+      if bucket is not None:
+        totals[bucket.name] = totals.get(bucket.name, 0) + bucket.value
+  return totals
+
+
+def ExpireBuckets(now=None):
+  """Deletes buckets older than the RETENTION of their resolution.
+
+  Returns:
+    Number of buckets deleted as int.
+  """
+  now = now or datetime.datetime.now()
+  deleted = 0
+  for (resolution, retention) in RETENTION.iteritems():
+    while True:
+      keys = (CounterBucket.all(keys_only=True)
+                           .filter('resolution =', resolution)
+                           .filter('start_time <', now - retention)
+                           .fetch(BATCH_SIZE))
+      if not keys:
+        break
+      db.delete(keys)
+      deleted += len(keys)
+  return deleted
+
+
+class AddBucketsHandler(webapp2.RequestHandler):
+  """Adds a task of harvested bucket deltas queued by AddHarvest.
+
+  Failed tasks are retried by the queue.
+  """
+
+  def post(self):
+    bucket_deltas = [tuple(bucket_delta) for bucket_delta
+                     in json.loads(self.request.body)]
+    AddToBuckets(bucket_deltas)
+    logging.info('Added %d counter buckets.', len(bucket_deltas))
+
+
+class ExpireBucketsHandler(webapp2.RequestHandler):
+  """Runs a bucket expiry from cron."""
+
+  def get(self):
+    deleted = ExpireBuckets()
+    logging.info('Expired %d counter buckets.', deleted)
+
+  def post(self):
+    self.get()
+
+
+app = webapp2.WSGIApplication([
+    (ADD_URL, AddBucketsHandler),
+    (EXPIRE_URL, ExpireBucketsHandler),
+    ], debug=True)
+app = middleware.WrapApp(app)
@@ -0,0 +1,214 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Per worker and per package totals of worker reported timings.
+
+Workers send a mrtaskman#worker_timings with each task result, holding the
+seconds spent in each phase of the task, the bytes and cache outcome of each
+package installed, and the seconds and bytes of the worker's previous result
+upload. Record adds them to ProdEagle counters named
+'WorkerTimings.<worker>.*' and 'PackageTimings.<name>.<version>.*', which
+the harvest turns into models.timeseries buckets. Durations are counted in
+milliseconds, as counters only hold integers.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from models import timeseries
+
+
+# Phases of ExecuteTask a worker reports seconds of.
+PHASES = ('stage_files', 'packages', 'command')
+
+WORKER_PREFIX = 'WorkerTimings'
+PACKAGE_PREFIX = 'PackageTimings'
+
+WORKER_COUNTERS = (
+    ['Tasks', 'Uploads', 'Upload.Ms', 'Upload.Bytes',
+     'CacheHits', 'CacheMisses', 'Download.Ms', 'Download.Bytes'] +
+    ['%s.Ms' % phase for phase in PHASES])
+
+PACKAGE_COUNTERS = ('Installs', 'Install.Ms', 'CacheMisses',
+                    'Download.Ms', 'Download.Bytes')
+
+
+def MakeWorkerCounterName(worker, name):
+  return '%s.%s.%s' % (WORKER_PREFIX, worker, name)
+
+
+def MakePackageCounterName(package_name, package_version, name):
+  return '%s.%s.%d.%s' % (PACKAGE_PREFIX, package_name, package_version, name)
+
+
+def GetAmount(value):
+  """Returns value if it is a non-negative number, or None."""
+  if isinstance(value, bool) or not isinstance(value, (int, long, float)):
+    return None
+  if value < 0:
+    return None
+  return value
+
+
+def GetMs(value):
+  seconds = GetAmount(value)
+  if seconds is None:
+    return None
+  return int(seconds * 1000)
+
+
+def IncrAmount(counters, name, amount):
+  if amount:
+    counters.incr(name, int(amount))
+
+
+def GetWorkerSeconds(timings):
+  """Returns seconds a worker reported in a task's phases, or None."""
+  if not isinstance(timings, dict):
+    return None
+  phases = timings.get('phases', None)
+  if not isinstance(phases, dict):
+    return None
+  seconds = [GetAmount(phases.get(phase, None)) for phase in PHASES]
+  seconds = [value for value in seconds if value is not None]
+  if not seconds:
+    return None
+  return sum(seconds)
+
+
+def Record(counters, worker, timings):
+  """Counts a mrtaskman#worker_timings of worker in a counter.Batch.
+
+  Malformed or missing values are skipped, as timings are advisory.
+  """
+  if not worker or not isinstance(timings, dict):
+    return
+  def Incr(name, amount=1):
+    IncrAmount(counters, MakeWorkerCounterName(worker, name), amount)
+
+  Incr('Tasks')
+  phases = timings.get('phases', None)
+  if isinstance(phases, dict):
+    for phase in PHASES:
+      Incr('%s.Ms' % phase, GetMs(phases.get(phase, None)))
+
+  upload = timings.get('upload', None)
+  if isinstance(upload, dict):
+    Incr('Uploads')
+    Incr('Upload.Ms', GetMs(upload.get('seconds', None)))
+    Incr('Upload.Bytes', GetAmount(upload.get('bytes', None)))
+
+  packages = timings.get('packages', None)
+  if not isinstance(packages, list):
+    return
+  for package in packages:
+    if not isinstance(package, dict):
+      continue
+    package_name = package.get('name', None)
+    package_version = package.get('version', None)
+    if (not isinstance(package_name, basestring) or
+        not isinstance(package_version, (int, long))):
+      continue
+    def IncrPackage(name, amount=1):
+      IncrAmount(counters,
+                 MakePackageCounterName(package_name, package_version, name),
+                 amount)
+
+    download_ms = GetMs(package.get('download_seconds', None))
+    download_bytes = GetAmount(package.get('bytes', None))
+    cache_hit = package.get('cache_hit', None)
+    if cache_hit is True:
+      Incr('CacheHits')
+    else:
+      # Workers without a cache download every package.
+      Incr('CacheMisses')
+      IncrPackage('CacheMisses')
+    Incr('Download.Ms', download_ms)
+    Incr('Download.Bytes', download_bytes)
+    IncrPackage('Installs')
+    IncrPackage('Install.Ms', GetMs(package.get('seconds', None)))
+    IncrPackage('Download.Ms', download_ms)
+    IncrPackage('Download.Bytes', download_bytes)
+
+
+def GetMean(total, count):
+  if not count:
+    return None
+  return total / float(count)
+
+
+def GetRate(amount, ms):
+  if not ms:
+    return None
+  return amount * 1000.0 / ms
+
+
+def GetWorkerTimings(worker, hours=24, now=None):
+  """Returns a mrtaskman#worker_timings_summary of worker's last hours."""
+  (resolution, start_time, end_time) = timeseries.GetRecentWindow(hours, now)
+  names = [MakeWorkerCounterName(worker, name) for name in WORKER_COUNTERS]
+  totals = timeseries.GetTotals(names, resolution, start_time, end_time)
+  def Get(name):
+    return totals.get(MakeWorkerCounterName(worker, name), 0)
+
+  tasks = Get('Tasks')
+  summary = {}
+  summary['kind'] = 'mrtaskman#worker_timings_summary'
+  summary['worker'] = worker
+  summary['hours'] = hours
+  summary['tasks'] = tasks
+  summary['phases'] = dict(
+      [(phase, {'mean_seconds': GetMean(Get('%s.Ms' % phase) / 1000.0, tasks)})
+       for phase in PHASES])
+  summary['upload'] = {
+    'count': Get('Uploads'),
+    'mean_seconds': GetMean(Get('Upload.Ms') / 1000.0, Get('Uploads')),
+    'bytes': Get('Upload.Bytes'),
+    'bytes_per_second': GetRate(Get('Upload.Bytes'), Get('Upload.Ms')),
+  }
+  cache_hits = Get('CacheHits')
+  cache_misses = Get('CacheMisses')
+  summary['packages'] = {
+    'cache_hits': cache_hits,
+    'cache_misses': cache_misses,
+    'cache_hit_rate': GetMean(cache_hits, cache_hits + cache_misses),
+    'download_bytes': Get('Download.Bytes'),
+    'download_bytes_per_second': GetRate(Get('Download.Bytes'),
+                                         Get('Download.Ms')),
+  }
+  return summary
+
+
+def GetPackageTimings(package_name, package_version, hours=24, now=None):
+  """Returns a mrtaskman#package_timings_summary of a package's last hours."""
+  (resolution, start_time, end_time) = timeseries.GetRecentWindow(hours, now)
+  names = [MakePackageCounterName(package_name, package_version, name)
+           for name in PACKAGE_COUNTERS]
+  totals = timeseries.GetTotals(names, resolution, start_time, end_time)
+  def Get(name):
+    return totals.get(
+        MakePackageCounterName(package_name, package_version, name), 0)
+
+  summary = {}
+  summary['kind'] = 'mrtaskman#package_timings_summary'
+  summary['name'] = package_name
+  summary['version'] = package_version
+  summary['hours'] = hours
+  summary['installs'] = Get('Installs')
+  summary['mean_install_seconds'] = GetMean(Get('Install.Ms') / 1000.0,
+                                            Get('Installs'))
+  summary['cache_misses'] = Get('CacheMisses')
+  summary['mean_download_seconds'] = GetMean(Get('Download.Ms') / 1000.0,
+                                             Get('CacheMisses'))
+  summary['download_bytes'] = Get('Download.Bytes')
+  summary['download_bytes_per_second'] = GetRate(Get('Download.Bytes'),
+                                                 Get('Download.Ms'))
+  return summary
@@ -0,0 +1,303 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Batched delivery of Task completion webhooks.
+
+Completed Tasks with a webhook are queued on a pull queue tagged with their
+webhook URL. A dispatcher leases completions grouped by URL, delivers them
+using parallel async urlfetch calls, and backs off exponentially on failure.
+
+By default each POST carries a single completion as a task_id form param,
+as webhooks always have. Tasks whose config sets "webhook_batching": true
+in its "task" section opt in to batches: a single POST carries up to
+MAX_BATCH_SIZE completions as a comma-separated task_ids form param, plus
+task_id when it carries only one. Batched completions are tagged with
+BATCHED_TAG_PREFIX before their URL.
+
+Failed completions are requeued with their attempt count in the payload.
+The dispatcher leases a single completion to learn the oldest webhook URL
+before leasing its batch, so a webhook at its concurrency limit only holds
+that one completion until its lease expires, without using up a delivery
+attempt.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import memcache
+from google.appengine.api import taskqueue
+from google.appengine.api import urlfetch
+
+import logging
+import time
+import urllib
+import webapp2
+
+from third_party.prodeagle import counter
+from util import middleware
+
+
+# Pull queue holding one task per completion, tagged by webhook URL.
+COMPLETIONS_QUEUE = 'webhook-completions'
+# Tag prefix of completions of webhooks which opted in to batches.
+BATCHED_TAG_PREFIX = 'batched:'
+# Push queue running the dispatcher, isolated from the default queue.
+DISPATCH_QUEUE = 'webhooks'
+DISPATCH_URL = '/webhooks/dispatch'
+# Completions arriving within this many seconds share a dispatch.
+DISPATCH_INTERVAL_SECONDS = 10
+
+# Most completions delivered in a single POST.
+MAX_BATCH_SIZE = 100
+# Most POSTs in flight from a single dispatch.
+MAX_PARALLEL_FETCHES = 10
+# Most POSTs in flight to a single webhook URL across all instances.
+MAX_CONCURRENT_PER_ENDPOINT = 2
+FETCH_DEADLINE_SECONDS = 10
+LEASE_SECONDS = 2 * FETCH_DEADLINE_SECONDS
+
+# Exponential backoff between delivery attempts.
+MIN_BACKOFF_SECONDS = 10
+MAX_BACKOFF_SECONDS = 30 * 60
+MAX_ATTEMPTS = 10
+
+
+def MakeCompletionPayload(task_id, attempts=0):
+  if not attempts:
+    return str(task_id)
+  return '%s:%d' % (task_id, attempts)
+
+
+def ParseCompletionPayload(payload):
+  """Returns (task_id as str, failed delivery attempts as int)."""
+  (task_id, _, attempts) = payload.partition(':')
+  return (task_id, int(attempts or 0))
+
+
+def IsBatchingEnabled(config):
+  """Returns True iff a Task's parsed config opts in to batched webhooks."""
+  return config.get('task', {}).get('webhook_batching', False) is True
+
+
+def MakeTag(webhook, batched):
+  tag = webhook.encode('utf-8')
+  if batched:
+    return BATCHED_TAG_PREFIX + tag
+  return tag
+
+
+def ParseTag(tag):
+  """Returns (webhook URL as unicode, True iff batched) of a tag."""
+  batched = tag.startswith(BATCHED_TAG_PREFIX)
+  if batched:
+    tag = tag[len(BATCHED_TAG_PREFIX):]
+  return (tag.decode('utf-8'), batched)
+
+
+def EnqueueCompletion(task_id, webhook, batched=False):
+  """Queues webhook delivery for completed task_id.
+
+  Must be called inside of the datastore transaction completing the task.
+  """
+  taskqueue.Task(method='PULL',
+                 payload=MakeCompletionPayload(task_id),
+                 tag=MakeTag(webhook, batched)).add(
+      queue_name=COMPLETIONS_QUEUE, transactional=True)
+
+
+def ScheduleDispatch():
+  """Makes sure a dispatch runs within DISPATCH_INTERVAL_SECONDS.
+
+  Completions arriving in the same interval share one named dispatch task.
+  """
+  now = int(time.time())
+  slot = now - now % DISPATCH_INTERVAL_SECONDS
+  try:
+    taskqueue.Task(name='webhook-dispatch-%d' % slot,
+                   method='POST',
+                   url=DISPATCH_URL,
+                   countdown=slot + DISPATCH_INTERVAL_SECONDS - now).add(
+        queue_name=DISPATCH_QUEUE)
+  except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+    pass
+
+
+def GetBackoffSeconds(attempts):
+  """Returns seconds to wait before the next delivery attempt."""
+  return min(MIN_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0),
+             MAX_BACKOFF_SECONDS)
+
+
+def MakeEndpointKey(webhook, slot):
+  return 'webhook_inflight:%d:%s' % (slot, webhook)
+
+
+def AcquireEndpoint(webhook):
+  """Leases one of MAX_CONCURRENT_PER_ENDPOINT slots of webhook.
+
+  Leases expire after LEASE_SECONDS, so a dispatch dying mid-delivery only
+  holds its slot until then.
+
+  Returns:
+    Memcache key of the leased slot to pass to ReleaseEndpoint, or None if
+    all slots are in use.
+  """
+  for slot in xrange(MAX_CONCURRENT_PER_ENDPOINT):
+    key = MakeEndpointKey(webhook, slot)
+    if memcache.add(key, time.time(), time=LEASE_SECONDS):
+      return key
+  return None
+
+
+def ReleaseEndpoint(endpoint_lease):
+  memcache.delete(endpoint_lease)
+
+
+def MakePayload(task_ids, batched):
+  """Returns the form POSTed for task_ids, see the module docstring."""
+  if not batched:
+    assert len(task_ids) == 1
+    return urllib.urlencode([('task_id', task_ids[0])]).encode('utf-8')
+  params = [('task_ids', ','.join(task_ids))]
+  if len(task_ids) == 1:
+    params.append(('task_id', task_ids[0]))
+  return urllib.urlencode(params).encode('utf-8')
+
+
+class Delivery(object):
+  """A single in-flight POST of a batch of completions to one webhook."""
+
+  def __init__(self, webhook, batched, endpoint_lease, leased_tasks):
+    self.webhook = webhook
+    self.endpoint_lease = endpoint_lease
+    self.leased_tasks = leased_tasks
+    self.task_ids = [ParseCompletionPayload(leased.payload)[0]
+                     for leased in leased_tasks]
+    self.rpc = urlfetch.create_rpc(deadline=FETCH_DEADLINE_SECONDS)
+    urlfetch.make_fetch_call(
+        self.rpc, webhook, payload=MakePayload(self.task_ids, batched),
+        method='POST',
+        headers={'Content-Type':
+            'application/x-www-form-urlencoded;encoding=utf-8'})
+
+  def GetStatusCode(self):
+    """Waits for the POST and returns its status code, or None on error."""
+    try:
+      return self.rpc.get_result().status_code
+    except urlfetch.Error, e:
+      logging.warning('Webhook %s failed: %s', self.webhook, e)
+      return None
+
+
+def Dispatch():
+  """Delivers pending completions, one POST per webhook URL batch.
+
+  Completions of webhooks which did not opt in to batches are delivered
+  one per POST.
+
+  Stops once the oldest pending webhook is one found at its concurrency
+  limit, rather than leasing its backlog. Completions leased but not
+  delivered are left to their leases expiring.
+
+  Returns:
+    Number of completions delivered as int.
+  """
+  queue = taskqueue.Queue(COMPLETIONS_QUEUE)
+  deliveries = []
+  saturated = set()
+  try:
+    while len(deliveries) < MAX_PARALLEL_FETCHES:
+      # With no tag given, leases a task of the oldest task's tag.
+      leased_tasks = queue.lease_tasks_by_tag(LEASE_SECONDS, 1)
+      if not leased_tasks:
+        break
+      tag = leased_tasks[0].tag
+      (webhook, batched) = ParseTag(tag)
+      if webhook in saturated:
+        break
+      endpoint_lease = AcquireEndpoint(webhook)
+      if endpoint_lease is None:
+        logging.info('Webhook %s is at its concurrency limit.', webhook)
+        saturated.add(webhook)
+        continue
+      if batched:
+        leased_tasks.extend(queue.lease_tasks_by_tag(
+            LEASE_SECONDS, MAX_BATCH_SIZE - 1, tag=tag))
+      try:
+        deliveries.append(
+            Delivery(webhook, batched, endpoint_lease, leased_tasks))
+      except Exception, e:
+        logging.exception(e)
+        ReleaseEndpoint(endpoint_lease)
+  finally:
+    delivered = FinishDeliveries(queue, deliveries)
+  return delivered
+
+
+def FinishDeliveries(queue, deliveries):
+  """Waits for deliveries, acking successes and backing off failures."""
+  counters = counter.Batch()
+  delivered = 0
+  for delivery in deliveries:
+    try:
+      status_code = delivery.GetStatusCode()
+    finally:
+      ReleaseEndpoint(delivery.endpoint_lease)
+    counters.incr('Tasks.WebhookInvoked%s' % status_code,
+                  len(delivery.task_ids))
+    logging.info('Webhook %s invoked for %d tasks with status %s.',
+                 delivery.webhook, len(delivery.task_ids), status_code)
+    if status_code is not None and 200 <= status_code < 300:
+      queue.delete_tasks(delivery.leased_tasks)
+      delivered += len(delivery.task_ids)
+      continue
+
+    # Lease retry_count also counts deferrals, so failed attempts are
+    # counted in the payload of a requeued completion instead.
+    retries = []
+    abandoned = []
+    for leased in delivery.leased_tasks:
+      (task_id, attempts) = ParseCompletionPayload(leased.payload)
+      attempts += 1
+      if attempts >= MAX_ATTEMPTS:
+        abandoned.append(task_id)
+      else:
+        retries.append(taskqueue.Task(
+            method='PULL',
+            payload=MakeCompletionPayload(task_id, attempts),
+            tag=leased.tag,
+            countdown=GetBackoffSeconds(attempts)))
+    if retries:
+      queue.add(retries)
+    if abandoned:
+      logging.error('Giving up on webhook %s for tasks %s.',
+                    delivery.webhook, ','.join(abandoned))
+      counters.incr('Tasks.WebhookAbandoned', len(abandoned))
+    queue.delete_tasks(delivery.leased_tasks)
+  counters.commit()
+  return delivered
+
+
+class DispatchHandler(webapp2.RequestHandler):
+  """Runs a webhook dispatch from the dispatch queue or cron."""
+
+  def post(self):
+    delivered = Dispatch()
+    logging.info('Delivered %d webhook completions.', delivered)
+
+  def get(self):
+    self.post()
+
+
+app = webapp2.WSGIApplication([
+    (DISPATCH_URL, DispatchHandler),
+    ], debug=True)
+app = middleware.WrapApp(app)
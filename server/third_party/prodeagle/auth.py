@@ -59,6 +59,8 @@ def isProdEagle(handler):
       return True
   if "X-Appengine-Queuename" in handler.request.headers:
     return True
+  if handler.request.headers.get("X-Appengine-Cron") == "true":
+    return True
   return False
 
 def isAdministrator(handler):
@@ -28,11 +28,16 @@ SAVE_PRODEAGLE_STATS = True
 # The relative url to the harvest.py handler
 PRODEAGLE_HARVEST_URL = "/prodeagle/"
 
+# False or String
+# Import path of a function called with the counters of each harvest, as
+# {counter_name: {slot: delta}}, before any AppStats or log counters are added.
+HARVEST_LISTENER = "models.timeseries.AddHarvest"
+
 # -------------------------- AppStats Configuration ---------------------------
 
 # Boolean
 # If True then ProdEagle will export data from AppStats.
-APPSTATS_ENABLE = True
+APPSTATS_ENABLE = False
 
 # List[Integers]
 # Here is an exmaple with APPSTATS_PERCENTILE = [90].
@@ -105,14 +110,25 @@ SAVE_IN_BETWEEN = 0
 MAX_LOOK_BACK = 3600
 
 # Integer
-# The amount of test counters we right into memcache servers to see if data
-# was lost the between two exports.
+# The maximum amount of test counters we write into memcache servers to see
+# if data was lost between two exports.
 EXPECTED_MEMCACHE_SERVERS = 1024
 
+# Integer
+# The minimum amount of test counters, and how many more are written per
+# known counter name. Apps with few counters then probe few keys per export.
+MIN_LOST_DATA_SENTINELS = 16
+LOST_DATA_SENTINELS_PER_COUNTER = 1
+
 # Integer
 # How many seconds the clocks of google servers can be apart.
 MAX_CLOCK_SKEW = 60
 
+# Integer
+# How many seconds a harvest may hold the lock keeping other harvests from
+# running at the same time, in case it dies without releasing it.
+HARVEST_LOCK_SECONDS = 600
+
 
 # ---------------------------- DO NOT CHANGE ---------------------------------
 
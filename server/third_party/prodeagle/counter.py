@@ -18,9 +18,13 @@ from google.appengine.api import memcache
 from google.appengine.api import taskqueue
 from third_party.prodeagle import counter_names
 import logging
+import threading
 
 from third_party.prodeagle import config
 
+# Counters of the current request, while inside of RequestBatchMiddleware.
+_request = threading.local()
+
 def incr(name, delta=1, save_stats=config.SAVE_PRODEAGLE_STATS):
   if delta:
     incrBatch({ name : delta }, save_stats)
@@ -38,7 +42,39 @@ class Batch():
       incrBatch(self.pending, save_stats)
     self.pending = {}
 
+def startRequestBatch():
+  """Collects all following counter updates until commitRequestBatch."""
+  _request.batch = Batch()
+
+def commitRequestBatch():
+  """Increments all counters collected since startRequestBatch at once."""
+  batch = getattr(_request, "batch", None)
+  _request.batch = None
+  if batch is not None:
+    batch.commit()
+
+class RequestBatchMiddleware(object):
+  """WSGI middleware incrementing counters once at the end of each request.
+
+  Saves a memcache RPC, and possibly a datastore transaction, per counter
+  update after the first.
+  """
+  def __init__(self, app):
+    self.app = app
+
+  def __call__(self, environ, start_response):
+    startRequestBatch()
+    try:
+      return self.app(environ, start_response)
+    finally:
+      commitRequestBatch()
+
 def incrBatch(counters, save_stats=config.SAVE_PRODEAGLE_STATS):
+  batch = getattr(_request, "batch", None)
+  if batch is not None:
+    for name in counters:
+      batch.incr(name, counters[name])
+    return
   try:
     cnm = counter_names.getDefaultCounterNamesManager()
     slot = counter_names.getEpochRounded()
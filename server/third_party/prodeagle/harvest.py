@@ -34,28 +34,63 @@ import webapp2
 from third_party.prodeagle import auth, config, counter_names, appstats_export, logservice_export, memcache_export
 from third_party.prodeagle.model import CountersLastHarvest, CountersSavedInBetween
 
+# Holds how many "last_slot_%d" test counters the last harvest wrote.
+LOST_DATA_SENTINEL_COUNT_KEY = "last_slot_count"
+# Held by the running harvest. Cron and ProdEagle both trigger harvests, and
+# two harvests reading the same slots would both count them.
+HARVEST_LOCK_KEY = "harvest_lock"
+
 class HarvestHandler(webapp2.RequestHandler):
 
+  def getLostDataSentinelCount(self, n_counters):
+    # More counters make more memcache servers and evictions likely, so the
+    # amount of test counters grows with the amount of counters.
+    return max(config.MIN_LOST_DATA_SENTINELS,
+               min(config.EXPECTED_MEMCACHE_SERVERS,
+                   n_counters * config.LOST_DATA_SENTINELS_PER_COUNTER))
+
   def wasDataLostSinceLastHarvest(self, namespace, slot,
-                                  reset_test_counters=False):
-    lost_data_check_keys = [ "last_slot_%d" % x
-                             for x in range(config.EXPECTED_MEMCACHE_SERVERS) ]
-    lost_data_check = memcache.get_multi(lost_data_check_keys,
-                                         namespace=namespace)
-
-    if reset_test_counters:
-      memcache.delete_multi(lost_data_check_keys, namespace=namespace)
+                                  reset_sentinel_count=None):
+    previous_count = memcache.get(LOST_DATA_SENTINEL_COUNT_KEY,
+                                  namespace=namespace)
+    data_lost = not previous_count
+    if previous_count:
+      lost_data_check_keys = [ "last_slot_%d" % x
+                               for x in range(previous_count) ]
+      lost_data_check = memcache.get_multi(lost_data_check_keys,
+                                           namespace=namespace)
+      data_lost = len(lost_data_check) != len(lost_data_check_keys)
+
+    if reset_sentinel_count:
       next_lost_data = {}
-      for key in lost_data_check_keys:
-        next_lost_data[key] = 1
-      memcache.offset_multi(next_lost_data,
-                            namespace=namespace,
-                            initial_value=0)
+      for x in range(reset_sentinel_count):
+        next_lost_data["last_slot_%d" % x] = 1
+      next_lost_data[LOST_DATA_SENTINEL_COUNT_KEY] = reset_sentinel_count
+      memcache.set_multi(next_lost_data, namespace=namespace)
 
-    if len(lost_data_check) != len(lost_data_check_keys):
+    if data_lost:
       logging.warning("ProdEagle counters lost before %d" % slot)
-      return True
-    return False
+    return data_lost
+
+  def harvestSlot(self, slot, all_keys, namespace):
+    """Returns and removes the updates of slot without losing any.
+
+    Harvested values are subtracted rather than deleted, so increments made
+    after the get are kept for the next harvest.
+    """
+    slot_updates = memcache.get_multi(all_keys, key_prefix=str(slot),
+                                      namespace=namespace)
+    harvested = {}
+    for counter in slot_updates:
+      if slot_updates[counter]:
+        harvested[counter] = slot_updates[counter]
+    if harvested:
+      deltas = {}
+      for counter in harvested:
+        deltas[counter] = -harvested[counter]
+      memcache.offset_multi(deltas, key_prefix=str(slot),
+                            namespace=namespace)
+    return harvested
 
   def addCounterToResult(self, counter, slot, delta, result_counters):
     if counter not in result_counters:
@@ -88,9 +123,21 @@ class HarvestHandler(webapp2.RequestHandler):
     return last_export_date, this_export_date
 
   def createReport(self, production_call=False):
+    cnm = counter_names.getDefaultCounterNamesManager()
+    if not memcache.add(HARVEST_LOCK_KEY, time.time(),
+                        time=config.HARVEST_LOCK_SECONDS,
+                        namespace=cnm.namespace):
+      logging.warning("Another harvest is running.")
+      self.response.set_status(503)
+      return
+    try:
+      self.createLockedReport(cnm, production_call)
+    finally:
+      memcache.delete(HARVEST_LOCK_KEY, namespace=cnm.namespace)
+
+  def createLockedReport(self, cnm, production_call):
     namespace = namespace_manager.get_namespace()
     try:
-      cnm = counter_names.getDefaultCounterNamesManager()
       namespace_manager.set_namespace(cnm.namespace)
 
       last_export_date, this_export_date = self.getAndSetExporDates()
@@ -101,27 +148,28 @@ class HarvestHandler(webapp2.RequestHandler):
                  "counters": {},
                  "ms_of_data_lost": 0,
                  "version": 1.0 }
-      result["all_data_inaccurate"] = self.wasDataLostSinceLastHarvest(
-                                          cnm.namespace, slot, True)
       all_keys = cnm.all(force_reload=True)
+      result["all_data_inaccurate"] = self.wasDataLostSinceLastHarvest(
+          cnm.namespace, slot, self.getLostDataSentinelCount(len(all_keys)))
       while slot <= counter_names.getEpochRounded(this_export_date):
-        gap = time.time()
-        slot_updates = memcache.get_multi(all_keys, key_prefix=str(slot),
-                                          namespace=cnm.namespace)
-        # NOTE(andrin): Between get_multi & delete_multi we loose all updates!
-        memcache.delete_multi(slot_updates.keys(), key_prefix=str(slot),
-                              namespace=cnm.namespace)
-        result["ms_of_data_lost"] = max(int((time.time() - gap) * 1000),
-                                        result["ms_of_data_lost"])
+        slot_updates = self.harvestSlot(slot, all_keys, cnm.namespace)
         for counter in slot_updates:
-          if slot_updates[counter]:
-            self.addCounterToResult(counter, slot, slot_updates[counter],
-                                    result["counters"])
+          self.addCounterToResult(counter, slot, slot_updates[counter],
+                                  result["counters"])
         slot += config.MIN_SLOT_SIZE
 
       result["all_data_inaccurate"] |= self.wasDataLostSinceLastHarvest(
                                            cnm.namespace, slot)
 
+      if config.HARVEST_LISTENER:
+        namespace_manager.set_namespace(namespace)
+        try:
+          webapp2.import_string(config.HARVEST_LISTENER)(result["counters"])
+        except:
+          logging.exception("Harvest listener %s failed." %
+                            config.HARVEST_LISTENER)
+        namespace_manager.set_namespace(cnm.namespace)
+
       if config.APPSTATS_ENABLE:
         appstats = appstats_export.AppStatsExport().getCounters(
             last_export_date, this_export_date)
@@ -4,21 +4,74 @@ from google.appengine.ext import db
 
 import json
 
+
+class RawJson(object):
+  """JSON text read from the datastore which has not been parsed yet."""
+  __slots__ = ('text',)
+
+  def __init__(self, text):
+    self.text = text
+
+
+def EncodeJson(value):
+  """Returns the canonical stored encoding of value as str."""
+  return json.dumps(value, separators=(',', ':'))
+
+
+def ParseJson(text):
+  """Parses stored JSON text.
+
+  Rows written before JsonProperty stored a single encoding hold a JSON
+  string containing the JSON document, so a str result is parsed again.
+  """
+  value = json.loads(text)
+  if isinstance(value, basestring):
+    try:
+      value = json.loads(value)
+    except ValueError:
+      pass
+  return value
+
+
+def IsLegacyJson(text):
+  """Returns True iff text was stored with the old double encoding."""
+  return text.lstrip().startswith('"')
+
+
 class JsonProperty(db.TextProperty):
-  """Stores text which is a JSON blob."""
+  """Stores a JSON-serializable value as a single JSON encoding.
+
+  Values read from the datastore are parsed on first access and the parsed
+  object replaces the raw text on the entity, so later reads are free.
+  Values that were never accessed are written back as their stored text.
+  """
 
   def validate(self, value):
     return value
 
+  def __get__(self, model_instance, model_class):
+    if model_instance is None:
+      return self
+    value = getattr(model_instance, self._attr_name(), None)
+    if isinstance(value, RawJson):
+      value = ParseJson(value.text)
+      setattr(model_instance, self._attr_name(), value)
+    return value
+
   def get_value_for_datastore(self, model_instance):
-    result = super(JsonProperty, self).get_value_for_datastore(model_instance)
-    result = json.dumps(result)
-    return db.Text(result)
+    value = getattr(model_instance, self._attr_name(), None)
+    if value is None:
+      return None
+    if isinstance(value, RawJson):
+      return db.Text(value.text)
+    return db.Text(EncodeJson(value))
 
-  def make_value_from_datastore(self, value):
-    try:
-      value = json.loads(str(value))
-    except:
-      pass
+  def IsLegacyEncoded(self, model_instance):
+    """Returns True iff model_instance still holds double-encoded text."""
+    value = getattr(model_instance, self._attr_name(), None)
+    return isinstance(value, RawJson) and IsLegacyJson(value.text)
 
-    return super(JsonProperty, self).make_value_from_datastore(value)
+  def make_value_from_datastore(self, value):
+    if value is None:
+      return None
+    return RawJson(value)
@@ -0,0 +1,72 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Log bucketed histograms of durations in seconds.
+
+Bucket 0 holds durations under a second. Bucket i > 0 holds durations of at
+least 2 ** ((i - 1) / 2.0) and under 2 ** (i / 2.0) seconds, so each bucket
+is about 41% wider than the last. The last bucket also holds everything
+longer. Histograms are lists of NUM_BUCKETS counts, merged by adding them.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import math
+
+
+BUCKETS_PER_DOUBLING = 2
+# Covers up to 2 ** 21.5 seconds, or about 35 days.
+NUM_BUCKETS = 44
+
+
+def GetBucket(seconds):
+  """Returns index of the bucket holding a duration of seconds."""
+  if seconds < 1:
+    return 0
+  bucket = int(math.floor(math.log(seconds, 2) * BUCKETS_PER_DOUBLING)) + 1
+  return min(bucket, NUM_BUCKETS - 1)
+
+
+def GetUpperBound(bucket):
+  """Returns the duration in seconds bucket holds durations under."""
+  return 2 ** (bucket / float(BUCKETS_PER_DOUBLING))
+
+
+def Merge(histograms):
+  """Returns the sum of given histograms."""
+  merged = [0] * NUM_BUCKETS
+  for histogram in histograms:
+    for (bucket, count) in enumerate(histogram):
+      merged[bucket] += count
+  return merged
+
+
+def GetPercentile(histogram, percentile):
+  """Returns upper bound in seconds of the bucket holding a percentile.
+
+  Args:
+    histogram: List of NUM_BUCKETS counts.
+    percentile: Percentile from 0 to 100.
+
+  Returns:
+    Upper bound in seconds as float, or None if histogram is empty.
+  """
+  total = sum(histogram)
+  if not total:
+    return None
+  rank = total * percentile / 100.0
+  seen = 0
+  for (bucket, count) in enumerate(histogram):
+    seen += count
+    if count and seen >= rank:
+      return GetUpperBound(bucket)
+  return GetUpperBound(NUM_BUCKETS - 1)
@@ -0,0 +1,53 @@
+#!/usr/bin/python
+"""Tests of histogram."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import unittest
+
+from util import histogram
+
+
+class HistogramTest(unittest.TestCase):
+  def testGetBucket(self):
+    self.assertEqual(0, histogram.GetBucket(0))
+    self.assertEqual(0, histogram.GetBucket(0.99))
+    self.assertEqual(1, histogram.GetBucket(1))
+    self.assertEqual(2, histogram.GetBucket(1.5))
+    self.assertEqual(3, histogram.GetBucket(2))
+    self.assertEqual(histogram.NUM_BUCKETS - 1,
+                     histogram.GetBucket(365 * 24 * 60 * 60))
+
+  def testBucketsHoldDurationsUnderUpperBound(self):
+    for seconds in (0.5, 1, 1.41, 1.42, 3, 60, 3600, 86400):
+      bucket = histogram.GetBucket(seconds)
+      self.assertTrue(seconds < histogram.GetUpperBound(bucket))
+      if bucket:
+        self.assertTrue(seconds >= histogram.GetUpperBound(bucket - 1))
+
+  def testMerge(self):
+    first = [0] * histogram.NUM_BUCKETS
+    second = [0] * histogram.NUM_BUCKETS
+    first[0] = 1
+    first[3] = 2
+    second[3] = 4
+    merged = histogram.Merge([first, second])
+    self.assertEqual(1, merged[0])
+    self.assertEqual(6, merged[3])
+    self.assertEqual(7, sum(merged))
+
+  def testGetPercentile(self):
+    counts = [0] * histogram.NUM_BUCKETS
+    self.assertEqual(None, histogram.GetPercentile(counts, 50))
+    counts[0] = 2
+    counts[3] = 2
+    self.assertEqual(1.0, histogram.GetPercentile(counts, 0))
+    self.assertEqual(1.0, histogram.GetPercentile(counts, 50))
+    self.assertEqual(histogram.GetUpperBound(3),
+                     histogram.GetPercentile(counts, 51))
+    self.assertEqual(histogram.GetUpperBound(3),
+                     histogram.GetPercentile(counts, 100))
+
+
+if __name__ == '__main__':
+  unittest.main()
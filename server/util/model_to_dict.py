@@ -1,5 +1,6 @@
 """Converts AppEngine db.Model's to JSON."""
 
+from google.appengine.api import users
 from google.appengine.ext import db
 from google.appengine.ext.blobstore import blobstore
 
@@ -9,42 +10,228 @@ import logging
 import time
 
 from util import db_properties
+from util import tracing
 
 
 SIMPLE_TYPES = (int, long, float, bool, dict, basestring, list)
 
+# Separators for compact JSON output.
+COMPACT_SEPARATORS = (',', ':')
 
-def ModelToDict(model):
-  """Returns dictionary from given db.Model."""
+
+@tracing.Traced('json.Dump')
+def DumpJson(value, out):
+  """Writes value to file-like out as compact JSON."""
+  json.dump(value, out, separators=COMPACT_SEPARATORS, check_circular=False)
+
+
+@tracing.Traced('json.Dump')
+def DumpsJson(value):
+  """Returns value as a compact JSON str."""
+  return json.dumps(value, separators=COMPACT_SEPARATORS,
+                    check_circular=False)
+
+
+def EncodeDate(value):
+  """Converts date/datetime to ms-since-epoch ("new Date()")."""
+  ms = time.mktime(value.utctimetuple()) * 1000
+  ms += getattr(value, 'microseconds', 0) / 1000
+  return int(ms)
+
+
+def EncodeValue(value):
+  """Encodes a property value whose type is only known at runtime."""
+  if value is None or isinstance(value, SIMPLE_TYPES):
+    return value
+  if isinstance(value, datetime.date):
+    return EncodeDate(value)
+  if isinstance(value, db.GeoPt):
+    return {'lat': value.lat, 'lon': value.lon}
+  if isinstance(value, users.User):
+    return value.email()
+  if isinstance(value, db.Model):
+    return ModelToDict(value)
+  raise ValueError('cannot encode ' + repr(value))
+
+
+def EncodeSimpleProperty(model, name, prop, references):
+  return getattr(model, name)
+
+
+def EncodeDateProperty(model, name, prop, references):
+  value = getattr(model, name)
+  if value is None:
+    return None
+  return EncodeDate(value)
+
+
+def EncodeGeoPtProperty(model, name, prop, references):
+  value = getattr(model, name)
+  if value is None:
+    return None
+  return {'lat': value.lat, 'lon': value.lon}
+
+
+def EncodeUserProperty(model, name, prop, references):
+  value = getattr(model, name)
+  if value is None:
+    return None
+  return value.email()
+
+
+def EncodeBlobReferenceProperty(model, name, prop, references):
+  # Reads the raw BlobKey so no BlobInfo is constructed.
+  if prop.get_value_for_datastore(model) is None:
+    return None
+  # TODO: Implement this if it's needed.
+  return 'UnimplementedBlobRef'
+
+
+def GetResolvedReference(model, name):
+  """Returns the already-loaded referenced model, or None."""
+  return model.__dict__.get('_RESOLVED_' + name, None)
+
+
+def EncodeReferenceProperty(model, name, prop, references):
+  """Encodes a referenced model without an extra datastore RPC if possible.
+
+  The referenced model is taken from the reference already resolved on model,
+  then from the references prefetched by ModelsToDicts, and only then
+  fetched from the datastore.
+  """
+  key = prop.get_value_for_datastore(model)
+  if key is None:
+    return None
+  referenced = GetResolvedReference(model, name)
+  if referenced is None and references is not None:
+    referenced = references.get(key, None)
+  if referenced is None:
+    referenced = getattr(model, name)
+  if referenced is None:
+    return None
+  return ModelToDict(referenced)
+
+
+def EncodeDynamicProperty(model, name, prop, references):
+  return EncodeValue(getattr(model, name))
+
+
+def MakePropertyEncoder(prop):
+  """Picks the encoder function for given db.Property once per class."""
+  if isinstance(prop, db_properties.JsonProperty):
+    # JsonProperty parses once and caches the parsed value on the model.
+    return EncodeSimpleProperty
+  if isinstance(prop, blobstore.BlobReferenceProperty):
+    return EncodeBlobReferenceProperty
+  if isinstance(prop, db.ReferenceProperty):
+    return EncodeReferenceProperty
+  if isinstance(prop, (db.DateTimeProperty, db.DateProperty,
+                       db.TimeProperty)):
+    return EncodeDateProperty
+  if isinstance(prop, db.GeoPtProperty):
+    return EncodeGeoPtProperty
+  if isinstance(prop, db.UserProperty):
+    return EncodeUserProperty
+  if type(prop) in (db.StringProperty, db.TextProperty, db.IntegerProperty,
+                    db.FloatProperty, db.BooleanProperty,
+                    db.StringListProperty):
+    return EncodeSimpleProperty
+  return EncodeDynamicProperty
+
+
+class ModelEncoder(object):
+  """Converts instances of a single db.Model class to dicts.
+
+  Property encoders are chosen once when the encoder is built rather than by
+  type-checking every value of every instance.
+  """
+
+  def __init__(self, model_class):
+    self.model_class = model_class
+    self.encoders = [(name, prop, MakePropertyEncoder(prop))
+                     for (name, prop) in model_class.properties().iteritems()]
+    self.reference_props = [prop for (_, prop, encoder) in self.encoders
+                            if encoder is EncodeReferenceProperty]
+
+  def Encode(self, model, properties=None, references=None):
+    """Returns dictionary from given model.
+
+    Args:
+      model: Instance of model_class to convert.
+      properties: Optional collection of property names to include.
+      references: Optional dict of {db.Key: db.Model} of prefetched models
+                  referenced by model.
+    """
+    output = {}
+    output['id'] = model.key().id_or_name()
+    for (name, prop, encoder) in self.encoders:
+      if properties is not None and name not in properties:
+        continue
+      output[name] = encoder(model, name, prop, references)
+    return output
+
+  def GetUnresolvedReferenceKeys(self, model, properties=None):
+    """Returns keys of referenced models not yet loaded on model."""
+    keys = []
+    for prop in self.reference_props:
+      if properties is not None and prop.name not in properties:
+        continue
+      if GetResolvedReference(model, prop.name) is not None:
+        continue
+      key = prop.get_value_for_datastore(model)
+      if key is not None:
+        keys.append(key)
+    return keys
+
+
+_model_encoders = {}
+
+
+def GetModelEncoder(model_class):
+  """Returns the cached ModelEncoder for given db.Model subclass."""
+  encoder = _model_encoders.get(model_class, None)
+  if encoder is None:
+    encoder = ModelEncoder(model_class)
+    _model_encoders[model_class] = encoder
+  return encoder
+
+
+@tracing.Traced('model_to_dict.ModelToDict')
+def ModelToDict(model, properties=None):
+  """Returns dictionary from given db.Model.
+
+  Args:
+    model: db.Model to convert.
+    properties: Optional list of property names to include. All properties
+                are included if None. 'id' is always included.
+  """
   if not isinstance(model, db.Model):
     logging.error('%s is not an instance of db.Model. It is %s',
                   model, model.__class__)
   assert isinstance(model, db.Model)
-  output = {}
-  output['id'] = model.key().id_or_name()
-
-  for key, prop in model.properties().iteritems():
-    value = getattr(model, key)
-
-    if value is None:
-      output[key] = value
-    elif isinstance(prop, db_properties.JsonProperty):
-      output[key] = json.loads(value)
-    elif isinstance(value, SIMPLE_TYPES):
-      output[key] = value
-    elif isinstance(value, datetime.date):
-      # Convert date/datetime to ms-since-epoch ("new Date()").
-      ms = time.mktime(value.utctimetuple()) * 1000
-      ms += getattr(value, 'microseconds', 0) / 1000
-      output[key] = int(ms)
-    elif isinstance(value, db.GeoPt):
-      output[key] = {'lat': value.lat, 'lon': value.lon}
-    elif isinstance(prop, blobstore.BlobReferenceProperty):
-      # TODO: Implement this if it's needed.
-      output[key] = 'UnimplementedBlobRef'
-    elif isinstance(value, db.Model):
-      output[key] = ModelToDict(value)
-    else:
-      raise ValueError('cannot encode ' + repr(prop))
-
-  return output
+  return GetModelEncoder(model.__class__).Encode(model, properties)
+
+
+@tracing.Traced('model_to_dict.ModelsToDicts')
+def ModelsToDicts(models, properties=None):
+  """Returns list of dictionaries from given list of db.Model.
+
+  Models referenced through ReferenceProperty are fetched with a single
+  batch get rather than one get per model.
+  """
+  if not models:
+    return []
+  reference_keys = []
+  for model in models:
+    encoder = GetModelEncoder(model.__class__)
+    reference_keys.extend(
+        encoder.GetUnresolvedReferenceKeys(model, properties))
+  references = None
+  if reference_keys:
+    references = dict(
+        (key, referenced) for (key, referenced)
+        in zip(reference_keys, db.get(reference_keys))
+        if referenced is not None)
+  return [GetModelEncoder(model.__class__).Encode(model, properties,
+                                                  references)
+          for model in models]
@@ -0,0 +1,157 @@
+#!/usr/bin/python
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Measures per-task encode cost of model_to_dict on list and assign paths.
+
+Compares the original per-value isinstance-dispatching conversion of a
+double-encoded config followed by an indented json.dump against the cached
+ModelEncoder over a singly-encoded config with compact output. Both paths
+include parsing the config as loaded from the datastore.
+
+Run from the server directory with the AppEngine SDK on PYTHONPATH:
+  python util/model_to_dict_benchmark.py [num_tasks] [iterations]
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import os
+import StringIO
+import sys
+import time
+
+os.environ.setdefault('APPLICATION_ID', 'mrtaskman')
+
+from google.appengine.ext import db
+
+import datetime
+import json
+
+from models import tasks
+from util import db_properties
+from util import model_to_dict
+
+
+CONFIG = {
+    'task': {
+        'name': 'benchmark',
+        'command': 'python android_monkey.py',
+        'timeout': '10m',
+        'requirements': {'executor': ['Galaxy Nexus', 'macos']},
+    },
+    'packages': [{'name': 'monkey', 'version': 1}],
+}
+
+# Config as stored by the original double-encoding JsonProperty.
+LEGACY_CONFIG_TEXT = json.dumps(json.dumps(CONFIG))
+# Config as stored by the current JsonProperty.
+CONFIG_TEXT = db_properties.EncodeJson(CONFIG)
+
+
+def OriginalModelToDict(model):
+  """The per-call isinstance-dispatching conversion being replaced."""
+  output = {}
+  output['id'] = model.key().id_or_name()
+  for key, prop in model.properties().iteritems():
+    if isinstance(prop, db_properties.JsonProperty):
+      # Parsed once when loaded, then again for the response.
+      value = json.loads(LEGACY_CONFIG_TEXT)
+    else:
+      value = getattr(model, key)
+    if value is None:
+      output[key] = value
+    elif isinstance(prop, db_properties.JsonProperty):
+      output[key] = json.loads(value)
+    elif isinstance(value, model_to_dict.SIMPLE_TYPES):
+      output[key] = value
+    elif isinstance(value, datetime.date):
+      output[key] = model_to_dict.EncodeDate(value)
+    else:
+      raise ValueError('cannot encode ' + repr(prop))
+  return output
+
+
+def MakeTasks(num_tasks):
+  """Returns num_tasks unsaved Tasks with complete keys."""
+  now = datetime.datetime.now()
+  return [tasks.Task(key=db.Key.from_path('TaskParent', '0', 'Task', i + 1),
+                     name='benchmark',
+                     config=CONFIG,
+                     executor_requirements=['Galaxy Nexus', 'macos'],
+                     scheduled_time=now,
+                     assigned_time=now,
+                     assigned_worker='worker%d' % i)
+          for i in xrange(num_tasks)]
+
+
+def TimePerTask(function, task_list, iterations):
+  """Returns mean seconds per task of calling function(task_list).
+
+  Configs are reset to unparsed stored text before each iteration, as every
+  request loads fresh entities.
+  """
+  config_attr = tasks.Task.config._attr_name()
+  elapsed = 0.0
+  for _ in xrange(iterations):
+    for task in task_list:
+      setattr(task, config_attr, db_properties.RawJson(CONFIG_TEXT))
+    begin = time.time()
+    function(task_list)
+    elapsed += time.time() - begin
+  return elapsed / (iterations * len(task_list))
+
+
+def OriginalList(task_list):
+  response = {'kind': 'mrtaskman#task_list',
+              'tasks': [OriginalModelToDict(task) for task in task_list]}
+  json.dump(response, StringIO.StringIO(), indent=2)
+
+
+def CompiledList(task_list):
+  response = {'kind': 'mrtaskman#task_list',
+              'tasks': model_to_dict.ModelsToDicts(task_list)}
+  model_to_dict.DumpJson(response, StringIO.StringIO())
+
+
+def OriginalAssign(task_list):
+  for task in task_list:
+    response = OriginalModelToDict(task)
+    response['kind'] = 'mrtaskman#task'
+    json.dump(response, StringIO.StringIO(), indent=2)
+
+
+def CompiledAssign(task_list):
+  for task in task_list:
+    response = model_to_dict.ModelToDict(task)
+    response['kind'] = 'mrtaskman#task'
+    model_to_dict.DumpJson(response, StringIO.StringIO())
+
+
+def main(argv):
+  num_tasks = int(argv[1]) if len(argv) > 1 else 1000
+  iterations = int(argv[2]) if len(argv) > 2 else 10
+  task_list = MakeTasks(num_tasks)
+
+  print 'path,original_us_per_task,compiled_us_per_task,speedup'
+  for (path, original, compiled) in [('list', OriginalList, CompiledList),
+                                     ('assign', OriginalAssign,
+                                      CompiledAssign)]:
+    original_cost = TimePerTask(original, task_list, iterations)
+    compiled_cost = TimePerTask(compiled, task_list, iterations)
+    print '%s,%.1f,%.1f,%.2f' % (path, original_cost * 1e6,
+                                 compiled_cost * 1e6,
+                                 original_cost / compiled_cost)
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv))
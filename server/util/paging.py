@@ -0,0 +1,41 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Provides FetchPage for paging through db.Query results with cursors."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.ext.db import datastore_query
+
+
+def FetchPage(query, limit, cursor=None):
+  """Fetches one page of results from query.
+
+  Args:
+    query: db.Query to fetch from.
+    limit: Maximum number of results to fetch as int.
+    cursor: Websafe cursor string to resume from, or None.
+
+  Returns:
+    (results, next_cursor) where next_cursor is a websafe cursor string,
+    or None if there are no more results.
+  """
+  if cursor:
+    results = query.fetch(
+        limit=limit,
+        start_cursor=datastore_query.Cursor.from_websafe_string(cursor))
+  else:
+    results = query.fetch(limit=limit)
+  next_cursor = None
+  if len(results) >= limit:
+    next_cursor = query.cursor()
+  return (results, next_cursor)
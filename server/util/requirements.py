@@ -0,0 +1,240 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Parses and evaluates Task requirement expressions.
+
+An expression compares worker attributes with values, combined with AND, OR
+and parentheses, for example:
+
+  os_version >= 4.0 AND (provider = Verizon OR provider = 'AT&T')
+
+= and != compare strs exactly. <, <=, > and >= compare dotted version
+numbers numerically when both sides are versions, and strs otherwise.
+
+Expressions are kept in disjunctive normal form: a list of conjunctions,
+each a list of (attribute, operator, value) comparisons.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import collections
+import re
+
+
+class Error(Exception):
+  pass
+
+
+class ParseError(Error):
+  pass
+
+
+# Most conjunctions an expression may expand to.
+MAX_CONJUNCTIONS = 32
+
+TOKEN_REGEX = re.compile(r"""
+    \s*(?:
+      (?P<paren>[()])|
+      (?P<operator><=|>=|!=|=|<|>)|
+      '(?P<quoted>[^']*)'|
+      (?P<word>[^\s()<>=!']+)
+    )""", re.VERBOSE)
+
+VERSION_REGEX = re.compile(r'^\d+(\.\d+)*$')
+
+ATTRIBUTE_TERM_PREFIX = 'attr:'
+
+
+def Tokenize(text):
+  """Returns list of (kind, value) tokens of text."""
+  tokens = []
+  position = 0
+  text = text.rstrip()
+  while position < len(text):
+    match = TOKEN_REGEX.match(text, position)
+    if not match:
+      raise ParseError('Unexpected character at %d: %s' %
+                       (position, text[position:]))
+    position = match.end()
+    for kind in ('paren', 'operator', 'quoted', 'word'):
+      value = match.group(kind)
+      if value is not None:
+        if kind == 'word' and value.upper() in ('AND', 'OR'):
+          tokens.append(('keyword', value.upper()))
+        elif kind == 'quoted':
+          tokens.append(('word', value))
+        else:
+          tokens.append((kind, value))
+        break
+  return tokens
+
+
+class Parser(object):
+  """Recursive descent parser producing disjunctive normal form."""
+
+  def __init__(self, text):
+    self.tokens_ = Tokenize(text)
+    self.position_ = 0
+
+  def Peek(self):
+    if self.position_ < len(self.tokens_):
+      return self.tokens_[self.position_]
+    return (None, None)
+
+  def Next(self, kind):
+    (token_kind, value) = self.Peek()
+    if token_kind != kind:
+      raise ParseError('Expected %s but got %s.' % (kind, value))
+    self.position_ += 1
+    return value
+
+  def Parse(self):
+    dnf = self.ParseOr()
+    if self.Peek()[0] is not None:
+      raise ParseError('Unexpected %s.' % self.Peek()[1])
+    return dnf
+
+  def ParseOr(self):
+    dnf = self.ParseAnd()
+    while self.Peek() == ('keyword', 'OR'):
+      self.position_ += 1
+      dnf = dnf + self.ParseAnd()
+      CheckSize(dnf)
+    return dnf
+
+  def ParseAnd(self):
+    dnf = self.ParseTerm()
+    while self.Peek() == ('keyword', 'AND'):
+      self.position_ += 1
+      right = self.ParseTerm()
+      # Distributes AND over the ORs of both sides.
+      dnf = [left_conjunction + right_conjunction
+             for left_conjunction in dnf
+             for right_conjunction in right]
+      CheckSize(dnf)
+    return dnf
+
+  def ParseTerm(self):
+    if self.Peek() == ('paren', '('):
+      self.position_ += 1
+      dnf = self.ParseOr()
+      if self.Next('paren') != ')':
+        raise ParseError('Expected ).')
+      return dnf
+    attribute = self.Next('word')
+    operator = self.Next('operator')
+    value = self.Next('word')
+    return [[(attribute, operator, value)]]
+
+
+def CheckSize(dnf):
+  if len(dnf) > MAX_CONJUNCTIONS:
+    raise ParseError('Expression expands to over %d alternatives.' %
+                     MAX_CONJUNCTIONS)
+
+
+# Most parsed expressions kept, least recently used dropped first.
+MAX_PARSED = 1000
+
+_parsed = collections.OrderedDict()
+
+
+def Parse(text):
+  """Returns expression text in disjunctive normal form.
+
+  Raises:
+    ParseError if text is not a valid expression.
+  """
+  dnf = _parsed.pop(text, None)
+  if dnf is None:
+    dnf = Parser(text).Parse()
+    if len(_parsed) >= MAX_PARSED:
+      _parsed.popitem(last=False)
+  _parsed[text] = dnf
+  return dnf
+
+
+def ParseVersion(value):
+  """Returns value as a tuple of ints without trailing zeros, or None."""
+  if not VERSION_REGEX.match(value):
+    return None
+  parts = [int(part) for part in value.split('.')]
+  while len(parts) > 1 and parts[-1] == 0:
+    parts.pop()
+  return tuple(parts)
+
+
+def Compare(actual, operator, expected):
+  """Returns True iff actual compares to expected by operator."""
+  if operator == '=':
+    return actual == expected
+  if operator == '!=':
+    return actual != expected
+  actual_version = ParseVersion(actual)
+  expected_version = ParseVersion(expected)
+  if actual_version is not None and expected_version is not None:
+    (actual, expected) = (actual_version, expected_version)
+  if operator == '<':
+    return actual < expected
+  if operator == '<=':
+    return actual <= expected
+  if operator == '>':
+    return actual > expected
+  return actual >= expected
+
+
+def Evaluate(dnf, attributes):
+  """Returns True iff dict of attributes satisfies expression dnf."""
+  for conjunction in dnf:
+    for (attribute, operator, expected) in conjunction:
+      actual = attributes.get(attribute, None)
+      if actual is None or not Compare(actual, operator, expected):
+        break
+    else:
+      return True
+  return False
+
+
+def MakeAttributeTerm(attribute, value=None):
+  """Returns the capability term for an attribute, or attribute value."""
+  if value is None:
+    return '%s%s' % (ATTRIBUTE_TERM_PREFIX, attribute)
+  return '%s%s=%s' % (ATTRIBUTE_TERM_PREFIX, attribute, value)
+
+
+def GetAnchorTerms(dnf):
+  """Returns terms at least one of which every matching worker has.
+
+  Each conjunction is anchored on its first equality, or on the presence of
+  its first attribute if it has no equality.
+  """
+  terms = []
+  for conjunction in dnf:
+    term = None
+    for (attribute, operator, value) in conjunction:
+      if operator == '=':
+        term = MakeAttributeTerm(attribute, value)
+        break
+    if term is None:
+      term = MakeAttributeTerm(conjunction[0][0])
+    if term not in terms:
+      terms.append(term)
+  return terms
+
+
+def GetWorkerTerms(attributes):
+  """Returns the capability terms of a worker with dict of attributes."""
+  terms = []
+  for (attribute, value) in attributes.iteritems():
+    terms.append(MakeAttributeTerm(attribute))
+    terms.append(MakeAttributeTerm(attribute, value))
+  return terms
@@ -0,0 +1,79 @@
+#!/usr/bin/python
+"""Tests of requirements."""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+import unittest
+
+from util import requirements
+
+
+class RequirementsTest(unittest.TestCase):
+  def testTokenize(self):
+    self.assertEqual(
+        [('word', 'provider'), ('operator', '!='), ('word', 'AT&T'),
+         ('keyword', 'OR'), ('paren', '('), ('word', 'os'),
+         ('operator', '>='), ('word', '4.0'), ('paren', ')')],
+        requirements.Tokenize("provider != 'AT&T' or (os>=4.0) "))
+
+  def testParseDistributesAndOverOr(self):
+    self.assertEqual(
+        [[('os_version', '>=', '4.0'), ('provider', '=', 'Verizon')],
+         [('os_version', '>=', '4.0'), ('provider', '=', 'AT&T')]],
+        requirements.Parse(
+            "os_version >= 4.0 AND (provider = Verizon OR provider = 'AT&T')"))
+
+  def testParseErrors(self):
+    for text in ('', 'os', 'os =', 'os = 4 AND', '(os = 4', 'os = 4)',
+                 'os ~ 4'):
+      self.assertRaises(requirements.ParseError, requirements.Parse, text)
+
+  def testParseLimitsConjunctions(self):
+    text = ' AND '.join(['(a%d = 1 OR a%d = 2)' % (i, i) for i in xrange(6)])
+    self.assertRaises(requirements.ParseError, requirements.Parse, text)
+
+  def testParseCacheDropsLeastRecentlyUsed(self):
+    max_parsed = requirements.MAX_PARSED
+    requirements.MAX_PARSED = 2
+    try:
+      requirements._parsed.clear()
+      requirements.Parse('a = 1')
+      requirements.Parse('b = 1')
+      requirements.Parse('a = 1')
+      requirements.Parse('c = 1')
+      self.assertEqual(['a = 1', 'c = 1'], list(requirements._parsed))
+    finally:
+      requirements.MAX_PARSED = max_parsed
+      requirements._parsed.clear()
+
+  def testEvaluate(self):
+    dnf = requirements.Parse('os_version > 4.9 AND provider != Sprint')
+    self.assertTrue(requirements.Evaluate(
+        dnf, {'os_version': '4.10', 'provider': 'Verizon'}))
+    self.assertFalse(requirements.Evaluate(
+        dnf, {'os_version': '4.10', 'provider': 'Sprint'}))
+    self.assertFalse(requirements.Evaluate(dnf, {'os_version': '4.10'}))
+    # Trailing zeros do not change a version.
+    dnf = requirements.Parse('os_version <= 4 AND os_version >= 4.0.0')
+    self.assertTrue(requirements.Evaluate(dnf, {'os_version': '4.0'}))
+    # Values which are not versions compare as strs.
+    dnf = requirements.Parse('model < b')
+    self.assertTrue(requirements.Evaluate(dnf, {'model': 'a10'}))
+
+  def testGetAnchorTerms(self):
+    dnf = requirements.Parse(
+        '(os_version >= 4 AND provider = Verizon) OR os_version < 2 OR '
+        'provider = Verizon')
+    self.assertEqual(['attr:provider=Verizon', 'attr:os_version'],
+                     requirements.GetAnchorTerms(dnf))
+
+  def testWorkerTermsMatchAnchorTerms(self):
+    dnf = requirements.Parse('os_version >= 4 OR provider = Verizon')
+    worker_terms = requirements.GetWorkerTerms(
+        {'os_version': '4.1', 'provider': 'Sprint'})
+    self.assertTrue(set(requirements.GetAnchorTerms(dnf)) &
+                    set(worker_terms))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,189 @@
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Sampled timing of spans of our own code within requests.
+
+TracingMiddleware samples SAMPLE_RATE of requests. Within a sampled request,
+each Span records its wall time and the API RPCs made while it ran, summed
+by span name. Each finished trace is stored in one of RING_SIZE memcache
+slots, and GetRecentTraces and AggregateTraces read them back.
+
+Unsampled requests only pay for a random number and a few attribute reads.
+"""
+
+__author__ = 'jeff.carollo@gmail.com (Jeff Carollo)'
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.api import memcache
+
+import functools
+import random
+import threading
+import time
+
+
+# Fraction of requests traced.
+SAMPLE_RATE = 0.05
+
+# Traces kept in memcache, and for how long.
+RING_SIZE = 200
+TRACE_SECONDS = 60 * 60
+
+TRACE_MEMCACHE_PREFIX = 'trace:'
+
+_request = threading.local()
+
+
+class Trace(object):
+  """Spans of a single sampled request."""
+
+  def __init__(self, path):
+    self.path = path
+    self.start = time.time()
+    self.rpcs = 0
+    # {name: [count, seconds, rpcs]}
+    self.spans = {}
+    # Names of spans running, so recursive spans are only timed outermost.
+    self.active = set()
+
+  def ToDict(self):
+    trace = {}
+    trace['path'] = self.path
+    trace['time'] = int(self.start)
+    trace['ms'] = int((time.time() - self.start) * 1000)
+    trace['rpcs'] = self.rpcs
+    trace['spans'] = dict(
+        [(name, {'count': count, 'ms': int(seconds * 1000), 'rpcs': rpcs})
+         for (name, (count, seconds, rpcs)) in self.spans.iteritems()])
+    return trace
+
+
+def GetTrace():
+  """Returns the Trace of the current request, or None if not sampled."""
+  return getattr(_request, 'trace', None)
+
+
+def CountRpc(service, call, request, response):
+  trace = GetTrace()
+  if trace is not None:
+    trace.rpcs += 1
+
+
+apiproxy_stub_map.apiproxy.GetPreCallHooks().Append('tracing', CountRpc)
+
+
+class Span(object):
+  """Context manager timing a named span of the current request's trace."""
+
+  def __init__(self, name):
+    self.name = name
+    self.trace = None
+
+  def __enter__(self):
+    trace = GetTrace()
+    if trace is None or self.name in trace.active:
+      return self
+    self.trace = trace
+    trace.active.add(self.name)
+    self.start = time.time()
+    self.rpcs = trace.rpcs
+    return self
+
+  def __exit__(self, exc_type, exc_value, traceback):
+    trace = self.trace
+    if trace is None:
+      return False
+    trace.active.discard(self.name)
+    span = trace.spans.setdefault(self.name, [0, 0.0, 0])
+    span[0] += 1
+    span[1] += time.time() - self.start
+    span[2] += trace.rpcs - self.rpcs
+    return False
+
+
+def Traced(name):
+  """Decorator running each call of a function in a Span called name."""
+  def Decorate(function):
+    @functools.wraps(function)
+    def Wrapper(*args, **kwargs):
+      with Span(name):
+        return function(*args, **kwargs)
+    return Wrapper
+  return Decorate
+
+
+def SaveTrace(trace):
+  slot = random.randrange(RING_SIZE)
+  memcache.set('%s%d' % (TRACE_MEMCACHE_PREFIX, slot), trace.ToDict(),
+               time=TRACE_SECONDS)
+
+
+class TracingMiddleware(object):
+  """WSGI middleware tracing a sample of requests."""
+
+  def __init__(self, app, sample_rate=None):
+    self.app = app
+    self.sample_rate = sample_rate
+
+  def __call__(self, environ, start_response):
+    sample_rate = self.sample_rate
+    if sample_rate is None:
+      sample_rate = SAMPLE_RATE
+    if random.random() >= sample_rate:
+      return self.app(environ, start_response)
+    trace = Trace('%s %s' % (environ.get('REQUEST_METHOD', ''),
+                             environ.get('PATH_INFO', '')))
+    _request.trace = trace
+    try:
+      return self.app(environ, start_response)
+    finally:
+      _request.trace = None
+      SaveTrace(trace)
+
+
+def GetRecentTraces():
+  """Returns list of recently saved trace dicts, latest first."""
+  keys = ['%s%d' % (TRACE_MEMCACHE_PREFIX, slot)
+          for slot in xrange(RING_SIZE)]
+  traces = memcache.get_multi(keys).values()
+  traces.sort(key=lambda trace: trace['time'], reverse=True)
+  return traces
+
+
+def AddStats(stats, name, ms, rpcs):
+  stat = stats.setdefault(name, {'count': 0, 'total_ms': 0, 'max_ms': 0,
+                                 'total_rpcs': 0})
+  stat['count'] += 1
+  stat['total_ms'] += ms
+  stat['max_ms'] = max(stat['max_ms'], ms)
+  stat['total_rpcs'] += rpcs
+
+
+def AggregateTraces(traces):
+  """Returns per request path and per span name stats of given traces.
+
+  Returns:
+    Dict of {'paths': {path: stats}, 'spans': {name: stats}}, where stats
+    holds count, mean_ms, max_ms and mean_rpcs. A span's count is of the
+    traces it ran in.
+  """
+  paths = {}
+  spans = {}
+  for trace in traces:
+    AddStats(paths, trace['path'], trace['ms'], trace['rpcs'])
+    for (name, span) in trace['spans'].iteritems():
+      AddStats(spans, name, span['ms'], span['rpcs'])
+  for stats in (paths, spans):
+    for stat in stats.itervalues():
+      stat['mean_ms'] = stat.pop('total_ms') / float(stat['count'])
+      stat['mean_rpcs'] = stat.pop('total_rpcs') / float(stat['count'])
+  return {'paths': paths, 'spans': spans}
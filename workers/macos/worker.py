@@ -27,8 +27,10 @@ import subprocess
 import sys
 import time
 import urllib2
+import uuid
 
 import gflags
+from client import event_buffer
 from client import mrtaskman_api
 from client import package_installer
 from client import package_cache
@@ -43,6 +45,13 @@ gflags.DEFINE_string('log_filename', '', 'Where to log stuff. Required.')
 gflags.DEFINE_string('worker_name', '', 'Unique worker name.')
 gflags.DEFINE_list('worker_capabilities', ['macos', 'android'],
                    'Things this worker can do.')
+gflags.DEFINE_integer('tasks_per_assign', 3,
+                      'Most tasks to be assigned at once. Tasks assigned '
+                      'together run back to back and send results together.')
+gflags.DEFINE_integer('event_batch_size', event_buffer.DEFAULT_MAX_EVENTS,
+                      'Events buffered before they are sent together.')
+gflags.DEFINE_integer('event_flush_seconds', event_buffer.DEFAULT_MAX_SECONDS,
+                      'Longest an event is buffered before it is sent.')
 
 # Package cache flags.
 gflags.DEFINE_boolean('use_cache', True, 'Whether or not to use package cache.')
@@ -67,10 +76,23 @@ class MrTaskmanRecoverableHttpError(TaskError):
   pass
 
 
+# Most task complete URLs fetched to send a single task's result.
+MAX_TASK_COMPLETE_URL_ATTEMPTS = 3
+# Most times a single task's result is sent before giving up, backing off
+# from 10 seconds up to MAX_SEND_RETRY_SECONDS between sends.
+MAX_SEND_ATTEMPTS = 10
+MAX_SEND_RETRY_SECONDS = 5 * 60
+
+
 def GetHostname():
   return socket.gethostname()
 
 
+def MakeDeadline(expires_in):
+  """Returns time.time() expires_in seconds from now."""
+  return time.time() + expires_in
+
+
 class MacOsWorker(object):
   """Executes macos tasks."""
 
@@ -79,10 +101,11 @@ class MacOsWorker(object):
     self.log_stream_ = log_stream
     self.api_ = mrtaskman_api.MrTaskmanApi()
     self.hostname_ = GetHostname()
-    self.capabilities_ = {'executor': self.GetCapabilities()}
-    self.executors_ = {}
-    for capability in self.capabilities_['executor']:
-      self.executors_[capability] = self.ExecuteTask
+    self.capabilities_ = {'executor': self.GetCapabilities(),
+                          'attributes': device_info.GetAttributes()}
+    self.events_ = event_buffer.EventBuffer(
+        self.api_, worker_name, FLAGS.event_batch_size,
+        FLAGS.event_flush_seconds)
     self.use_cache_ = FLAGS.use_cache
     if self.use_cache_:
       self.package_cache_ = package_cache.PackageCache(
@@ -91,6 +114,8 @@ class MacOsWorker(object):
           FLAGS.cache_path,
           FLAGS.low_watermark_percentage,
           FLAGS.high_watermark_percentage)
+    # Timings of the last result upload, reported with the next results.
+    self.last_upload_timings_ = None
 
   def GetCapabilities(self):
     capabilities = device_info.GetCapabilities()
@@ -98,16 +123,17 @@ class MacOsWorker(object):
     capabilities.append(self.worker_name_)
     return capabilities
 
-  def AssignTask(self):
-    """Makes a request to /tasks/assign to get assigned a task.
+  def AssignTasks(self):
+    """Makes a request to /tasks/assign to get assigned a batch of tasks.
 
     Returns:
-      Task if a task was assigned, or None.
+      mrtaskman#task_list if any tasks were assigned, or None.
+      Its ['task_results_url_deadline'] is when its URL expires as time.time().
     """
     try:
-      task = self.api_.AssignTask(self.worker_name_, self.hostname_,
-                                  self.capabilities_)
-      return task
+      task_list = self.api_.AssignTasks(self.worker_name_, self.hostname_,
+                                        self.capabilities_,
+                                        FLAGS.tasks_per_assign)
     except urllib2.HTTPError, e:
       logging.info('Got %d HTTP response from MrTaskman on AssignTask.',
                    e.code)
@@ -115,22 +141,115 @@ class MacOsWorker(object):
     except urllib2.URLError, e:
       logging.info('Got URLError trying to reach MrTaskman: %s', e)
       return None
+    if task_list:
+      task_list['task_results_url_deadline'] = MakeDeadline(
+          task_list.get('task_results_url_expires_in', 0))
+    return task_list
+
+  def GetTaskResultsUrl(self, task_list):
+    """Returns an unexpired URL to send results of task_list to, or None.
+
+    Only asks MrTaskman for a fresh URL if the assigned one has expired.
+    """
+    if (task_list.get('task_results_url', None) and
+        time.time() < task_list['task_results_url_deadline']):
+      return task_list['task_results_url']
+    logging.info('Task results URL expired. Getting a fresh one.')
+    try:
+      response = self.api_.GetTaskResultsUrl()
+    except urllib2.HTTPError, error_response:
+      logging.warning('GetTaskResultsUrl HTTPError code %d\n%s',
+                      error_response.code, error_response.read())
+      return None
+    except urllib2.URLError, e:
+      logging.info('Got URLError trying to reach MrTaskman: %s', e)
+      return None
+    task_list['task_results_url'] = response['task_results_url']
+    task_list['task_results_url_deadline'] = MakeDeadline(
+        response.get('task_results_url_expires_in', 0))
+    return task_list['task_results_url']
+
+  def SendResponses(self, task_list, completed):
+    """Sends results of a batch of tasks in a single upload.
+
+    Falls back to sending each result with SendResponse if the batch upload
+    fails. Timings of the upload are reported with the next task's results.
+
+    Args:
+      task_list: mrtaskman#task_list the tasks were assigned in.
+      completed: List of (task_id, stdout, stderr, task_result).
+    """
+    start_time = time.time()
+    upload_timings = {
+      'tasks': len(completed),
+      'bytes': sum([len(stdout) + len(stderr)
+                    for (_, stdout, stderr, _) in completed]),
+      'batched': False,
+    }
+    try:
+      upload_timings['batched'] = self.SendBatchResponse(task_list, completed)
+      if not upload_timings['batched']:
+        for (task_id, stdout, stderr, task_result) in completed:
+          self.SendResponse(task_id, stdout, stderr, task_result)
+    finally:
+      upload_timings['seconds'] = time.time() - start_time
+      self.last_upload_timings_ = upload_timings
+
+  def SendBatchResponse(self, task_list, completed):
+    """Sends results of completed in a single upload.
+
+    Returns:
+      True if MrTaskman answered the upload, False if it should be retried
+      with SendResponse.
+    """
+    task_results_url = self.GetTaskResultsUrl(task_list)
+    if task_results_url:
+      device_sn = device_info.GetDeviceSerialNumber()
+      for (_, _, _, task_result) in completed:
+        task_result['device_serial_number'] = device_sn
+      try:
+        response = self.api_.SendTaskResults(
+            task_results_url,
+            [(stdout, stderr, task_result)
+             for (_, stdout, stderr, task_result) in completed])
+        for result in response.get('results', []):
+          task_id = result['task_id']
+          if result['status'] == 200:
+            logging.info('Successfully sent response for task %s: %s',
+                         task_id, self.api_.MakeTaskUrl(task_id))
+          else:
+            logging.warning('Response for task %s rejected with %d: %s',
+                            task_id, result['status'],
+                            result.get('message', ''))
+        return True
+      except urllib2.HTTPError, error_response:
+        logging.warning('SendTaskResults HTTPError code %d\n%s',
+                        error_response.code, error_response.read())
+      except urllib2.URLError, e:
+        logging.info(
+            'Got URLError trying to send responses to MrTaskman: %s', e)
+    return False
 
   def SendResponse(self, task_id, stdout, stderr, task_result):
+    # TODO(jeff.carollo): Refactor.
+    device_sn = device_info.GetDeviceSerialNumber()
+    task_result['device_serial_number'] = device_sn
+
+    url_attempts = 0
+    send_attempts = 0
+    response_url = None
     while True:
       try:
-        # TODO(jeff.carollo): Refactor.
-        device_sn = device_info.GetDeviceSerialNumber()
-        task_result['device_serial_number'] = device_sn
-
-        response_url = self.api_.GetTaskCompleteUrl(task_id)
-        if not response_url:
-          logging.info('No task complete url for task_id %s', task_id)
-          return
-        response_url = response_url.get('task_complete_url', None)
         if not response_url:
-          logging.info('No task complete url for task_id %s', task_id)
-          return
+          if url_attempts >= MAX_TASK_COMPLETE_URL_ATTEMPTS:
+            logging.warning('Giving up sending response for task %s.',
+                            task_id)
+            return
+          url_attempts += 1
+          response_url = self.GetTaskCompleteUrl(task_id)
+          if not response_url:
+            logging.info('No task complete url for task_id %s', task_id)
+            return
         self.api_.SendTaskResult(response_url, stdout, stderr, task_result)
         logging.info('Successfully sent response for task %s: %s',
                      task_id, self.api_.MakeTaskUrl(task_id))
@@ -140,6 +259,7 @@ class MacOsWorker(object):
         code = error_response.code
         if code == 404:
           logging.warning('TaskCompleteUrl timed out.')
+          response_url = None
           continue
         logging.warning('SendResponse HTTPError code %d\n%s',
                         code, body)
@@ -147,18 +267,31 @@ class MacOsWorker(object):
       except urllib2.URLError, e:
         logging.info(
             'Got URLError trying to send response to MrTaskman: %s', e)
-        logging.info('Retrying in 10 seconds')
-        time.sleep(10)
+        send_attempts += 1
+        if send_attempts >= MAX_SEND_ATTEMPTS:
+          logging.warning('Giving up sending response for task %s.',
+                          task_id)
+          return
+        # Resending is safe, as uploads with the same upload_key are
+        # only stored once.
+        delay = min(10 * 2 ** (send_attempts - 1), MAX_SEND_RETRY_SECONDS)
+        logging.info('Retrying in %d seconds', delay)
+        time.sleep(delay)
         continue
 
   def GetTaskCompleteUrl(self, task_id):
+    """Returns a fresh task complete URL for task_id, or None."""
     try:
-      return self.api_.GetTaskCompleteUrl(task_id)
+      response = self.api_.GetTaskCompleteUrl(task_id)
+      return response.get('task_complete_url', None)
     except urllib2.HTTPError, error_response:
       body = error_response.read()
       code = error_response.code
       logging.warning('GetTaskCompleteUrl HTTPError code %d\n%s',
                       code, body)
+    except urllib2.URLError, e:
+      logging.info('Got URLError trying to reach MrTaskman: %s', e)
+    return None
 
   def ShouldWaitForDevice(self):
     """Returns True iff this worker controls a device which is offline."""
@@ -168,99 +301,115 @@ class MacOsWorker(object):
 
   def PollAndExecute(self):
     logging.info('Polling for work...')
+    self.events_.Add('STARTUP', 'INFO', 'Worker started')
     device_active = True
     while True:
       try:
+        self.events_.MaybeFlush()
         if self.ShouldWaitForDevice():
           if device_active:
             logging.info('Device %s is offline. Waiting for it to come back.',
                          device_info.DEVICE_SN)
+            self.events_.Add('OFFLINE', 'WARNING', 'Device offline',
+                             event_info=device_info.DEVICE_SN)
             device_active = False
           time.sleep(10)
           continue
         if not device_active:
           logging.info('Device came back online.')
+          self.events_.Add('RESUME', 'INFO', 'Device online',
+                           event_info=device_info.DEVICE_SN)
           device_active = True
 
         # TODO(jeff.carollo): Wrap this in a catch-all Excepion handler that
         # allows us to continue executing in the face of various task errors.
-        task = self.AssignTask()
+        task_list = self.AssignTasks()
 
-        if not task:
+        if not task_list:
           time.sleep(10)
           continue
       except KeyboardInterrupt:
         logging.info('Caught CTRL+C. Exiting.')
+        self.events_.Add('SHUTDOWN', 'INFO', 'Worker stopped')
+        self.events_.Flush()
         return
 
-      task_stream = cStringIO.StringIO()
-      task_logs = None
-      self.log_stream_.AddStream(task_stream)
-      try:
-        logging.info('Got a task:\n%s\n', json.dumps(task, 'utf-8', indent=2))
-
-        config = task['config']
-        task_id = int(task['id'])
-        attempt = task['attempts']
-
-        # Figure out which of our executors we can use.
-        executor = None
-        allowed_executors = config['task']['requirements']['executor']
-        for allowed_executor in allowed_executors:
-          try:
-            executor = self.executors_[allowed_executor]
-          except KeyError:
-            pass
-          if executor is not None:
-            break
-
-        if executor is None:
-          # TODO: Send error response to server.
-          # This is probably our fault - we said we could do something
-          # that we actually couldn't do.
-          logging.error('No matching executor from %s', allowed_executors)
-          raise Exception('No allowed executors matched our executors_:\n' +
-                          '%s\nvs.%s\n' % (allowed_executors, self.executors_))
-
-        try:
-          # We've got a valid executor, so use it.
-          (results, stdout, stderr) = executor(task_id, attempt, task, config)
-        except MrTaskmanUnrecoverableHttpError:
-          logging.error(
-              'Unrecoverable MrTaskman HTTP error. Aborting task %d.', task_id)
+      completed = []
+      for task in task_list.get('tasks', []):
+        if self.ShouldWaitForDevice():
+          # Tasks not run time out and are rescheduled.
+          logging.info('Device %s went offline. Not running task %s.',
+                       device_info.DEVICE_SN, task['id'])
           continue
-      finally:
-        self.log_stream_.RemoveStream(task_stream)
-        task_logs = task_stream.getvalue().decode('utf-8')
-        task_stream.close()
+        completed_task = self.RunTask(task)
+        if completed_task:
+          completed.append(completed_task)
+
+      if completed:
+        self.SendResponses(task_list, completed)
+
+      logging.info('Polling for work...')
+      # Loop back up and poll for the next task.
+
+  def RunTask(self, task):
+    """Executes given task, capturing its logs.
+
+    Returns:
+      (task_id, stdout, stderr, task_result) if task ran, or None.
+    """
+    task_stream = cStringIO.StringIO()
+    task_logs = None
+    self.log_stream_.AddStream(task_stream)
+    try:
+      logging.info('Got a task:\n%s\n', json.dumps(task, 'utf-8', indent=2))
+
+      config = task['config']
+      task_id = int(task['id'])
+      attempt = task['attempts']
 
       try:
-        results['worker_log'] = task_logs.encode('utf-8')
-        self.SendResponse(task_id,
-                          stdout,
-                          stderr,
-                          results)
+        # The server only assigns tasks matching our capabilities.
+        (results, stdout, stderr) = self.ExecuteTask(
+            task_id, attempt, task, config)
+        # Read outputs now, as results are sent after the whole batch runs.
+        stdout = stdout.read()
+        stderr = stderr.read()
       except MrTaskmanUnrecoverableHttpError:
         logging.error(
             'Unrecoverable MrTaskman HTTP error. Aborting task %d.', task_id)
+        return None
+    finally:
+      self.log_stream_.RemoveStream(task_stream)
+      task_logs = task_stream.getvalue().decode('utf-8')
+      task_stream.close()
 
-      logging.info('Polling for work...')
-      # Loop back up and poll for the next task.
+    results['worker_log'] = task_logs.encode('utf-8')
+    return (task_id, stdout, stderr, results)
 
   def ExecuteTask(self, task_id, attempt, task, config):
     logging.info('Recieved task %s', task_id)
 
+    # A mrtaskman#worker_timings of this task, so MrTaskman can tell slow
+    # hosts and slow packages apart.
+    timings = {
+      'kind': 'mrtaskman#worker_timings',
+      'phases': {},
+    }
     try:
       tmpdir = package_installer.TmpDir()
 
       # Download the files we need from the server.
       files = config.get('files', [])
+      phase_start_time = time.time()
       self.DownloadAndStageFiles(files)
+      timings['phases']['stage_files'] = time.time() - phase_start_time
 
       # Install any packages we might need.
       # TODO(jeff.carollo): Handle any exceptions raised here.
       packages = config.get('packages', [])
-      self.DownloadAndInstallPackages(packages, tmpdir)
+      phase_start_time = time.time()
+      timings['packages'] = self.DownloadAndInstallPackages(packages, tmpdir)
+      timings['phases']['packages'] = time.time() - phase_start_time
 
       # We probably don't want to run forever. Default to 12 minutes.
       timeout = config['task'].get('timeout', '12m')
@@ -279,6 +428,10 @@ class MacOsWorker(object):
               command, env, timeout, tmpdir.GetTmpDir()))
 
       logging.info('Executed %s with result %d', command, exit_code)
+      timings['phases']['command'] = execution_time.total_seconds()
+      # A result cannot carry timings of its own upload.
+      if self.last_upload_timings_:
+        timings['upload'] = self.last_upload_timings_
 
       results = {
         'kind': 'mrtaskman#task_complete_request',
@@ -286,7 +439,10 @@ class MacOsWorker(object):
         'attempt': attempt,
         'exit_code': exit_code,
         'execution_time': execution_time.total_seconds(),
-        'result_metadata': result_metadata
+        'result_metadata': result_metadata,
+        # Lets MrTaskman acknowledge retried uploads of this result.
+        'upload_key': uuid.uuid4().hex,
+        'worker_timings': timings,
       }
       return (results, stdout, stderr)
     finally:
@@ -348,20 +504,34 @@ class MacOsWorker(object):
     # TODO: Stage files.
 
   def DownloadAndInstallPackages(self, packages, tmpdir):
-    # TODO(jeff.carollo): Create a package cache if things take off.
+    """Installs packages into tmpdir, from the package cache if enabled.
+
+    Returns:
+      List of dicts, one per package, with its 'name', 'version', total
+      'seconds' including retries, 'attempts', 'download_seconds' and
+      downloaded 'bytes'. Packages installed through the cache also have
+      'cache_hit', 'copy_seconds' and 'wait_seconds'.
+    """
+    package_timings = []
     for package in packages:
       attempts = 0
+      start_time = time.time()
       while True:
         try:
-          # TODO(jeff.carollo): Put package cache code here.
+          attempts += 1
           if self.use_cache_:
-            self.package_cache_.CopyToDirectory(
+            package_timing = self.package_cache_.CopyToDirectory(
                 package, tmpdir.GetTmpDir(),
                 package_installer.DownloadAndInstallPackage)
           else:
-            package_installer.DownloadAndInstallPackage(
+            download_start_time = time.time()
+            num_bytes = package_installer.DownloadAndInstallPackage(
                 package['name'], package['version'],
                 tmpdir.GetTmpDir())
+            package_timing = {
+              'download_seconds': time.time() - download_start_time,
+              'bytes': num_bytes,
+            }
           break
         except urllib2.HTTPError, e:
           logging.error('Got HTTPError %d trying to grab package %s.%s: %s',
@@ -372,7 +542,6 @@ class MacOsWorker(object):
           logging.error('Got URLError trying to grab package %s.%s: %s',
               package['name'], package['version'], e)
           logging.info('Retrying in 10')
-          attempts += 1
           # TODO(jeff.carollo): Figure out a robust way to do this.
           # Likely need to just try a few times to get around Internet blips
           # then mark task as failed for package reasons.
@@ -386,6 +555,12 @@ class MacOsWorker(object):
           logging.error('Got IOError trying to grab package %s.%s: %s',
               package['name'], package['version'], e)
           raise MrTaskmanUnrecoverableHttpError(e)
+      package_timing['name'] = package['name']
+      package_timing['version'] = package['version']
+      package_timing['attempts'] = attempts
+      package_timing['seconds'] = time.time() - start_time
+      package_timings.append(package_timing)
+    return package_timings
 
 
 def main(argv):